@@ -0,0 +1,74 @@
+"""
+Helpers to run the bundled examples for benchmarking.
+The examples are executed as they are, but the call to
+savefig at the end is intercepted so that the images in
+examples/ are not overwritten.
+
+"""
+import runpy
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+from matplotlib.figure import Figure
+
+EXAMPLES_DIR = Path(__file__).parents[1].joinpath("examples")
+EXAMPLES = ["spin_echo", "cross_polarization", "hsqcetgpsi"]
+
+
+@contextmanager
+def intercept_savefig():
+    """
+    Collects (figure, savefig keywords) instead of saving
+
+    """
+    saved = []
+    savefig = Figure.savefig
+    Figure.savefig = lambda fig, *args, **kwargs: saved.append((fig, kwargs))
+
+    try:
+        yield saved
+    finally:
+        Figure.savefig = savefig
+
+
+def build(name):
+    """
+    Runs an example and returns the figure and the
+    keywords it would have been saved with
+
+    """
+    with intercept_savefig() as saved:
+        runpy.run_path(str(EXAMPLES_DIR.joinpath(f"{name}.py")))
+
+    fig, kwargs = saved[-1]
+    kwargs.pop("fname", None)
+
+    return fig, kwargs
+
+
+def timeit(func, repeat=5):
+    """
+    Best time out of `repeat` calls, in seconds
+
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+
+    return best
+
+
+def savefig_time(fig, fmt="png", repeat=5, **kwargs):
+    """
+    Best time to save the figure to memory in the given format
+
+    """
+    return timeit(lambda: fig.savefig(BytesIO(), format=fmt, **kwargs), repeat)
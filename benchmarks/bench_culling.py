@@ -0,0 +1,61 @@
+"""
+Redraw times for a long sequence, zoomed out and zoomed
+in, with and without culling (PulseProgram.culling)
+
+    python benchmarks/bench_culling.py [number of elements]
+
+"""
+import sys
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import pulseplot as pplot
+from pulseplot import PulseSeq
+
+from _examples import timeit
+
+
+def long_sequence(n):
+    block = [
+        r"p1 pl1 f1 fck ph1",
+        r"d2 f1",
+        r"p2 pl1 f1 ph2",
+        r"p1 pl0.5 sp=grad fc=grey f0 w",
+        r"d2 f1",
+    ]
+
+    return PulseSeq([block[i % len(block)] for i in range(n)])
+
+
+def main(n=100_000):
+
+    t0 = time.perf_counter()
+    seq = long_sequence(n)
+    print(f"parsed {n} elements in {time.perf_counter() - t0:.1f} s")
+
+    fig, ax = pplot.subplots(figsize=(10, 3))
+    t0 = time.perf_counter()
+    ax.pseq(seq)
+    print(f"built axes in {time.perf_counter() - t0:.1f} s\n")
+
+    xlow, xhigh = ax.get_xlim()
+    views = {
+        "zoomed out": (xlow, xhigh),
+        "zoomed in": (xlow, xlow + 50),
+    }
+
+    print(f"{'view':<14}{'culling':<10}{'redraw (ms)':>12}  stats")
+    for view, xlim in views.items():
+        ax.set_xlim(*xlim)
+        for culling in [False, True]:
+            ax.culling = culling
+            ax.draw_stats = {}
+            redraw = timeit(fig.canvas.draw, repeat=3)
+            print(f"{view:<14}{str(culling):<10}{1e3 * redraw:>12.0f}  {ax.draw_stats}")
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:]])
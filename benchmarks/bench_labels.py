@@ -0,0 +1,46 @@
+"""
+Time savefig for the bundled examples with labels drawn as
+Text artists and from the cached label layouts
+(PulseProgram.cache_labels)
+
+    python benchmarks/bench_labels.py
+
+"""
+import pulseplot as pplot
+from pulseplot.artists import LABEL_CACHE
+
+from _examples import EXAMPLES, build, savefig_time
+
+FORMATS = ["png", "svg", "pdf"]
+
+
+def main():
+    print(
+        f"{'example':<20}{'format':<8}{'text (ms)':>12}"
+        f"{'cached (ms)':>14}{'speedup':>10}"
+    )
+
+    for name in EXAMPLES:
+        times = {}
+        for cached in [False, True]:
+            pplot.PulseProgram.cache_labels = cached
+            fig, kwargs = build(name)
+            for fmt in FORMATS:
+                times[cached, fmt] = savefig_time(fig, fmt, **kwargs)
+
+        for fmt in FORMATS:
+            text, cached = times[False, fmt], times[True, fmt]
+            print(
+                f"{name:<20}{fmt:<8}{1e3 * text:>12.1f}{1e3 * cached:>14.1f}"
+                f"{text / cached:>9.2f}x"
+            )
+
+    pplot.PulseProgram.cache_labels = False
+    print(
+        f"\nlabel cache: {len(LABEL_CACHE)} layouts, "
+        f"{LABEL_CACHE.hits} hits, {LABEL_CACHE.misses} misses"
+    )
+
+
+if __name__ == "__main__":
+    main()
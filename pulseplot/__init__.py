@@ -1,2 +1,63 @@
-from .pulseplot import *
-from .parse import *
+"""
+pulseplot: pulse-timing diagrams with matplotlib
+
+The plotting (pulseplot.pulseplot), parsing (pulseplot.parse),
+rendering (pulseplot.render, pulseplot.mosaic), timeline
+(pulseplot.timeline) and phase cycle (pulseplot.cycle) modules are
+imported when one of their names is first used, so that modules
+which do not need matplotlib (such as pulseplot.cache) can be
+imported quickly.
+
+"""
+
+from importlib import import_module
+
+_EXPORTS = {
+    "pulseplot": [
+        "subplots",
+        "subplot_mosaic",
+        "show",
+        "animation",
+        "register_projection",
+        "PulseProgram",
+        "ElementIndex",
+    ],
+    "parse": [
+        "PULSE_DEFAULTS",
+        "TEXT_DEFAULTS",
+        "OutlineCache",
+        "OUTLINES",
+        "SHAPES",
+        "register_shape",
+        "PAR",
+        "PARAMS",
+        "PATTERN",
+        "parse_base",
+        "parse_anchor",
+        "Pulse",
+        "Delay",
+        "PulseSeq",
+        "Shape",
+    ],
+    "render": ["render_async", "render_many"],
+    "mosaic": ["render_mosaic"],
+    "timeline": ["Timeline", "Selection"],
+    "cycle": ["PhaseCycle", "ScanView", "show_scan"],
+}
+
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(name):
+    try:
+        module = import_module(f".{_MODULES[name]}", __name__)
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    return getattr(module, name)
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
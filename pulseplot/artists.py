@@ -0,0 +1,383 @@
+"""
+Artists used by the PulseProgram projection
+
+"""
+
+from collections import OrderedDict
+from copy import copy
+
+import numpy as np
+from matplotlib import artist, cbook, rcParams
+from matplotlib.font_manager import FontProperties
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
+from matplotlib.textpath import TextPath, text_to_path
+from matplotlib.transforms import Affine2D, Bbox, IdentityTransform, ScaledTranslation
+
+
+def outline_path(element, npoints=None, **sampling):
+    """
+    Makes a (read-only) path for the outline of a pulse relative
+    to its origin, with npoints points on the shape. Any other
+    arguments are passed on to Pulse.local_vertices.
+
+    """
+    vertices = element.local_vertices(npoints, **sampling)
+
+    if element.open:
+        return Path(vertices, readonly=True)
+
+    closed = np.vstack([vertices, vertices[:1]])
+
+    return Path(closed, closed=True, readonly=True)
+
+
+def count_corners(vertices):
+    """
+    Counts the vertices that an outline cannot leave out: its ends,
+    and the vertices at which it changes direction (5 for a rectangle,
+    which ends where it starts, and about the number of points on a
+    shape)
+
+    """
+    steps = np.diff(vertices, axis=0)
+    steps = steps[np.any(steps != 0, axis=1)]
+
+    if len(steps) < 2:
+        return len(steps) + 1
+
+    before, after = steps[:-1], steps[1:]
+    cross = before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0]
+    scale = np.hypot(*before.T) * np.hypot(*after.T)
+
+    return int(np.count_nonzero(np.abs(cross) > 1e-9 * scale)) + 2
+
+
+def output_path(path, transform, digits):
+    """
+    Transforms a path to output coordinates (points in svg and pdf,
+    pixels otherwise), leaves out the vertices that make no visible
+    difference there (with the path simplification of matplotlib)
+    and rounds the others to the given number of decimals
+
+    """
+    cleaned = path.cleaned(transform, simplify=True)
+    vertices, codes = cleaned.vertices, cleaned.codes
+
+    # the path ends with a STOP
+    if codes is not None and len(codes) and codes[-1] == Path.STOP:
+        vertices, codes = vertices[:-1], codes[:-1]
+
+    vertices = np.round(vertices, digits)
+
+    keep = np.ones(len(vertices), dtype=bool)
+    keep[1:] = np.any(vertices[1:] != vertices[:-1], axis=1)
+
+    if codes is None:
+        return Path(vertices[keep])
+
+    keep |= codes != Path.LINETO
+    vertices, codes = vertices[keep], codes[keep].copy()
+
+    if path.codes is not None and path.codes[-1] == Path.CLOSEPOLY:
+        codes[-1] = Path.CLOSEPOLY
+
+    return Path(vertices, codes)
+
+
+class ElementPatch(PathPatch):
+    """
+    Patch for a pulse (or a delay) that builds its outline only when
+    the outline is needed, normally when it is drawn. The patch holds
+    a copy of the element as it was when it was added, and its slot,
+    i.e. the position of its origin in data coordinates.
+
+    With adaptive set, the number of points on the shape follows the
+    width of the pulse on the output (in pixels), up to the npoints
+    of the element.
+
+    If the axes has vector_digits set, the outline is simplified and
+    rounded to that many decimals on the output (see output_path).
+
+    phase_label is the artist of the phase label of the element, once
+    the element is drawn on a PulseProgram (None if it has no phase).
+
+    """
+
+    phase_label = None
+
+    def __init__(self, element, slot, adaptive=False, **kwargs):
+
+        self.element = copy(element)
+        self.slot = slot
+        self.adaptive = adaptive
+
+        super().__init__(None, **kwargs)
+
+    def get_path(self):
+        if self._path is None:
+            self._path = self._get_outline(None)
+
+        return self._path
+
+    def _get_outline(self, npoints):
+        try:
+            return self.axes.shared_path(self.element, npoints)
+        except AttributeError:
+            return outline_path(self.element, npoints)
+
+    def resolution(self):
+        """
+        Number of points needed on the shape to resolve
+        the pulse at the current size on the output
+
+        """
+        (x0, _), (x1, _) = self.get_transform().transform(
+            [(0, 0), (self.element.plen, 0)]
+        )
+
+        return int(np.clip(np.ceil(abs(x1 - x0)), 2, self.element.npoints))
+
+    @artist.allow_rasterization
+    def draw(self, renderer):
+
+        if self.adaptive:
+            self._path = self._get_outline(self.resolution())
+
+        digits = getattr(self.axes, "vector_digits", None)
+
+        if digits is None:
+            super().draw(renderer)
+            return
+
+        path, transform = self.get_path(), self._transform
+        self._path = output_path(path, self.get_transform(), digits)
+        self._transform = IdentityTransform()
+
+        try:
+            super().draw(renderer)
+        finally:
+            self._path, self._transform = path, transform
+
+
+# text keywords that a cached label knows how to handle
+LABEL_KEYWORDS = {
+    "x",
+    "y",
+    "s",
+    "fontsize",
+    "size",
+    "ha",
+    "horizontalalignment",
+    "va",
+    "verticalalignment",
+    "color",
+    "c",
+    "alpha",
+    "zorder",
+    "family",
+    "fontfamily",
+    "weight",
+    "fontweight",
+    "style",
+    "fontstyle",
+}
+
+
+class LabelLayout(object):
+    """
+    A laid out label: the outline of the text in points, with the
+    baseline starting at the origin, and the line metrics that
+    matplotlib.text.Text uses to align it.
+
+    """
+
+    def __init__(self, s, prop):
+
+        ismath = cbook.is_math_text(s)
+
+        self.text = s
+        self.path = TextPath((0, 0), s, prop=prop)
+        width, height, descent = text_to_path.get_text_width_height_descent(
+            s, prop, ismath
+        )
+
+        # same minimum line height as matplotlib.text.Text
+        _, lp_height, lp_descent = text_to_path.get_text_width_height_descent(
+            "lp", prop, False
+        )
+
+        self.width = width
+        self.height = max(height, lp_height)
+        self.descent = max(descent, lp_descent)
+
+    def anchor(self, ha="center", va="center"):
+        """
+        Gets the point of the layout (in points) that is
+        placed at the (x, y) position of the label
+
+        """
+        dx = {"left": 0.0, "center": self.width / 2, "right": self.width}[ha]
+
+        dy = {
+            "baseline": 0.0,
+            "bottom": -self.descent,
+            "center": self.height / 2 - self.descent,
+            "top": self.height - self.descent,
+        }[va]
+
+        return dx, dy
+
+
+class LabelCache(object):
+    """
+    Least-recently used cache of laid out labels, keyed
+    by the string and the font properties (which include
+    the fontsize)
+
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._layouts = OrderedDict()
+
+    def get(self, s, prop):
+        """
+        Gets the layout for the string s with the given font properties
+
+        """
+        key = (s, prop)
+
+        try:
+            layout = self._layouts[key]
+            self._layouts.move_to_end(key)
+            self.hits += 1
+            return layout
+
+        except KeyError:
+            pass
+
+        self.misses += 1
+        layout = LabelLayout(s, prop)
+        self._layouts[key] = layout
+
+        if len(self._layouts) > self.maxsize:
+            self._layouts.popitem(last=False)
+
+        return layout
+
+    def clear(self):
+        self._layouts.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._layouts)
+
+
+LABEL_CACHE = LabelCache()
+
+
+class LabelPatch(PathPatch):
+    """
+    A text label drawn from a cached layout. The outline of the
+    text is shared between all labels with the same string and
+    font, and each label only carries its own position.
+
+    """
+
+    def __init__(self, x, y, layout, ha="center", va="center", **kwargs):
+
+        self._xy = (x, y)
+        self.layout = layout
+        self._anchor = layout.anchor(ha, va)
+
+        super().__init__(layout.path, **kwargs)
+
+    def get_position(self):
+        return self._xy
+
+    def set_position(self, xy):
+        self._xy = tuple(xy)
+        self._update_transform()
+
+    def get_text(self):
+        return self.layout.text
+
+    def get_window_extent(self, renderer=None):
+        """
+        Extent of the line box of the text in display coordinates,
+        the same box that matplotlib.text.Text uses for layout
+
+        """
+        layout = self.layout
+        box = Bbox.from_extents(
+            0, -layout.descent, layout.width, layout.height - layout.descent
+        )
+
+        return box.transformed(self.get_transform())
+
+    def set_axes_transform(self, ax):
+        """
+        Places the label in data coordinates of the given axes
+
+        """
+        self._ax = ax
+        self._update_transform()
+
+    def _update_transform(self):
+        ax = self._ax
+        dx, dy = self._anchor
+        self.set_transform(
+            Affine2D().translate(-dx, -dy).scale(1 / 72.0)
+            + ax.figure.dpi_scale_trans
+            + ScaledTranslation(*self._xy, ax.transData)
+        )
+
+
+def cached_label(ax, cache=LABEL_CACHE, **params):
+    """
+    Makes a LabelPatch for the keyword arguments that would be passed
+    to ax.text. Returns None if the arguments include something
+    that a cached label cannot handle.
+
+    """
+    if not isinstance(params.get("s"), str) or not params["s"]:
+        return None
+
+    if not set(params).issubset(LABEL_KEYWORDS):
+        return None
+
+    get = params.get
+
+    prop = FontProperties(
+        family=get("fontfamily", get("family")),
+        style=get("fontstyle", get("style")),
+        weight=get("fontweight", get("weight")),
+        size=get("fontsize", get("size")),
+    )
+
+    layout = cache.get(params["s"], prop)
+
+    try:
+        label = LabelPatch(
+            params["x"],
+            params["y"],
+            layout,
+            ha=get("horizontalalignment", get("ha", "left")),
+            va=get("verticalalignment", get("va", "baseline")),
+            facecolor=get("color", get("c", rcParams["text.color"])),
+            edgecolor="none",
+            linewidth=0,
+            alpha=get("alpha"),
+            zorder=get("zorder", 3),
+            clip_on=False,
+        )
+    except KeyError:
+        return None
+
+    label.set_axes_transform(ax)
+
+    return label
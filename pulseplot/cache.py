@@ -0,0 +1,271 @@
+"""
+Content-addressed cache of rendered sequences on disk
+
+Renders are stored under a key that is a hash of everything that
+changes the output: the (normalized) sequence, the external
+parameters, the PulseProgram settings, the format, the dpi and the
+versions of pulseplot and matplotlib. Nothing here imports
+matplotlib.pyplot, and a cache hit does not draw anything.
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from importlib import metadata
+from pathlib import Path
+
+# bump this when the output of a render changes for the same input
+CACHE_VERSION = 1
+
+DEFAULT_MAXSIZE = 512 * 2 ** 20
+
+
+def _version(package):
+    try:
+        return metadata.version(package)
+    except Exception:
+        return None
+
+
+def default_path():
+    """
+    Directory used for the cache when none is given: $PULSEPLOT_CACHE,
+    or pulseplot/ in $XDG_CACHE_HOME (~/.cache by default)
+
+    """
+    if os.environ.get("PULSEPLOT_CACHE"):
+        return Path(os.environ["PULSEPLOT_CACHE"])
+
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache")
+
+    return Path(base).joinpath("pulseplot")
+
+
+def normalize(sequence):
+    """
+    Makes a stable representation of a sequence for hashing.
+
+    Strings are reduced to the lines that PulseSeq reads, without
+    comments and with single spaces between the parameters. PulseSeq
+    objects are represented by the parsed parameters of their
+    elements (as they are pickled, so registered shapes are given by
+    name), without the input strings they were parsed from.
+
+    """
+    if isinstance(sequence, str):
+        lines = (line.split("#")[0] for line in sequence.split("\n"))
+        return "\n".join(" ".join(line.split()) for line in lines if line.strip())
+
+    elements = getattr(sequence, "elements", sequence)
+
+    return [
+        [
+            type(element).__name__,
+            sorted((k, v) for k, v in _state(element).items() if k != "args"),
+        ]
+        for element in elements
+    ]
+
+
+def _state(element):
+    try:
+        return element.__getstate__()
+    except Exception:
+        return vars(element)
+
+
+def cache_key(sequence, params=None, fmt="png", dpi=150, **options):
+    """
+    Hash (hex string) of a render of sequence. The options are any other
+    keywords that are passed on to the renderer: settings of the
+    PulseProgram, the figure size, channels, etc.
+
+    """
+    content = {
+        "cache": CACHE_VERSION,
+        "pulseplot": _version("pulseplot"),
+        "matplotlib": _version("matplotlib"),
+        "sequence": normalize(sequence),
+        "params": params or {},
+        "format": fmt,
+        "dpi": dpi,
+        "options": options,
+    }
+
+    encoded = json.dumps(content, sort_keys=True, default=repr).encode()
+
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class RenderCache(object):
+    """
+    Renders stored as files in a directory, at most maxsize bytes in
+    total. Entries that have not been used for the longest time are
+    removed first when the cache grows above maxsize.
+
+    Entries are written to a temporary file and moved into place, so
+    several processes can share one cache directory: a reader sees
+    either a complete entry or none at all.
+
+    """
+
+    def __init__(self, path=None, maxsize=DEFAULT_MAXSIZE):
+        self.path = Path(path) if path is not None else default_path()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def entry(self, key):
+        """
+        File where the entry for key is stored
+
+        """
+        return self.path.joinpath(key[:2], key)
+
+    def get(self, key):
+        """
+        Gets the stored bytes for key, or None
+
+        """
+        entry = self.entry(key)
+
+        try:
+            data = entry.read_bytes()
+        except OSError:
+            self.misses += 1
+            return None
+
+        self._touch(entry)
+        self.hits += 1
+
+        return data
+
+    def copy(self, key, destination):
+        """
+        Copies the entry for key to the destination file.
+        Returns False if there is no such entry.
+
+        """
+        entry = self.entry(key)
+
+        try:
+            shutil.copyfile(entry, destination)
+        except FileNotFoundError:
+            if not entry.exists():
+                self.misses += 1
+                return False
+            raise
+
+        self._touch(entry)
+        self.hits += 1
+
+        return True
+
+    def put(self, key, data):
+        """
+        Stores data for key, then evicts old entries if needed
+
+        """
+        entry = self.entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, temporary = tempfile.mkstemp(dir=entry.parent, prefix=".", suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temporary, entry)
+
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+
+        self.evict()
+
+    def entries(self):
+        """
+        Lists (last use, size, file) for all complete entries
+
+        """
+        found = []
+
+        for entry in self.path.glob("??/*"):
+            if entry.name.startswith("."):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime, stat.st_size, entry))
+
+        return found
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, maxsize=None):
+        """
+        Removes the least recently used entries until the total
+        size is at most maxsize (by default, self.maxsize)
+
+        """
+        if maxsize is None:
+            maxsize = self.maxsize
+
+        found = sorted(self.entries(), key=lambda item: item[0])
+        total = sum(size for _, size, _ in found)
+
+        for _, size, entry in found:
+            if total <= maxsize:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        self.evict(maxsize=0)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries())
+
+    @staticmethod
+    def _touch(entry):
+        # the modification time records the last use
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+
+def cached_render(sequence, params=None, fmt="png", dpi=150, cache=None, **kwargs):
+    """
+    Same as pulseplot.render.render, but returns stored bytes
+    if the same render is in the cache (a RenderCache, or the
+    default one if None), and stores new renders there.
+
+    """
+    if cache is None:
+        cache = RenderCache()
+
+    options = {k: v for k, v in kwargs.items() if k != "fig"}
+    key = cache_key(sequence, params, fmt, dpi, **options)
+
+    data = cache.get(key)
+
+    if data is None:
+        from .render import render
+
+        data = render(sequence, params=params, fmt=fmt, dpi=dpi, **kwargs)
+        cache.put(key, data)
+
+    return data
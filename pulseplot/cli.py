@@ -0,0 +1,644 @@
+"""
+Command line interface
+
+    pulseplot render sequences/*.seq --params params.json -f png -f svg
+    pulseplot render sequences/*.seq --params params.json --pdf library.pdf
+    pulseplot lint sequences/*.seq --params params.json
+    pulseplot watch sequence.seq -o sequence.png
+
+"""
+
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# figure reused by all renders in a worker process
+_FIGURE = None
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise RenderTimeout("rendering timed out")
+
+
+def _init_worker(figsize, layout):
+    """
+    Makes the figure that the worker reuses for every file, and draws
+    a small sequence once so that fonts and mathtext are loaded
+
+    """
+    global _FIGURE
+
+    from .render import draw_sequence, new_figure
+
+    _FIGURE = new_figure(figsize=figsize, layout=layout)
+    draw_sequence(_FIGURE, r"p1 ph1 tx=$\tau$")
+    _FIGURE.canvas.draw()
+
+
+def _render_file(path, outputs, params, channels, settings, dpi, timeout, cache=None):
+    """
+    Renders one sequence file to one or more output files. Returns
+    (path, error, elapsed time), where error is None on success.
+
+    With a cache (a RenderCache), outputs that are in the cache are
+    copied from it, and the sequence is drawn only if some are not.
+
+    """
+    from .render import draw_sequence, export
+
+    t0 = time.perf_counter()
+
+    # signals can only be used in the main thread
+    use_alarm = (
+        timeout
+        and hasattr(signal, "setitimer")
+        and threading.current_thread() is threading.main_thread()
+    )
+
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+
+    try:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+
+        sequence = Path(path).read_text()
+
+        if cache is None:
+            draw_sequence(_FIGURE, sequence, params, channels, **settings)
+            export(_FIGURE, outputs, dpi=dpi)
+
+        else:
+            _render_cached(sequence, outputs, params, channels, settings, dpi, cache)
+
+        error = None
+
+    except RenderTimeout:
+        error = f"timed out after {timeout} s"
+
+    except Exception as e:
+        error = "".join(traceback.format_exception_only(type(e), e)).strip()
+
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+    return path, error, time.perf_counter() - t0
+
+
+def _render_cached(sequence, outputs, params, channels, settings, dpi, cache):
+
+    from .cache import cache_key
+    from .render import draw_sequence, save_many
+
+    options = {
+        "channels": channels,
+        "figsize": tuple(_FIGURE.get_size_inches()),
+        "layout": type(_FIGURE.get_layout_engine()).__name__,
+        **settings,
+    }
+
+    missing = []
+    for output in outputs:
+        fmt = Path(output).suffix[1:]
+        key = cache_key(sequence, params, fmt, dpi, **options)
+        if not cache.copy(key, output):
+            missing.append((output, fmt, key))
+
+    if not missing:
+        return
+
+    draw_sequence(_FIGURE, sequence, params, channels, **settings)
+    datas = save_many(_FIGURE, [fmt for _, fmt, _ in missing], dpi=dpi)
+
+    for (output, fmt, key), data in zip(missing, datas):
+        Path(output).write_bytes(data)
+        cache.put(key, data)
+
+
+def expand(patterns):
+    """
+    Expands glob patterns (with ** for recursion) into a sorted list
+    of files. Returns the files and the patterns that did not match.
+
+    """
+    files, unmatched = set(), []
+
+    for pattern in patterns:
+        matches = [f for f in glob.glob(pattern, recursive=True) if os.path.isfile(f)]
+        if matches:
+            files.update(matches)
+        else:
+            unmatched.append(pattern)
+
+    return sorted(files), unmatched
+
+
+def load_params(path):
+    """
+    Reads external parameters from a JSON file
+
+    """
+    if path is None:
+        return {}
+
+    with open(path) as f:
+        params = json.load(f)
+
+    if not isinstance(params, dict):
+        raise ValueError(f"{path} should contain a JSON object")
+
+    return params
+
+
+def _channel(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def render_command(args):
+    """
+    pulseplot render: draws sequence files to image files
+
+    """
+    files, unmatched = expand(args.files)
+
+    try:
+        params = load_params(args.params)
+    except (OSError, ValueError) as e:
+        print(f"pulseplot: cannot read parameters: {e}", file=sys.stderr)
+        return 2
+
+    settings = {
+        "spacing": args.spacing,
+        "phase_dy": args.phase_dy,
+        "text_dy": args.text_dy,
+        "fontsize": args.fontsize,
+        "center_align": args.center_align,
+    }
+    formats = args.format or ["png"]
+    channels = [_channel(c) for c in args.channels or []]
+
+    cache = None
+    if args.cache is not None:
+        from .cache import RenderCache
+
+        cache = RenderCache(args.cache or None, maxsize=args.cache_size * 2 ** 20)
+
+    errors = {pattern: "no files match this pattern" for pattern in unmatched}
+
+    if args.pdf:
+        _render_pdf(files, args.pdf, params, channels, settings, args, errors)
+        return _report_errors(errors)
+
+    tasks = []
+    written = {}
+    for path in files:
+        outdir = Path(args.outdir) if args.outdir else Path(path).parent
+        outputs = [str(outdir.joinpath(f"{Path(path).stem}.{fmt}")) for fmt in formats]
+
+        # files with the same name (from different directories, with -o)
+        # would overwrite each other's images
+        first = written.get(outputs[0])
+        if first is not None:
+            errors[path] = f"has the same output as {first} ({outputs[0]})"
+            continue
+
+        written[outputs[0]] = path
+        outdir.mkdir(parents=True, exist_ok=True)
+        tasks.append(
+            (path, outputs, params, channels, settings, args.dpi, args.timeout, cache)
+        )
+
+    initargs = (tuple(args.figsize), args.layout)
+
+    def report(i, path, error, elapsed):
+        if args.quiet and error is None:
+            return
+        status = "ok" if error is None else f"FAILED ({error})"
+        print(
+            f"[{i}/{len(tasks)}] {path}: {status} in {elapsed:.2f} s", file=sys.stderr
+        )
+
+    if args.jobs == 1 or len(tasks) <= 1:
+        _init_worker(*initargs)
+        for i, task in enumerate(tasks, start=1):
+            path, error, elapsed = _render_file(*task)
+            report(i, path, error, elapsed)
+            if error is not None:
+                errors[path] = error
+
+    elif tasks:
+        with ProcessPoolExecutor(
+            max_workers=args.jobs, initializer=_init_worker, initargs=initargs
+        ) as pool:
+            futures = [pool.submit(_render_file, *task) for task in tasks]
+            for i, future in enumerate(as_completed(futures), start=1):
+                path, error, elapsed = future.result()
+                report(i, path, error, elapsed)
+                if error is not None:
+                    errors[path] = error
+
+    return _report_errors(errors)
+
+
+def _render_pdf(files, output, params, channels, settings, args, errors):
+    """
+    Draws all files into one PDF, one file on each page, with the
+    name of the file above it
+
+    """
+    from .render import save_pdf
+
+    sequences = {}
+    for path in files:
+        try:
+            sequences[path] = Path(path).read_text()
+        except OSError as e:
+            errors[path] = str(e)
+
+    def failed(path, e):
+        errors[path] = "".join(traceback.format_exception_only(type(e), e)).strip()
+
+    t0 = time.perf_counter()
+    pages = save_pdf(
+        sequences,
+        output,
+        params,
+        figsize=tuple(args.figsize),
+        layout=args.layout,
+        channels=channels,
+        on_error=failed,
+        **settings,
+    )
+
+    if not args.quiet:
+        print(
+            f"{output}: {pages} page(s) in {time.perf_counter() - t0:.2f} s",
+            file=sys.stderr,
+        )
+
+
+def _report_errors(errors):
+
+    if errors:
+        print(f"\n{len(errors)} error(s):", file=sys.stderr)
+        for path, error in errors.items():
+            print(f"  {path}: {error}", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+def lint_command(args):
+    """
+    pulseplot lint: checks sequence files for errors without drawing them
+
+    """
+    from .lint import ERROR, format_json, format_text, lint_file
+
+    files, unmatched = expand(args.files)
+
+    try:
+        params = load_params(args.params)
+    except (OSError, ValueError) as e:
+        print(f"pulseplot: cannot read parameters: {e}", file=sys.stderr)
+        return 2
+
+    # named values are only checked against a parameters file
+    if args.params is None:
+        params = None
+
+    if args.jobs == 1 or len(files) <= 1:
+        results = [lint_file(path, params) for path in files]
+
+    else:
+        # files are small, so send them to the workers in batches
+        chunksize = max(1, len(files) // (4 * args.jobs))
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(
+                pool.map(lint_file, files, [params] * len(files), chunksize=chunksize)
+            )
+
+    if args.format == "json":
+        print(format_json(results))
+    else:
+        for path, diagnostics in results:
+            sys.stdout.write(format_text(path, diagnostics))
+
+    for pattern in unmatched:
+        print(f"pulseplot: no files match {pattern}", file=sys.stderr)
+
+    severities = [d.severity for _, diagnostics in results for d in diagnostics]
+    errors = severities.count(ERROR)
+    warnings = len(severities) - errors
+
+    if not args.quiet:
+        print(
+            f"{len(files)} file(s) checked: {errors} error(s), {warnings} warning(s)",
+            file=sys.stderr,
+        )
+
+    if errors or unmatched or (args.strict and warnings):
+        return 1
+
+    return 0
+
+
+def watch_command(args):
+    """
+    pulseplot watch: draws a sequence file to an image again
+    whenever it changes, until interrupted
+
+    """
+    from .watch import watch_to
+
+    try:
+        params = load_params(args.params)
+    except (OSError, ValueError) as e:
+        print(f"pulseplot: cannot read parameters: {e}", file=sys.stderr)
+        return 2
+
+    def report(message):
+        print(f"pulseplot: {message}", file=sys.stderr)
+
+    try:
+        watch_to(
+            args.file,
+            args.output,
+            params=params,
+            interval=args.interval,
+            dpi=args.dpi,
+            report=report,
+            figsize=tuple(args.figsize),
+        )
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def serve_command(args):
+    """
+    pulseplot serve: runs the render server until interrupted
+
+    """
+    import asyncio
+
+    from .server import RenderServer
+
+    server = RenderServer(
+        workers=args.jobs,
+        max_renders=args.max_renders,
+        max_queue=args.max_queue,
+        timeout=args.timeout,
+        cache_size=int(args.cache_size * 2 ** 20),
+        figsize=tuple(args.figsize),
+        layout=args.layout,
+        shape_dir=args.shape_dir,
+        max_elements=args.max_elements,
+        max_npoints=args.max_npoints,
+    )
+
+    where = args.socket or f"http://{args.host}:{args.port}"
+    print(f"pulseplot: serving on {where} with {args.jobs} workers", file=sys.stderr)
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, path=args.socket))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def get_parser():
+
+    parser = argparse.ArgumentParser(
+        prog="pulseplot", description="Draw pulse-timing diagrams"
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    render = commands.add_parser(
+        "render",
+        help="render sequence files to images",
+        description="Render sequence files to PNG/SVG/PDF files using a pool of "
+        "worker processes. Each file contains a sequence in the same format "
+        "as ax.pseq takes.",
+    )
+    render.add_argument("files", nargs="+", help="sequence files or glob patterns")
+    render.add_argument("-p", "--params", help="JSON file with external parameters")
+    render.add_argument(
+        "-o", "--outdir", help="output directory (default: next to each file)"
+    )
+    render.add_argument(
+        "-f",
+        "--format",
+        action="append",
+        choices=["png", "svg", "pdf"],
+        help="output format, can be given more than once (default: png)",
+    )
+    render.add_argument(
+        "--pdf",
+        metavar="FILE",
+        help="draw all files into this PDF, one on each page, instead of "
+        "one output for each file",
+    )
+    render.add_argument("--dpi", type=float, default=150)
+    render.add_argument(
+        "--figsize", type=float, nargs=2, default=(8, 2.5), metavar=("W", "H")
+    )
+    render.add_argument(
+        "--layout",
+        default="constrained",
+        help="figure layout engine (default: constrained)",
+    )
+    render.add_argument(
+        "--channels",
+        nargs="+",
+        help="channels to draw lines for (numbers or names in the parameters)",
+    )
+    render.add_argument("--spacing", type=float, default=0.0)
+    render.add_argument("--phase-dy", type=float, default=0.0)
+    render.add_argument("--text-dy", type=float, default=0.0)
+    render.add_argument("--fontsize", type=float, default=None)
+    render.add_argument("--center-align", action="store_true")
+    render.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    render.add_argument(
+        "--timeout",
+        type=float,
+        default=60.0,
+        help="maximum time in seconds for each file, 0 for none (default: 60)",
+    )
+    render.add_argument(
+        "--cache",
+        nargs="?",
+        const="",
+        metavar="DIR",
+        help="reuse renders stored in DIR, or in the default cache directory "
+        "(~/.cache/pulseplot) if none is given",
+    )
+    render.add_argument(
+        "--cache-size",
+        type=float,
+        default=512,
+        help="maximum size of the cache in MB (default: 512)",
+    )
+    render.add_argument(
+        "-q", "--quiet", action="store_true", help="only report failed files"
+    )
+    render.set_defaults(func=render_command)
+
+    lint = commands.add_parser(
+        "lint",
+        help="check sequence files for errors without drawing them",
+        description="Check sequence files for syntax errors, unknown parameters, "
+        "parameters missing from the parameter file, lines with both a pulse and "
+        "a delay, negative lengths and unknown shapes. Matplotlib is not used, so "
+        "this is much faster than rendering.",
+    )
+    lint.add_argument("files", nargs="+", help="sequence files or glob patterns")
+    lint.add_argument("-p", "--params", help="JSON file with external parameters")
+    lint.add_argument(
+        "--format",
+        choices=["text", "json"],
+        default="text",
+        help="text (path:line:column: severity: message) or json (default: text)",
+    )
+    lint.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    lint.add_argument(
+        "--strict", action="store_true", help="exit with an error on warnings too"
+    )
+    lint.add_argument(
+        "-q", "--quiet", action="store_true", help="do not print the summary"
+    )
+    lint.set_defaults(func=lint_command)
+
+    watch = commands.add_parser(
+        "watch",
+        help="draw a sequence file to an image whenever it changes",
+        description="Draw a sequence file to an image, and draw it again "
+        "whenever the file changes. Only the lines that changed are parsed "
+        "again, and only the elements from the first changed line onward "
+        "are drawn again.",
+    )
+    watch.add_argument("file", help="sequence file")
+    watch.add_argument("-o", "--output", required=True, help="image file")
+    watch.add_argument("-p", "--params", help="JSON file with external parameters")
+    watch.add_argument("--dpi", type=float, default=150)
+    watch.add_argument(
+        "--figsize", type=float, nargs=2, default=(8, 2.5), metavar=("W", "H")
+    )
+    watch.add_argument(
+        "--interval",
+        type=float,
+        default=0.25,
+        help="seconds between checks of the file (default: 0.25)",
+    )
+    watch.set_defaults(func=watch_command)
+
+    serve = commands.add_parser(
+        "serve",
+        help="run an HTTP server that renders sequences",
+        description="Run an HTTP server (on a TCP port or a Unix socket) that "
+        "renders sequences on a pool of warm worker processes. POST the "
+        "sequence to /render, as text or as JSON with the parameters; "
+        "metrics are at /metrics.",
+    )
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--socket", help="listen on this Unix socket instead")
+    serve.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    serve.add_argument(
+        "--max-renders",
+        type=int,
+        default=None,
+        help="renders that can run at a time (default: number of workers)",
+    )
+    serve.add_argument(
+        "--max-queue",
+        type=int,
+        default=64,
+        help="renders that can wait for their turn, before requests are "
+        "turned away (default: 64)",
+    )
+    serve.add_argument(
+        "--timeout",
+        type=float,
+        default=30.0,
+        help="maximum time in seconds for each render (default: 30)",
+    )
+    serve.add_argument(
+        "--cache-size",
+        type=float,
+        default=64,
+        help="size of the in-memory cache of renders in MB (default: 64)",
+    )
+    serve.add_argument(
+        "--figsize", type=float, nargs=2, default=(8, 2.5), metavar=("W", "H")
+    )
+    serve.add_argument("--layout", default="constrained")
+    serve.add_argument(
+        "--shape-dir",
+        help="directory that shape files (sp=file:<name>) are read from, "
+        "with names relative to it (default: shape files are not allowed)",
+    )
+    serve.add_argument(
+        "--max-elements",
+        type=int,
+        default=2000,
+        help="elements (lines) a sequence can have (default: 2000)",
+    )
+    serve.add_argument(
+        "--max-npoints",
+        type=int,
+        default=10000,
+        help="points a shape can have, with np= (default: 10000)",
+    )
+    serve.set_defaults(func=serve_command)
+
+    return parser
+
+
+def main(argv=None):
+
+    args = get_parser().parse_args(argv)
+
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
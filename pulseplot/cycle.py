@@ -0,0 +1,212 @@
+"""
+Phase cycles, and the scans of a sequence that they make
+
+A phase cycle is a table from the labels of phases (ph1, phrec) to the
+phase in each scan, e.g. {"ph1": "x y -x -y", "phrec": "x -y -x y"}.
+Expanding it to n scans makes a ScanView: the sequence, which is parsed
+and drawn once, and an array with the phase of each cycled element in
+each scan. A scan only differs from the others in its phase labels.
+
+"""
+
+import numbers
+from copy import copy
+
+import numpy as np
+
+from .parse import PulseSeq
+
+# phases given as numbers are in units of 90 degrees, as in
+# the phase programs of spectrometers (0 1 2 3 = x y -x -y)
+QUADRANTS = ("x", "y", "-x", "-y")
+
+
+def phase_text(value):
+    """
+    Text for a phase in a cycle: whole numbers (as numbers or
+    strings of digits, e.g. 1 or "1") are quadrants, and other
+    strings are used as they are (e.g. "-x", or "$\\pi/4$")
+
+    """
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+
+    if isinstance(value, numbers.Integral):
+        return QUADRANTS[int(value) % 4]
+
+    return str(value)
+
+
+class PhaseCycle(object):
+    """
+    Phases of each labelled phase of a sequence in each scan. The
+    phases of a label are a list, or a string separated by spaces, and
+    are repeated when there are more scans than phases. Labels can be
+    given with or without "ph" (ph1 or 1).
+
+    >>> cycle = PhaseCycle({"ph1": "x y -x -y", "phrec": [0, 3, 2, 1]})
+    >>> cycle.expand(2)
+    array([['x', 'y'],
+           ['x', '-y']], dtype='<U2')
+
+    """
+
+    def __init__(self, table):
+
+        if isinstance(table, PhaseCycle):
+            table = table.table
+
+        self.table = {}
+
+        for label, phases in dict(table).items():
+            if isinstance(phases, str):
+                phases = phases.split()
+
+            phases = [phase_text(p) for p in phases]
+            if not phases:
+                raise ValueError(f"No phases for {label}")
+
+            self.table[_label(label)] = phases
+
+    @property
+    def labels(self):
+        return list(self.table)
+
+    def __len__(self):
+        """
+        Number of scans for a full cycle, after which
+        all the phases are back where they started
+
+        """
+        lengths = [len(p) for p in self.table.values()]
+
+        return int(np.lcm.reduce(lengths)) if lengths else 1
+
+    def expand(self, scans=None):
+        """
+        Gets the phases in each of the first scans (by default, one full
+        cycle), as an array with a row for each label
+
+        """
+        scans = len(self) if scans is None else int(scans)
+        counts = np.arange(scans)
+
+        if not self.table:
+            return np.empty((0, scans), dtype=str)
+
+        return np.array(
+            [np.asarray(p)[counts % len(p)] for p in self.table.values()], dtype=str
+        )
+
+    def __repr__(self):
+        return f"PhaseCycle({self.table!r})"
+
+
+class ScanView(object):
+    """
+    The scans of a sequence with a phase cycle. The elements are shared
+    between all scans, and only the phases of the cycled elements (those
+    whose phase has a label in the cycle) change from scan to scan.
+
+    >>> view = sequence.scans(8)
+    >>> view.phases(1)
+    array(['y', '-y'], dtype='<U2')
+    >>> frames = view.draw(ax)
+    >>> ani = pplot.animation(fig, frames, interval=500)
+
+    """
+
+    def __init__(self, sequence, cycle, scans=None):
+
+        self.sequence = sequence
+        self.cycle = PhaseCycle(cycle)
+
+        labels = self.cycle.labels
+        self.elements = sequence.select(phase=labels).rows
+        self.rows = np.array(
+            [labels.index(sequence.elements[i].phase) for i in self.elements], int
+        )
+
+        self.table = self.cycle.expand(scans)
+
+    def __len__(self):
+        return self.table.shape[1]
+
+    def phases(self, scan):
+        """
+        Gets the phase of each cycled element (in the order of
+        self.elements) in a scan
+
+        """
+        return self.table[self.rows, scan]
+
+    def __getitem__(self, scan):
+        """
+        Gets a scan as a PulseSeq, which can be drawn or rendered like
+        any other. Only the cycled elements are copied, the others are
+        the elements of the sequence.
+
+        """
+        if not -len(self) <= scan < len(self):
+            raise IndexError(f"There are {len(self)} scans")
+
+        elements = list(self.sequence.elements)
+
+        for i, phase in zip(self.elements.tolist(), self.phases(scan).tolist()):
+            elements[i] = copy(elements[i])
+            elements[i].phase = f"_{phase}"
+
+        return PulseSeq(elements)
+
+    def __iter__(self):
+        for scan in range(len(self)):
+            yield self[scan]
+
+    def draw(self, ax, scans=None):
+        """
+        Draws the sequence once, with the phases of the first scan, and
+        adds the phase labels of the other scans at the same places.
+        Returns one frame for each scan, a list of the phase labels of
+        that scan, for pplot.animation (only the phase labels change
+        between frames). Only the labels of the first scan are visible
+        until an animation or show_scan shows another scan.
+
+        """
+        start = len(ax.index)
+        ax.pseq(self[0])
+
+        patches = ax.index.patches(start)
+        elements = [patches[i].element for i in self.elements.tolist()]
+        first = [patches[i].phase_label for i in self.elements.tolist()]
+
+        frames = [first]
+        for scan in range(1, len(self) if scans is None else scans):
+            labels = []
+            for element, phase in zip(elements, self.phases(scan).tolist()):
+                label = ax.add_label(**element.phase_params(s=phase))
+                label.set_visible(False)
+                labels.append(label)
+
+            frames.append(labels)
+
+        return frames
+
+
+def show_scan(frames, scan):
+    """
+    Shows the phase labels of one scan, and hides those of the
+    other scans, in frames drawn by ScanView.draw
+
+    """
+    for i, labels in enumerate(frames):
+        for label in labels:
+            label.set_visible(i == scan)
+
+
+def _label(label):
+    label = str(label)
+
+    if label.startswith("ph") and len(label) > 2:
+        return label[2:]
+
+    return label
@@ -0,0 +1,222 @@
+"""
+Arithmetic expressions in the values of parameters
+
+Numeric parameters can be given as an expression in braces, e.g.
+p={2*p1} or d={d10 - p2/2}, where names are looked up in the external
+parameters. Expressions are parsed once (with ast, never eval) into a
+tree of functions, which is cached by the text of the expression.
+The same functions work on numpy arrays, so that an expression can
+be evaluated for many sets of parameters at once (see evaluate_many).
+
+"""
+
+import ast
+import operator
+import re
+from functools import lru_cache, reduce
+
+import numpy as np
+
+# parameters whose values can be expressions (the numeric ones)
+KEYS = (
+    "p",
+    "pl",
+    "al",
+    "np",
+    "pdx",
+    "pdy",
+    "pfs",
+    "d",
+    "st",
+    "f",
+    "tdx",
+    "tdy",
+    "tfs",
+)
+
+# an expression at the start of a token, after the key of a parameter
+EXPRESSION = re.compile(
+    r"(?<!\S)((?:%s)=?)\{([^{}]*)\}" % "|".join(sorted(KEYS, key=len, reverse=True))
+)
+
+BINARY = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+UNARY = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+FUNCTIONS = {
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "log10": np.log10,
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "abs": np.abs,
+    "round": np.round,
+    "floor": np.floor,
+    "ceil": np.ceil,
+    "min": lambda *args: reduce(np.minimum, args),
+    "max": lambda *args: reduce(np.maximum, args),
+}
+
+CONSTANTS = {"pi": np.pi, "e": np.e}
+
+
+class Expression(object):
+    """
+    A compiled expression, called with a dict of parameters
+
+    >>> Expression("d10 - p2/2")({"d10": 5, "p2": 1})
+    4.5
+
+    """
+
+    def __init__(self, source):
+        self.source = source
+
+        try:
+            tree = ast.parse(source.strip(), mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"Cannot read the expression {{{source}}}: {e.msg}")
+
+        names = set()
+        self._function = _build(tree.body, source, names)
+        self.names = frozenset(names)
+
+    def __repr__(self):
+        return f"Expression({self.source!r})"
+
+    def __call__(self, params):
+        try:
+            return self._function(params)
+        except KeyError as e:
+            raise ValueError(
+                f"{e.args[0]} in {{{self.source}}} is not in the parameters"
+            )
+        except (ArithmeticError, TypeError) as e:
+            raise ValueError(f"Cannot evaluate {{{self.source}}}: {e}")
+
+    def evaluate_many(self, params):
+        """
+        Evaluates the expression for many sets of parameters, given as a
+        list of dicts, or as a dict of arrays (one value per set) and
+        single numbers (the same for all sets). Returns an array with
+        one value per set.
+
+        """
+        sets = count_sets(params)
+
+        if isinstance(params, (list, tuple)):
+            try:
+                params = {
+                    name: np.array([p[name] for p in params], float)
+                    for name in self.names
+                    if sets and name in params[0]
+                }
+            except KeyError as e:
+                raise ValueError(f"{e.args[0]} is missing from some of the parameters")
+        else:
+            params = {k: np.asarray(v, float) for k, v in params.items()}
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = self(params)
+
+        return np.broadcast_to(np.asarray(values, float), (sets,))
+
+
+def count_sets(params):
+    """
+    The number of sets in parameters given as a list of dicts, or
+    as a dict of arrays and single numbers (see evaluate_many)
+
+    """
+    if isinstance(params, (list, tuple)):
+        return len(params)
+
+    return max((np.size(v) for v in params.values() if np.ndim(v)), default=1)
+
+
+@lru_cache(maxsize=4096)
+def compile_expression(source):
+    """
+    Gets the compiled expression for a source text,
+    which is compiled only the first time
+
+    """
+    return Expression(source)
+
+
+def hide_expressions(line):
+    """
+    Replaces the text of each expression in a line with zeros, so that the
+    line can be matched with the patterns of the parameters. The length
+    of the line does not change, so the expressions are found in the
+    original line at the same positions.
+
+    """
+    if "{" not in line:
+        return line
+
+    return EXPRESSION.sub(lambda m: f"{m.group(1)}{{{'0' * len(m.group(2))}}}", line)
+
+
+def is_expression(value):
+    return isinstance(value, str) and value.startswith("{") and value.endswith("}")
+
+
+def _build(node, source, names):
+    """
+    Turns an ast node into a function of the parameters,
+    allowing only numbers, names, arithmetic and FUNCTIONS
+
+    """
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        # numbers are floats, so that powers overflow instead of growing forever
+        value = float(node.value)
+        return lambda params: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        names.add(name)
+
+        if name in CONSTANTS:
+            constant = CONSTANTS[name]
+            return lambda params: params.get(name, constant)
+
+        return lambda params: params[name]
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY:
+        op = BINARY[type(node.op)]
+        left = _build(node.left, source, names)
+        right = _build(node.right, source, names)
+        return lambda params: op(left(params), right(params))
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY:
+        op = UNARY[type(node.op)]
+        operand = _build(node.operand, source, names)
+        return lambda params: op(operand(params))
+
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id in FUNCTIONS
+        and node.args
+        and not node.keywords
+    ):
+        function = FUNCTIONS[node.func.id]
+        args = [_build(arg, source, names) for arg in node.args]
+        return lambda params: function(*[arg(params) for arg in args])
+
+    raise ValueError(
+        f"{ast.get_source_segment(source.strip(), node) or source!r} is not allowed "
+        f"in {{{source}}}, only numbers, parameters, + - * / // % ** and "
+        f"{', '.join(FUNCTIONS)}"
+    )
@@ -0,0 +1,111 @@
+"""
+Placement of labels so that they do not overlap
+
+Labels are placed one at a time, from left to right, each at the first
+of a list of candidate positions (where it was put, then above and below
+that, then to the sides) at which it does not overlap any label placed
+before it. Labels for which there is no room are left where they were.
+Placed labels are kept in a grid hash, a dict from the cells of a grid
+to the labels in them, so that each candidate is only checked against
+the labels nearby. Apart from the sort, placing n labels takes about
+O(n), and the result only depends on the positions and sizes of the
+labels, not on the order in which they were added.
+
+"""
+
+import math
+
+import numpy as np
+
+# shifts tried for each label, in widths (dx) and heights (dy) of the label
+CANDIDATES = (
+    (0.0, 0.0),
+    (0.0, 1.0),
+    (0.0, -1.0),
+    (0.0, 2.0),
+    (0.0, -2.0),
+    (0.75, 0.0),
+    (-0.75, 0.0),
+    (0.75, 1.0),
+    (-0.75, 1.0),
+    (0.0, 3.0),
+    (0.0, -3.0),
+)
+
+
+def place_boxes(x, y, width, height, candidates=CANDIDATES, pad=0.0):
+    """
+    Finds shifts (dx, dy) for boxes with centers (x, y) and the given
+    widths and heights, so that the boxes (grown by pad on each side)
+    do not overlap. Each box gets the first candidate shift at which it
+    overlaps none of the boxes placed before it. A box for which there
+    is no room is not moved, and is left out of the index, so that
+    only boxes that do not overlap are in it, and there are never
+    more than a few in each cell. Returns the arrays dx and dy.
+
+    """
+    x, y = np.asarray(x, float), np.asarray(y, float)
+    width = np.asarray(width, float) + 2 * pad
+    height = np.asarray(height, float) + 2 * pad
+
+    n = len(x)
+    dx, dy = np.zeros(n), np.zeros(n)
+
+    if n == 0:
+        return dx, dy
+
+    cell = max(float(np.median(width)), float(np.median(height)), 1e-9)
+
+    # left to right, ties broken by position, so the result is stable
+    order = np.lexsort((np.arange(n), y, x))
+
+    grid = {}
+    placed = [None] * n
+
+    xs, ys, widths, heights = x.tolist(), y.tolist(), width.tolist(), height.tolist()
+
+    for i in order.tolist():
+        w, h = widths[i], heights[i]
+
+        for cx, cy in candidates:
+            sx, sy = cx * w, cy * h
+            x0, y0 = xs[i] + sx - w / 2, ys[i] + sy - h / 2
+            box = (x0, y0, x0 + w, y0 + h)
+
+            if not _overlaps(box, grid, placed, cell):
+                break
+        else:
+            # there is no room, the label stays where it is
+            continue
+
+        dx[i], dy[i] = sx, sy
+        placed[i] = box
+
+        for key in _cells(box, cell):
+            grid.setdefault(key, []).append(i)
+
+    return dx, dy
+
+
+def _cells(box, cell):
+    x0, y0, x1, y1 = box
+
+    for ix in range(math.floor(x0 / cell), math.floor(x1 / cell) + 1):
+        for iy in range(math.floor(y0 / cell), math.floor(y1 / cell) + 1):
+            yield ix, iy
+
+
+def _overlaps(box, grid, placed, cell):
+    """
+    Checks if a box overlaps any of the placed boxes
+
+    """
+    x0, y0, x1, y1 = box
+
+    for key in _cells(box, cell):
+        for j in grid.get(key, ()):
+            a0, b0, a1, b1 = placed[j]
+            if x0 < a1 and a0 < x1 and y0 < b1 and b0 < y1:
+                return True
+
+    return False
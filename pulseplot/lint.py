@@ -0,0 +1,276 @@
+"""
+Checks sequence files for errors without drawing them
+
+Lines are checked with the same patterns that parse_base uses, so
+that everything the parser would skip or fail on is reported, with
+its line and column. Only the parser is used: matplotlib is not
+imported.
+
+    pulseplot lint sequences/*.seq --params params.json --format json
+
+"""
+
+import json
+import re
+from collections import namedtuple
+from functools import lru_cache
+from pathlib import Path
+
+from .expr import CONSTANTS
+from .expr import KEYS as EXPRESSION_KEYS
+from .expr import compile_expression, hide_expressions, is_expression
+from .parse import PARAMS, PATTERN, SHAPES, Shape, parse_anchor
+from .shapes import PREFIX as FILE_PREFIX
+from .shapes import find_shape
+
+Diagnostic = namedtuple("Diagnostic", ["line", "column", "severity", "message"])
+
+ERROR, WARNING = "error", "warning"
+
+KEYS = list(PARAMS)
+
+# values that are named like the parameters of a spectrometer (p1, d10,
+# pl1), and looked up in the external parameters
+NAMED = ("p", "d", "pl")
+
+
+def lint_text(text, params=None):
+    """
+    Checks a sequence (the text given to PulseSeq) line by line,
+    and returns a list of Diagnostics. Lines and columns start at 1.
+    When params are given (even if empty), named values (see NAMED)
+    that are not in them are reported, since they are then taken as
+    they are written (p1 as a pulse of length 1).
+
+    """
+    diagnostics = []
+
+    for number, line in enumerate(text.split("\n"), start=1):
+        # comments are removed the same way as in PulseSeq
+        line = line.split("#")[0]
+        if not line.strip():
+            continue
+
+        for column, severity, message in lint_line(line, params):
+            diagnostics.append(Diagnostic(number, column, severity, message))
+
+    return diagnostics
+
+
+def lint_line(line, params=None):
+    """
+    Checks a single line of a sequence. Returns a list of
+    (column, severity, message), with columns starting at 1.
+
+    """
+    named = params is not None
+    params = params or {}
+
+    found = []
+    covered = [False] * len(line)
+
+    # expressions are matched as zeros, and then taken from the line
+    for match in re.finditer(PATTERN, hide_expressions(line)):
+        if not match.group(0):
+            continue
+
+        covered[match.start() : match.end()] = [True] * (match.end() - match.start())
+
+        for i, token in enumerate(match.groups()):
+            if token:
+                start, end = match.span(i + 1)
+                found.append((KEYS[i], line[start:end], start + 1))
+
+    problems = []
+
+    # anything that no pattern matches is skipped by the parser
+    for unknown in re.finditer(r"\S+", line):
+        start, end = unknown.span()
+        if not all(covered[start:end]):
+            text = "".join(
+                c if not covered[start + i] else " "
+                for i, c in enumerate(unknown.group())
+            )
+            problems.append(
+                (start + 1, ERROR, f"{text.strip()!r} is not understood and is ignored")
+            )
+
+    values = {}
+    for key, token, column in found:
+        if key in values:
+            problems.append(
+                (column, WARNING, f"{token!r} overrides {values[key][0]!r}")
+            )
+        values[key] = (token, column)
+
+    parsed = {}
+    for key, (token, column) in values.items():
+        try:
+            parsed[key] = _value(key, token, params)
+        except ValueError as e:
+            problems.append((column, ERROR, str(e)))
+            continue
+
+        if named and _unresolved(key, token, params):
+            problems.append(
+                (
+                    column,
+                    WARNING,
+                    f"{token} is not in the parameters, {parsed[key]!r} is used",
+                )
+            )
+
+    if "p" in values and "d" in values:
+        problems.append(
+            (
+                values["d"][1],
+                ERROR,
+                "a line cannot have both a pulse length (p) and a delay (d)",
+            )
+        )
+
+    elif "p" not in values and "d" not in values:
+        problems.append(
+            (1, ERROR, "the line has neither a pulse length (p) nor a delay (d)")
+        )
+
+    for key, kind in (("p", "pulse length"), ("d", "delay")):
+        value = parsed.get(key)
+        if isinstance(value, (int, float)) and value < 0:
+            problems.append((values[key][1], WARNING, f"negative {kind} {value}"))
+
+    for key in ("pkw", "tkw", "skw"):
+        if isinstance(parsed.get(key), str):
+            try:
+                _keywords(parsed[key])
+            except ValueError:
+                problems.append(
+                    (values[key][1], ERROR, f"{parsed[key]!r} is not a valid dict")
+                )
+
+    if isinstance(parsed.get("sp"), str):
+        problem = _check_shape(parsed["sp"])
+        if problem:
+            problems.append((values["sp"][1], *problem))
+
+    if isinstance(parsed.get("an"), str):
+        try:
+            parse_anchor(parsed["an"])
+        except ValueError as e:
+            problems.append((values["an"][1], ERROR, str(e)))
+
+    return sorted(problems)
+
+
+def _value(key, token, params):
+    """
+    Gets the value of a parameter the way parse_base does,
+    but with a message that says what went wrong
+
+    """
+    info = PARAMS[key]
+
+    if token in params:
+        value = params[token]
+        source = f"{value!r} (the value of {token} in the parameters)"
+
+    elif token == key:
+        return not info.default
+
+    else:
+        value = token[len(key) + 1 :] if token[len(key)] == "=" else token[len(key) :]
+        source = repr(value)
+
+    if not callable(info.type):
+        return value
+
+    if key in EXPRESSION_KEYS and is_expression(value):
+        expression = compile_expression(value[1:-1])
+        missing = sorted(expression.names - set(params) - set(CONSTANTS))
+        if missing:
+            raise ValueError(f"{token!r}: the parameters have no {', '.join(missing)}")
+        return expression(params)
+
+    try:
+        return info.type(value)
+    except (TypeError, ValueError):
+        kind = f"{info.name} ({info.type.__name__})"
+        hint = "" if token in params else f", and {token} is not in the parameters"
+        raise ValueError(f"{token!r}: {source} is not a valid {kind}{hint}")
+
+
+def _unresolved(key, token, params):
+    """
+    Checks if a named value (p1 or pX, but not p=1, p0.5 or p={2*p1})
+    is missing from the external parameters
+
+    """
+    if key not in NAMED or token in params:
+        return False
+
+    return re.fullmatch(r"\w+", token[len(key) :]) is not None
+
+
+def _keywords(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json.loads(text.replace("'", '"'))
+
+
+@lru_cache(maxsize=256)
+def _check_shape(shape):
+
+    if shape.startswith(FILE_PREFIX):
+        try:
+            find_shape(shape[len(FILE_PREFIX) :])
+        except FileNotFoundError as e:
+            return ERROR, str(e)
+        return None
+
+    try:
+        name = Shape(shape, 2).name
+    except ValueError:
+        return ERROR, f"the parameters of the shape {shape!r} are not numbers"
+
+    if name not in SHAPES and not hasattr(Shape, name):
+        return WARNING, f"unknown shape {name!r}, it is drawn as a square"
+
+    return None
+
+
+def lint_file(path, params=None):
+    """
+    Checks a sequence file. Returns the path and a list of Diagnostics.
+
+    """
+    try:
+        text = Path(path).read_text()
+    except (OSError, UnicodeDecodeError) as e:
+        return path, [Diagnostic(0, 0, ERROR, f"cannot read the file: {e}")]
+
+    return path, lint_text(text, params)
+
+
+def format_text(path, diagnostics):
+    """
+    Diagnostics as lines of path:line:column: severity: message
+
+    """
+    return "".join(
+        f"{path}:{d.line}:{d.column}: {d.severity}: {d.message}\n" for d in diagnostics
+    )
+
+
+def format_json(results):
+    """
+    Diagnostics for (path, diagnostics) pairs as a JSON list of files
+
+    """
+    return json.dumps(
+        [
+            {"file": str(path), "diagnostics": [d._asdict() for d in diagnostics]}
+            for path, diagnostics in results
+        ],
+        indent=2,
+    )
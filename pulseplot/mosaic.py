@@ -0,0 +1,245 @@
+"""
+Rendering the panels of a mosaic in parallel
+
+Each panel of a mosaic (laid out as for subplot_mosaic) is drawn on a
+figure of its own, in a worker process, and copied straight into its
+place in one RGBA image in shared memory. The panels are drawn at the
+same time, so a large grid takes about as long as its slowest panel,
+and no image is sent back from the workers.
+
+"""
+
+import os
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from io import BytesIO
+from multiprocessing import shared_memory
+
+import numpy as np
+
+FORMATS = ("png", "rgba")
+
+
+def mosaic_cells(mosaic):
+    """
+    Finds the rows and columns that each panel of a mosaic spans. The
+    mosaic is a list of rows, each a list of names, or a string with
+    one character for each panel and rows separated by ";" or new
+    lines, as for matplotlib's subplot_mosaic. "." is an empty cell.
+    Returns a dict from each name to (row0, row1, col0, col1) (with
+    the ends excluded), and the number of rows and columns.
+
+    >>> mosaic_cells("AB;CC")
+    ({'A': (0, 1, 0, 1), 'B': (0, 1, 1, 2), 'C': (1, 2, 0, 2)}, 2, 2)
+
+    """
+    if isinstance(mosaic, str):
+        rows = [list(row.strip()) for row in mosaic.replace(";", "\n").split("\n")]
+        rows = [row for row in rows if row]
+    else:
+        rows = [list(row) for row in mosaic]
+
+    if not rows or any(len(row) != len(rows[0]) for row in rows):
+        raise ValueError("All rows of the mosaic should have the same length")
+
+    cells = {}
+    for i, row in enumerate(rows):
+        for j, name in enumerate(row):
+            if name != ".":
+                cells.setdefault(name, []).append((i, j))
+
+    spans = {}
+    for name, where in cells.items():
+        i, j = np.array(where).T
+        span = (i.min(), i.max() + 1, j.min(), j.max() + 1)
+
+        if len(where) != (span[1] - span[0]) * (span[3] - span[2]):
+            raise ValueError(f"Panel {name!r} of the mosaic is not a rectangle")
+
+        spans[name] = tuple(int(s) for s in span)
+
+    return spans, len(rows), len(rows[0])
+
+
+def panel_pixels(spans, nrows, ncols, width, height):
+    """
+    Divides an image of width x height pixels into the grid of the
+    mosaic, and returns a dict from each panel to the slice of the
+    image it covers, (top, bottom, left, right) in pixels
+
+    """
+    ys = np.round(np.linspace(0, height, nrows + 1)).astype(int)
+    xs = np.round(np.linspace(0, width, ncols + 1)).astype(int)
+
+    return {
+        name: (int(ys[r0]), int(ys[r1]), int(xs[c0]), int(xs[c1]))
+        for name, (r0, r1, c0, c1) in spans.items()
+    }
+
+
+def render_mosaic(
+    mosaic,
+    panels,
+    figsize=(8, 5),
+    dpi=150,
+    fmt="png",
+    executor=None,
+    layout="constrained",
+    facecolor="white",
+    params=None,
+    channels=None,
+    **settings,
+):
+    """
+    Draws each panel of a mosaic (see mosaic_cells) in parallel and
+    puts them together into one image of figsize inches at dpi.
+    Returns the image as png bytes, or as an RGBA array with
+    fmt="rgba".
+
+    panels maps the name of each panel to what is drawn on it:
+
+    - a sequence (a string or a PulseSeq), drawn with the params,
+      channels and settings (attributes of PulseProgram, see
+      render.SETTINGS) given here,
+    - a dict of keyword arguments for render.draw_on (sequence,
+      params, channels and settings) for this panel only,
+    - a function that is called with the PulseProgram of the panel
+      and draws on it (it is run in a worker, so it should be defined
+      at the top level of a module).
+
+    The panels are drawn by executor (by default, a new pool with
+    one process for each panel, up to the number of CPUs). Pass a
+    pool to reuse it for many mosaics, since starting one takes time.
+
+    >>> png = render_mosaic("AB;CC", {"A": hsqc, "B": noesy, "C": cosy})
+
+    """
+    from .render import check_settings
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Format should be one of {FORMATS}, not {fmt}")
+
+    check_settings(settings)
+
+    spans, nrows, ncols = mosaic_cells(mosaic)
+
+    missing = set(spans) - set(panels)
+    if missing:
+        raise ValueError(f"Nothing to draw on {', '.join(map(repr, sorted(missing)))}")
+
+    width, height = round(figsize[0] * dpi), round(figsize[1] * dpi)
+    pixels = panel_pixels(spans, nrows, ncols, width, height)
+
+    shape = (height, width, 4)
+    memory = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(min(len(spans), os.cpu_count() or 1))
+
+    jobs = []
+
+    try:
+        image = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+        image[...] = 255
+
+        for name, box in pixels.items():
+            spec = panels[name]
+
+            if not isinstance(spec, dict) and not callable(spec):
+                spec = {"sequence": spec}
+
+            if isinstance(spec, dict):
+                spec = {
+                    "params": params,
+                    "channels": channels,
+                    **settings,
+                    **spec,
+                }
+
+            jobs.append(
+                executor.submit(
+                    _draw_panel, memory.name, shape, box, spec, dpi, layout, facecolor
+                )
+            )
+
+        done, _ = wait(jobs, return_when=FIRST_EXCEPTION)
+        for job in jobs:
+            if job in done:
+                job.result()
+
+        # the workers are done with the image, copy it out
+        # before the shared memory is freed
+        image = image.copy()
+
+    finally:
+        # panels that have not started are not drawn after an error
+        for job in jobs:
+            job.cancel()
+        if own_executor:
+            executor.shutdown(wait=True)
+        memory.close()
+        memory.unlink()
+
+    if fmt == "rgba":
+        return image
+
+    from matplotlib.image import imsave
+
+    buffer = BytesIO()
+    imsave(buffer, image, format="png", dpi=dpi)
+
+    return buffer.getvalue()
+
+
+def _attach(name):
+    """
+    Opens shared memory made by another process, which stays
+    in charge of freeing it
+
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13, the memory is always tracked, but workers
+        # share the resource tracker of the process that made it, which
+        # only keeps one entry for it
+        return shared_memory.SharedMemory(name=name)
+
+
+def _draw_panel(name, shape, box, spec, dpi, layout, facecolor):
+    """
+    Draws one panel on a figure of its own and copies it into
+    its box (top, bottom, left, right) of the shared image
+
+    """
+    from .pulseplot import PulseProgram
+    from .render import check_settings, draw_on, new_figure
+
+    top, bottom, left, right = box
+    width, height = right - left, bottom - top
+
+    # a little more than the size, so that the canvas is not a pixel short
+    fig = new_figure(figsize=((width + 0.5) / dpi, (height + 0.5) / dpi), layout=layout)
+    fig.set_dpi(dpi)
+    fig.set_facecolor(facecolor)
+    ax = fig.add_subplot(axes_class=PulseProgram)
+
+    if isinstance(spec, dict):
+        spec = dict(spec)
+        sequence = spec.pop("sequence")
+        params, channels = spec.pop("params", None), spec.pop("channels", None)
+        check_settings(spec)
+        draw_on(ax, sequence, params=params, channels=channels, **spec)
+    else:
+        spec(ax)
+
+    fig.canvas.draw()
+    tile = np.asarray(fig.canvas.buffer_rgba())
+
+    memory = _attach(name)
+    try:
+        image = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+        image[top:bottom, left:right] = tile[:height, :width]
+        del image
+    finally:
+        memory.close()
@@ -1,16 +1,103 @@
 # -*- coding: utf-8 -*-
 
 import json
+import pickle
 import re
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from copy import deepcopy
 from warnings import warn
 
 import numpy as np
-from matplotlib.patches import Polygon
+
+from .expr import KEYS as EXPRESSION_KEYS
+from .expr import compile_expression, hide_expressions, is_expression
+from .shapes import PREFIX as FILE_PREFIX
+from .shapes import decimate_outline, file_shape, shape_stamp
 
 PULSE_DEFAULTS = {"power": 1.0, "channel": 0.0}
 TEXT_DEFAULTS = {"fontsize": 10, "ha": "center", "va": "center"}
 
+
+class OutlineCache(OrderedDict):
+    """
+    Least-recently used store of pulse outlines, keyed
+    by Pulse.geometry_key
+
+    """
+
+    def __init__(self, maxsize=4096):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+OUTLINES = OutlineCache()
+
+# shape functions registered by name, see register_shape
+SHAPES = {}
+
+
+def register_shape(name, function=None):
+    """
+    Registers a function that makes a pulse shape under a name, so that
+    it can be used as sp=name (or sp=name_a_b with parameters a and b),
+    and so that pulses with this shape are sent to other processes by
+    name. The function gets an array from 0 to 1, and the parameters
+    that are given, and returns the shape on that array.
+
+    Shapes have to be registered in every process that uses them, for
+    example when a module is imported, or in the initializer of a
+    process pool. Can also be used as a decorator:
+
+    >>> @register_shape("half")
+    ... def half(x, level=0.5):
+    ...     return np.full_like(x, level)
+
+    """
+
+    def register(function):
+        if not callable(function):
+            raise TypeError(f"The shape {name} should be a function")
+
+        if not name or "_" in name or " " in name:
+            raise ValueError(f"Invalid shape name {name!r}, cannot contain '_'")
+
+        if name in SHAPES:
+            # outlines of the old function are cached under the same name
+            OUTLINES.clear()
+
+        SHAPES[name] = function
+
+        return function
+
+    if function is None:
+        return register
+
+    return register(function)
+
+
+def shape_name(function):
+    """
+    Gets the name under which a shape function
+    is registered, or None if it is not registered
+
+    """
+    for name, registered in SHAPES.items():
+        if registered is function:
+            return name
+
+    return None
+
+
 PAR = namedtuple("parameters", ["name", "type", "default", "pattern", "parents"])
 
 # fmt: off
@@ -43,16 +130,47 @@ PARAMS = {
     "tfs":   PAR("text_fontsize",   float,  15.0,     r"(tfs=?[^ ]+)?",                 ["pulse", "delay"],),
     "n":     PAR("name",            str,    "",       r"(n=?[^p ]+)?",                  ["pulse", "delay"],),
     "skw":   PAR("style_kw",        str,    "{}",     r"(skw=?{.*?})?",                 ["pulse", "delay"],),
+    "an":    PAR("anchor",          str,    None,     r"(an=?[^ ]+)?",                  ["pulse", "delay"],),
 }
 # fmt: on
 
 PATTERN = "".join([v.pattern for k, v in PARAMS.items()])
 
 
-def parse_base(instructions, params=None):
+ANCHORS = ("after", "before", "start", "end", "center")
+
+
+def parse_anchor(anchor):
+    """
+    Splits an anchor (mode:name, with an optional offset, e.g.
+    after:t1, center:echo or before:acq-0.5) into the mode, the name
+    of the element it is anchored to, and the offset. A name alone
+    (an=t1) is the same as after:name.
+
+    """
+    match = re.fullmatch(r"(?:(\w+):)?(.+?)([+-][0-9.]+(?:e[+-]?[0-9]+)?)?", anchor)
+
+    if match is None:
+        raise ValueError(f"Cannot read the anchor {anchor!r}")
+
+    mode, name, offset = match.groups()
+    mode = mode or "after"
+
+    if mode not in ANCHORS:
+        raise ValueError(
+            f"Unknown anchor {mode!r} in {anchor!r}, use one of {', '.join(ANCHORS)}"
+        )
+
+    return mode, name, float(offset or 0.0)
+
+
+def parse_base(instructions, params=None, sources=None):
     """
     Basic parsing of a single line of instructions
-    using regexes
+    using regexes. Numeric values can be expressions in
+    braces, p={2*p1} (see pulseplot.expr). If a dict is given
+    as sources, the expressions or external parameters that
+    numeric values come from are put in it.
 
     """
     arguments = [""] * len(PARAMS)
@@ -63,12 +181,21 @@ def parse_base(instructions, params=None):
         params = {}
 
     # match and squash
-    matches = re.findall(PATTERN, instructions)
-    for m in matches:
-        for i, _ in enumerate(arguments):
-            value = m[i]
-            if value:
-                arguments[i] = value
+    hidden = hide_expressions(instructions)
+    if hidden == instructions:
+        matches = re.findall(PATTERN, instructions)
+        for m in matches:
+            for i, _ in enumerate(arguments):
+                value = m[i]
+                if value:
+                    arguments[i] = value
+
+    else:
+        # expressions are matched as zeros, and then taken from the line
+        for m in re.finditer(PATTERN, hidden):
+            for i, _ in enumerate(arguments):
+                if m.group(i + 1):
+                    arguments[i] = instructions[m.start(i + 1) : m.end(i + 1)]
 
     # parse and pick up values + cast to appropriate types
     for arg, (param, param_info) in zip(arguments, PARAMS.items()):
@@ -87,6 +214,10 @@ def parse_base(instructions, params=None):
                 else:
                     userparams[param_info.name] = value
 
+                if sources is not None and param in EXPRESSION_KEYS:
+                    if arg.isidentifier():
+                        sources[param_info.name] = arg
+
             except KeyError:
 
                 # special case for Boolean params
@@ -99,6 +230,13 @@ def parse_base(instructions, params=None):
                     else:
                         value = arg[len(param) :]
 
+                    if param in EXPRESSION_KEYS and is_expression(value):
+                        expression = compile_expression(value[1:-1])
+                        value = expression(params)
+
+                        if sources is not None:
+                            sources[param_info.name] = expression.source
+
                     if callable(param_info.type):
                         try:
                             userparams[param_info.name] = param_info.type(value)
@@ -136,7 +274,8 @@ class Pulse(object):
         except TypeError as e:
             raise TypeError("All arguments without a keyword should be strings")
 
-        args = parse_base(self.args, external_params)
+        sources = {}
+        args = parse_base(self.args, external_params, sources)
 
         # check that the parsing is OK, remove things that are not required
         if args["time"] is not None:
@@ -178,7 +317,95 @@ class Pulse(object):
                 args["truncate_off"] = True
                 args["open"] = True
 
-        self.__dict__ = {**self.__dict__, **args, **params}
+        self.__dict__.update(args)
+        self.__dict__.update(params)
+        self._keep_sources(sources, params)
+
+    def _keep_sources(self, sources, params):
+        """
+        Keeps the expressions that values come from, so that they can
+        be evaluated again for other parameters (see Timeline.sweep)
+
+        """
+        if not sources:
+            return
+
+        sources = {k: v for k, v in sources.items() if k not in params}
+
+        if sources:
+            self.expressions = sources
+
+    @classmethod
+    def _defaults(cls):
+        """
+        Parameters of an element made from an empty string,
+        shared by all elements of this class
+
+        """
+        if "_default_state" not in cls.__dict__:
+            cls._default_state = vars(cls(""))
+
+        return cls._default_state
+
+    def __getstate__(self):
+        """
+        Only the parameters that differ from the defaults are pickled.
+        Shape functions are sent by their registered name.
+
+        """
+        defaults = self._defaults()
+        get = defaults.get
+
+        # most defaults are the very same objects as in PARAMS,
+        # the few other values are compared with the defaults
+        state = {k: v for k, v in self.__dict__.items() if v is not get(k, self)}
+
+        for key, value in list(state.items()):
+            default = get(key, self)
+            try:
+                if type(value) is type(default) and value == default:
+                    del state[key]
+            except ValueError:
+                pass
+
+        if callable(self.shape):
+            name = shape_name(self.shape)
+
+            if name is not None:
+                state["shape"] = name
+
+            elif "<" in getattr(self.shape, "__qualname__", ""):
+                raise pickle.PicklingError(
+                    f"The shape {self.shape.__qualname__} cannot be pickled. "
+                    "Register it with register_shape to send it to other processes."
+                )
+
+        return state
+
+    def __copy__(self):
+        # copies within a process keep the shape function as it is
+        new = type(self).__new__(type(self))
+        new.__dict__.update(self.__dict__)
+
+        return new
+
+    def __deepcopy__(self, memo):
+        new = type(self).__new__(type(self))
+        new.__dict__.update(deepcopy(self.__dict__, memo))
+
+        return new
+
+    def __setstate__(self, state):
+
+        defaults = self._defaults()
+        self.__dict__.update(defaults)
+
+        # the keyword dictionaries are not shared between elements
+        for key in ("phase_kw", "text_kw", "style_kw"):
+            if key not in state:
+                self.__dict__[key] = dict(defaults[key])
+
+        self.__dict__.update(state)
 
     def phase_params(self, **kwargs):
         """
@@ -196,10 +423,10 @@ class Pulse(object):
         else:
             text = fr"$\phi_{{{self.phase}}}$"
 
-        p = self.patch()
+        xy = self.vertices()
         center = int(self.npoints // 2)
-        xpos = p.xy[:, 0][center] + self.phtxt_dx
-        ypos = p.xy[:, 1][center] + self.phtxt_dy + 0.15
+        xpos = xy[:, 0][center] + self.phtxt_dx
+        ypos = xy[:, 1][center] + self.phtxt_dy + 0.15
 
         phtxtparams = {"x": xpos, "y": ypos, "s": text, "fontsize": self.ph_fontsize}
 
@@ -215,10 +442,10 @@ class Pulse(object):
         by the kwargs passed to this function.
 
         """
-        p = self.patch()
+        xy = self.vertices()
         center = int(self.npoints // 2)
-        xpos = p.xy[:, 0][center] + self.text_dx
-        ypos = p.xy[:, 1][center] / 2 + p.xy[:, 1].min() / 2 + self.text_dy
+        xpos = xy[:, 0][center] + self.text_dx
+        ypos = xy[:, 1][center] / 2 + xy[:, 1].min() / 2 + self.text_dy
 
         # xpos = self.start_time + self.plen / 2 + self.text_dx
         # ypos = self.power / 2 + self.channel + self.text_dy
@@ -262,19 +489,23 @@ class Pulse(object):
         except ValueError:
             raise ValueError("Pulse Power can only be increased by constant factor")
 
-    def get_shape(self):
+    def get_shape(self, npoints=None):
         """
         Returns the shape of the pulse on an array from 0 to 1
+        with npoints points (defaults to the npoints of the pulse)
 
         """
+        if npoints is None:
+            npoints = self.npoints
+
         if callable(self.shape):
-            shape_array = self.shape(np.linspace(0, 1, self.npoints))
+            shape_array = self.shape(np.linspace(0, 1, npoints))
 
         elif isinstance(self.shape, str):
-            shape_array = Shape(self.shape, self.npoints).get_shape()
+            shape_array = Shape(self.shape, npoints).get_shape()
 
         else:
-            shape_array = np.ones(self.npoints)
+            shape_array = np.ones(npoints)
 
         return shape_array * self.power
 
@@ -314,27 +545,111 @@ class Pulse(object):
             else:
                 return self.start_time + self.plen
 
-    def patch(self, **kwargs):
+    def origin(self):
         """
-        Gets the matplotlib.patches.Polygon patch for the pulse
-        to be added on to an matplotlib Axes object
+        Gets the (x, y) position of the lower left corner
+        of the pulse, i.e. where the first vertex returned
+        by local_vertices is placed
 
         """
-        x = self.time_array()
-        y = self.get_shape()
+        if self.centered:
+            return self.start_time - self.plen / 2, self.channel
+        else:
+            return self.start_time, self.channel
 
-        if not self.truncate_off:
-            vertices = [[x[0], self.channel]]
+    def local_vertices(self, npoints=None, oversample=1, decimation="minmax"):
+        """
+        Gets the vertices of the pulse relative to its origin, with
+        npoints points on the shape (defaults to the npoints of the
+        pulse). The returned array is read-only, since it is shared
+        between all pulses with the same geometry.
 
-        else:
-            vertices = []
+        With oversample > 1, the shape is computed on oversample times
+        the npoints of the pulse, and then reduced to npoints points
+        with the minmax or lttb decimation (see pulseplot.shapes), so
+        that fast oscillations (as in fids) are not aliased.
+
+        """
+        if npoints is None:
+            npoints = self.npoints
+
+        key = self.geometry_key(npoints, oversample, decimation)
+
+        try:
+            return OUTLINES[key]
+        except KeyError:
+            pass
+
+        if oversample > 1:
+            samples = self.npoints * oversample
+            x = np.linspace(0, 1, samples)
+            x, y = decimate_outline(x, self.get_shape(samples), npoints, decimation)
+            x = x * self.plen
 
-        for v in [[i, j + self.channel] for i, j in zip(x, y)]:
-            vertices.append(v)
+        else:
+            x = np.linspace(0, self.plen, npoints)
+            y = self.get_shape(npoints)
 
         if not self.truncate_off:
-            vertices.append([x[-1], self.channel])
+            x = np.concatenate([x[:1], x, x[-1:]])
+            y = np.concatenate([[0.0], y, [0.0]])
+
+        vertices = np.column_stack([x, y])
+        vertices.flags.writeable = False
+
+        if key is not None:
+            OUTLINES[key] = vertices
 
+        return vertices
+
+    def vertices(self):
+        """
+        Gets the vertices of the pulse at its actual position
+
+        """
+        return self.local_vertices() + self.origin()
+
+    def geometry_key(self, npoints=None, oversample=1, decimation="minmax"):
+        """
+        Gets a hashable key that identifies the outline of the
+        pulse independent of where it is placed. Pulses with
+        the same key can share a single path. Returns None if
+        the shape cannot be hashed. Keys of shapes from files
+        change when the file does.
+
+        """
+        key = (
+            self.shape,
+            self.npoints if npoints is None else npoints,
+            self.plen,
+            self.power,
+            self.truncate_off,
+            self.open,
+        )
+
+        if oversample > 1:
+            key += (self.npoints, oversample, decimation)
+
+        if isinstance(self.shape, str) and self.shape.startswith(FILE_PREFIX):
+            try:
+                key += shape_stamp(self.shape[len(FILE_PREFIX) :])
+            except (OSError, ValueError):
+                # the error is raised when the shape is made
+                return None
+
+        try:
+            hash(key)
+        except TypeError:
+            return None
+
+        return key
+
+    def style_params(self, **kwargs):
+        """
+        Gets the keyword arguments that style the patch
+        for the pulse
+
+        """
         patch_params = {
             "facecolor": self.facecolor,
             "edgecolor": self.edgecolor,
@@ -343,9 +658,19 @@ class Pulse(object):
             **self.style_kw,
         }
 
-        patch_params = {**patch_params, **kwargs}
+        return {**patch_params, **kwargs}
+
+    def patch(self, **kwargs):
+        """
+        Gets the matplotlib.patches.Polygon patch for the pulse
+        to be added on to an matplotlib Axes object
+
+        """
+        from matplotlib.patches import Polygon
 
-        pulse_patch = Polygon(vertices, closed=not self.open, **patch_params)
+        pulse_patch = Polygon(
+            self.vertices(), closed=not self.open, **self.style_params(**kwargs)
+        )
 
         return pulse_patch
 
@@ -382,7 +707,8 @@ class Delay(Pulse):
         except TypeError as e:
             raise TypeError("All arguments without a keyword should be strings")
 
-        args = parse_base(self.args, external_params)
+        sources = {}
+        args = parse_base(self.args, external_params, sources)
 
         # check that the parsig is OK, remove things that are not required
         if args["plen"] is not None:
@@ -410,13 +736,17 @@ class Delay(Pulse):
             except json.decoder.JSONDecodeError as e:
                 raise ValueError(f"The input {args[item]} is not understood.")
 
-        self.__dict__ = {**self.__dict__, **args, **params}
+        self.__dict__.update(args)
+        self.__dict__.update(params)
 
         self.plen = self.time
         self.facecolor = "none"
         self.edgecolor = "none"
         self.power = PULSE_DEFAULTS["power"]
 
+        sources.pop("power", None)
+        self._keep_sources(sources, params)
+
     def __mul__(self, constant):
         """Increases the delay by a given factor"""
 
@@ -438,7 +768,7 @@ class PulseSeq(object):
     """Docstring for PulseSeq. """
 
     def __init__(
-        self, sequence, external_params={},
+        self, sequence, external_params={}, phase_cycle=None,
     ):
         """TODO: to be defined.
 
@@ -452,6 +782,15 @@ class PulseSeq(object):
         self.named_elements = {}
         self.input_string = ""
 
+        # kept so that expressions can be evaluated again (see sweep)
+        self.external_params = dict(external_params)
+
+        # bumped when the elements change, see invalidate
+        self._version = 0
+
+        # phases of the labelled phases in each scan, see pulseplot.cycle
+        self.phase_cycle = dict(phase_cycle or {})
+
         if isinstance(sequence, str):
             self.input_string = sequence
             self.args = [i for i in sequence.split("\n") if i.strip()]
@@ -484,8 +823,69 @@ class PulseSeq(object):
             if element.name:
                 self.named_elements[element.name] = i
 
+    def __getstate__(self):
+        """
+        Sequences made from a string are pickled without the lines
+        of the string, which are split again when unpickled
+
+        """
+        state = dict(self.__dict__)
+        del state["named_elements"]
+        state.pop("_timeline", None)
+
+        # a loaded sequence is pickled with its elements
+        state.pop("_source", None)
+        state["elements"] = self.elements
+
+        if self.input_string:
+            del state["args"]
+
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        self.__dict__.setdefault("phase_cycle", {})
+        self.__dict__.setdefault("external_params", {})
+        self.__dict__.setdefault("_version", 0)
+
+        if "args" not in state:
+            self.args = [i for i in self.input_string.split("\n") if i.strip()]
+            self.args = [i.split("#")[0] for i in self.args if i.split("#")[0]]
+
+        if "named_elements" not in state:
+            self.named_elements = {
+                element.name: i
+                for i, element in enumerate(self.elements)
+                if element.name
+            }
+
+    def __getattr__(self, name):
+        # the elements of a loaded sequence are made when they are
+        # first used, see Timeline.to_sequence
+        source = self.__dict__.get("_source")
+
+        if name != "elements" or source is None:
+            raise AttributeError(f"'PulseSeq' object has no attribute '{name}'")
+
+        self.elements = source.to_elements()
+        del self._source
+
+        return self.elements
+
+    def invalidate(self):
+        """
+        Tells the sequence that its elements were changed directly
+        (not with edit or a selection), so that what was compiled
+        from them (see select) is compiled again
+
+        """
+        self._version += 1
+
     def edit(self, index=None, name=None, **kwargs):
 
+        self.invalidate()
+
         if index is not None:
             self.elements[index].__dict__.update(kwargs)
 
@@ -497,6 +897,113 @@ class PulseSeq(object):
 
             self.elements[index].__dict__.update(kwargs)
 
+    def select(self, *predicates, **criteria):
+        """
+        Selects elements by their parameters, e.g. channel=2, shape="gauss"
+        or phase=["x", "y"], and by predicates on the compiled sequence (see
+        Timeline.select). Edits of the selection are applied to all the
+        selected elements at once. Call invalidate() after changing
+        elements directly.
+
+        >>> sequence.select(channel=2).edit(facecolor="red")
+
+        """
+        from .timeline import Selection, Timeline
+
+        # the compiled sequence is kept for later selections, until the
+        # elements are edited (see invalidate) or the list of elements
+        # changes
+        cached = self.__dict__.get("_timeline")
+
+        if cached is not None and cached[0] == self._timeline_key():
+            timeline = cached[1]
+        else:
+            timeline = Timeline.compile(self)
+            self._timeline = (self._timeline_key(), timeline)
+
+        return Selection(timeline, sequence=self).select(*predicates, **criteria)
+
+    def _timeline_key(self):
+        return self._version, tuple(map(id, self.elements))
+
+    def scans(self, scans=None, phase_cycle=None):
+        """
+        Expands the phase cycle (by default, the phase_cycle of the
+        sequence) to a ScanView of the first scans (by default, one
+        full cycle). The sequence is not parsed again, and the scans
+        share all elements but the ones with cycled phases.
+
+        >>> sequence.phase_cycle = {"ph1": "x y -x -y", "phrec": "x -y -x y"}
+        >>> for scan in sequence.scans():
+        ...     ax.pseq(scan)
+
+        """
+        from .cycle import ScanView
+
+        if phase_cycle is None:
+            phase_cycle = self.phase_cycle
+
+        return ScanView(self, phase_cycle, scans)
+
+    def compile(self, spacing=0.0, time=0.0):
+        """
+        Compiles the sequence into a Timeline (see pulseplot.timeline)
+
+        """
+        from .timeline import Timeline
+
+        return Timeline.compile(self, spacing=spacing, time=time)
+
+    def export(self, file, fmt=None, spacing=0.0, time=0.0, chunksize=65536):
+        """
+        Writes the timing of the elements (element, kind, channel, start,
+        end, power, shape, phase, name) to a csv, npz or jsonl file,
+        without drawing the sequence. See Timeline.export.
+
+        """
+        self.compile(spacing=spacing, time=time).export(
+            file, fmt=fmt, chunksize=chunksize
+        )
+
+    def waveform(
+        self, channel, dt, spacing=0.0, time=0.0, start=None, stop=None, chunksize=None
+    ):
+        """
+        Samples the amplitude of the pulses on a channel every dt, see
+        Timeline.waveform. Sample k is at start + k * dt, where start
+        defaults to the start of the sequence.
+
+        """
+        return self.compile(spacing=spacing, time=time).waveform(
+            channel, dt, start=start, stop=stop, chunksize=chunksize
+        )
+
+    def sweep(self, params, spacing=0.0, time=0.0):
+        """
+        Compiles the sequence once, and places it again for each of many
+        sets of parameters, see Timeline.sweep. Values given as
+        expressions (p={2*p1}) or external parameters (p1) are
+        evaluated again for each set, with the external parameters
+        of the sequence for the names that a set does not have.
+
+        """
+        return self.compile(spacing=spacing, time=time).sweep(params)
+
+    def save(self, path):
+        """
+        Saves the sequence in the binary timeline format,
+        which is loaded without parsing the sequence again
+
+        """
+        self.compile().save(path)
+
+    @classmethod
+    def load(cls, path):
+
+        from .timeline import Timeline
+
+        return Timeline.load(path).to_sequence()
+
     def __len__(self):
         return len(self.elements)
 
@@ -518,6 +1025,11 @@ class Shape(object):
     def guess_pars(self):
         """Guesses the shape name and any parameters separated by _"""
         new_pars = ["", None, None]
+
+        # shape files (file:<name>) can have any name
+        if self.input.startswith(FILE_PREFIX):
+            return ["file", self.input[len(FILE_PREFIX) :], None]
+
         pars = self.input.split("_")
 
         try:
@@ -542,6 +1054,10 @@ class Shape(object):
 
     def get_shape(self):
         """Returns the shape after introspecting the passed parameters"""
+        if self.name in SHAPES:
+            pars = [p for p in self.pars if p is not None]
+            return np.asarray(SHAPES[self.name](self.xscale, *pars), dtype=float)
+
         try:
             return self.__getattribute__(self.name)(*self.pars)
         except AttributeError:
@@ -554,6 +1070,10 @@ class Shape(object):
         """Square shaped pulse, use here as a fallback"""
         return np.ones(self.npoints)
 
+    def file(self, name, *args, **kwargs):
+        """Shape read from a file, see pulseplot.shapes"""
+        return file_shape(name, self.npoints)
+
     def gauss(self, x0, sigma, *args, **kwargs):
         "Gaussian shaped pulse"
         if x0 is None:
@@ -0,0 +1,133 @@
+"""
+Pool of reusable figures for rendering many diagrams in memory
+
+"""
+
+import queue
+from contextlib import contextmanager
+from io import BytesIO
+
+from .pulseplot import PulseProgram
+from .render import check_settings, draw_on, new_figure
+
+
+class FigurePool(object):
+    """
+    A fixed number of figures, each with one PulseProgram, that are
+    built once and reused for every render. A figure is reset when it
+    is taken from the pool and is used by only one caller at a time,
+    so the pool can be shared by the threads of a thread pool.
+
+    >>> pool = FigurePool(size=4, figsize=(4, 1))
+    >>> png = pool.render(r"p1 ph1 fc=black", fmt="png", dpi=100)
+
+    """
+
+    def __init__(self, size=4, figsize=(8, 2.5), layout="constrained", warm=True):
+
+        self.size = size
+        self.figsize = tuple(figsize)
+        self.layout = layout
+
+        # last in, first out, so that the most recently used
+        # (and so, warmest) figures are used first
+        self._free = queue.LifoQueue()
+
+        for _ in range(size):
+            fig, ax = self._build()
+            if warm:
+                draw_on(ax, r"p1 ph1 tx=$\tau$")
+                fig.canvas.draw()
+            self._free.put((fig, ax))
+
+    def _build(self):
+        fig = new_figure(figsize=self.figsize, layout=self.layout)
+        ax = fig.add_subplot(axes_class=PulseProgram)
+
+        return fig, ax
+
+    def _restore(self, fig, ax):
+        """
+        Resets a figure taken from the pool, or builds a new
+        one if the old one was changed beyond the axes
+
+        """
+        if fig.axes != [ax] or fig.artists or fig.texts or fig.legends:
+            return self._build()
+
+        if tuple(fig.get_size_inches()) != self.figsize:
+            fig.set_size_inches(self.figsize)
+
+        ax.reset()
+
+        return fig, ax
+
+    @contextmanager
+    def figure(self, timeout=None):
+        """
+        Takes a (reset) figure and its PulseProgram from the pool,
+        and puts it back afterwards. Waits for at most timeout
+        seconds (forever if None) for a figure to be free.
+
+        >>> with pool.figure() as (fig, ax):
+        ...     ax.pseq("p1 ph1")
+        ...     fig.savefig(buffer, format="svg")
+
+        """
+        try:
+            fig, ax = self._free.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No free figure in the pool") from None
+
+        try:
+            fig, ax = self._restore(fig, ax)
+            yield fig, ax
+        finally:
+            self._free.put((fig, ax))
+
+    def render_to(
+        self,
+        buffer,
+        sequence,
+        params=None,
+        fmt="png",
+        dpi=150,
+        channels=None,
+        figsize=None,
+        timeout=None,
+        **settings,
+    ):
+        """
+        Draws the sequence on a figure from the pool and saves it into
+        buffer (a BytesIO or any other binary file-like object).
+        settings are attributes of PulseProgram, as in render.render.
+        The figure size of the pool is used unless figsize is given.
+
+        """
+        check_settings(settings)
+
+        with self.figure(timeout=timeout) as (fig, ax):
+            if figsize is not None:
+                fig.set_size_inches(figsize)
+            draw_on(ax, sequence, params=params, channels=channels, **settings)
+            fig.savefig(buffer, format=fmt, dpi=dpi)
+
+        return buffer
+
+    def render(self, sequence, params=None, fmt="png", dpi=150, **kwargs):
+        """
+        Same as render_to, but returns the image as bytes
+
+        """
+        buffer = self.render_to(
+            BytesIO(), sequence, params=params, fmt=fmt, dpi=dpi, **kwargs
+        )
+
+        return buffer.getvalue()
+
+    def free(self):
+        """
+        Number of figures that are not in use
+
+        """
+        return self._free.qsize()
@@ -3,10 +3,15 @@ Utilities for making plots
 
 """
 from warnings import warn
-import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.axes import Axes
 from matplotlib.projections import register_projection
 from matplotlib.animation import ArtistAnimation
+from matplotlib.collections import PolyCollection
+from matplotlib.transforms import Affine2D, Bbox
 
+from .artists import ElementPatch, cached_label, count_corners, outline_path
+from .labels import place_boxes
 from .parse import Delay, Pulse, PulseSeq
 
 
@@ -17,6 +22,8 @@ def subplots(*args, **kwargs):
     in subplot keywords
 
     """
+    import matplotlib.pyplot as plt
+
     register_projection(PulseProgram)
 
     if "subplot_kw" in kwargs.keys():
@@ -43,6 +50,8 @@ def subplot_mosaic(*args, **kwargs):
     in subplot keywords
 
     """
+    import matplotlib.pyplot as plt
+
     register_projection(PulseProgram)
 
     if "subplot_kw" in kwargs.keys():
@@ -70,6 +79,8 @@ def show(*args, **kwargs):
     pulse diagrams.
 
     """
+    import matplotlib.pyplot as plt
+
     plt.show(*args, **kwargs)
 
     return
@@ -84,7 +95,7 @@ def animation(*args, **kwargs):
     return ArtistAnimation(*args, **kwargs)
 
 
-class PulseProgram(plt.Axes):
+class PulseProgram(Axes):
     """
     A class that defines convinience functions for
     plotting elements of a NMR pulse squence on a
@@ -108,28 +119,141 @@ class PulseProgram(plt.Axes):
 
     name = "PulseProgram"
 
+    # share one path between pulses with identical geometry
+    instancing = True
+
+    # number of points on shapes follows their width in pixels
+    adaptive_npoints = False
+
+    # compute shapes on oversample times their np points, and reduce
+    # them back with the "minmax" or "lttb" decimation
+    oversample = 1
+    decimation = "minmax"
+
+    # draw labels from cached text outlines instead of Text artists
+    cache_labels = False
+
+    # move labels so that they do not overlap (see pulseplot.labels),
+    # keeping at least label_pad points between them
+    avoid_overlaps = False
+    label_pad = 1.0
+
+    # skip elements outside the x-limits while drawing, and (with lod)
+    # collapse runs of elements narrower than lod_pixels into a single
+    # envelope, in the colour of the elements it replaces unless
+    # lod_style has a facecolor
+    culling = True
+    cull_margin = 50
+    lod = False
+    lod_pixels = 1.0
+    lod_style = {"edgecolor": "none", "linewidth": 0}
+
+    # in vector outputs (svg, pdf), draw as images the elements with
+    # more than rasterize_vertices corners, hatches of at least
+    # rasterize_hatch strokes ("////" has 4), and runs of at least
+    # rasterize_train identical pulses on a channel (see rasterize), and
+    # keep vector_digits decimals in the outlines of the others
+    rasterize_vertices = None
+    rasterize_hatch = None
+    rasterize_train = None
+    vector_digits = None
+
+    # limits before anything is drawn
+    initial_limits = {
+        "xlow": 10,
+        "xhigh": -10,
+        "ylow": 10,
+        "yhigh": -10,
+        "dx": 0.1,
+        "dy": 0.1,
+    }
+
     def __init__(self, *args, **kwargs):
 
+        # the time, limits and sequence are set in clear(),
+        # which is called by Axes.__init__
         super().__init__(*args, **kwargs)
 
+        self.reset_style()
+
+    def reset_style(self):
+        """
+        Sets the spacing, alignment, offsets, fontsize and external
+        parameters back to their defaults, and removes any drawing
+        options (instancing, culling, etc.) set on this axes
+
+        """
         self.center_align = False
         self.spacing = 0.0
         self.phase_dy = 0.0
         self.text_dy = 0.0
         self.fontsize = None
-        self.time = 0.0
         self.params = {}
-        self.limits = {
-            "xlow": 10,
-            "xhigh": -10,
-            "ylow": 10,
-            "yhigh": -10,
-            "dx": 0.1,
-            "dy": 0.1,
-        }
 
-        self.set_limits()
-        self.axis(False)
+        for option in (
+            "instancing",
+            "adaptive_npoints",
+            "oversample",
+            "decimation",
+            "cache_labels",
+            "avoid_overlaps",
+            "label_pad",
+            "culling",
+            "cull_margin",
+            "lod",
+            "lod_pixels",
+            "lod_style",
+            "rasterize_vertices",
+            "rasterize_hatch",
+            "rasterize_train",
+            "vector_digits",
+        ):
+            self.__dict__.pop(option, None)
+
+    def reset(self):
+        """
+        Brings the axes back to the state of a new PulseProgram,
+        so that it can be reused for another sequence.
+
+        This is much faster than clear(), since it only removes what
+        has been drawn and does not rebuild the axis, ticks and spines
+        of matplotlib, which are hidden on a PulseProgram. If the axis
+        has been turned on, everything is cleared.
+
+        """
+        if self.axison:
+            self.clear()
+
+        else:
+            for artists in (
+                self.patches,
+                self.lines,
+                self.texts,
+                self.collections,
+                self.images,
+                self.artists,
+                self.tables,
+            ):
+                for artist in list(artists):
+                    artist.remove()
+
+            for loc in ("left", "center", "right"):
+                self.set_title("", loc=loc)
+
+            self.dataLim.set_points(Bbox.null().get_points())
+            self.ignore_existing_data_limits = True
+
+            self._reset_state()
+            self.set_limits()
+
+        # layout engines start from the current position, so a
+        # reused axes is put back where a new one would be
+        spec = self.get_subplotspec()
+        if spec is not None:
+            self.set_position(spec.get_position(self.figure))
+            self.set_in_layout(True)
+
+        self.reset_style()
 
     def pulse(self, *args, **kwargs):
 
@@ -154,36 +278,48 @@ class PulseProgram(plt.Axes):
             if "fontsize" not in p.phase_kw:
                 p.phase_kw["fontsize"] = self.fontsize
 
-        # add the actual pulse
-        pulse_patch = p.patch()
-        super().add_patch(pulse_patch)
-
-        xarr, yarr = pulse_patch.xy[:, 0], pulse_patch.xy[:, 1]
+        # add the actual pulse, the outline is only built when drawn
+        x0, y0 = p.origin()
+        xmin, xmax, ymin, ymax = self.shared_extents(p)
 
         if self.center_align:
-            center = (yarr.min() + yarr.max()) / 2.0 - yarr.min()
-            yarr -= center
-            pulse_patch.xy[:, 1] = yarr
+            center = (ymin + ymax) / 2.0 - ymin
+            y0 -= center
 
             p.text_dy -= center
             p.phtxt_dy -= center
 
+        pulse_patch = ElementPatch(
+            p,
+            (x0, y0),
+            adaptive=self.adaptive_npoints,
+            transform=Affine2D().translate(x0, y0) + self.transData,
+            **p.style_params(),
+        )
+        # the extents are already known, so skip the (slow) walk over
+        # the path that add_patch does to update the data limits
+        self.add_artist(pulse_patch)
+        self.update_datalim([(x0 + xmin, y0 + ymin), (x0 + xmax, y0 + ymax)])
+
         self.edit_limits(
-            xlow=xarr.min(), xhigh=xarr.max(), ylow=yarr.min(), yhigh=yarr.max()
+            xlow=x0 + xmin, xhigh=x0 + xmax, ylow=y0 + ymin, yhigh=y0 + ymax
         )
 
         p.start_time -= self.spacing
         p.plen += 2 * self.spacing
 
+        labels = []
+
         try:
-            super().text(**p.label_params())
+            labels.append(self.add_label(**p.label_params()))
             xpos, ypos = p.label_params["x"], p.label_params["y"]
             self.edit_limits(xlow=xpos, xhigh=xpos, ylow=ypos, yhigh=ypos)
         except:
             pass
 
         try:
-            super().text(**p.phase_params())
+            pulse_patch.phase_label = self.add_label(**p.phase_params())
+            labels.append(pulse_patch.phase_label)
             xpos, ypos = p.phase_params["x"], p.phase_params["y"]
             self.edit_limits(xlow=xpos, xhigh=xpos, ylow=ypos, yhigh=ypos)
         except:
@@ -192,6 +328,397 @@ class PulseProgram(plt.Axes):
         p.text_dy -= self.text_dy
         p.phtxt_dy -= self.phase_dy
 
+        # delays are usually patches with nothing to draw, leave
+        # them out of the draw altogether
+        if isinstance(p, Delay) and _draws_nothing(pulse_patch):
+            self._invisible.add(pulse_patch)
+
+        self.index.add(
+            x0 + xmin,
+            x0 + xmax,
+            y0 + ymin,
+            y0 + ymax,
+            [pulse_patch] + labels,
+            collapsible=not isinstance(p, Delay),
+        )
+
+    def remove_elements(self, start):
+        """
+        Removes the elements drawn from index start onward (in the
+        order in which they were drawn), along with their labels.
+        The time and the limits are left as they are.
+
+        """
+        for artist in self.index.truncate(start):
+            artist.remove()
+            self._invisible.discard(artist)
+
+    def draw(self, renderer):
+
+        if self.avoid_overlaps:
+            self.place_labels(renderer)
+
+        if self._raster_classes or self.rasterizes():
+            self.rasterize()
+
+        if self.culling and len(self.index):
+            self._culled, self._envelope = self.cull()
+
+        try:
+            super().draw(renderer)
+        finally:
+            self._culled, self._envelope = None, None
+
+    def rasterizes(self):
+        """
+        Checks if any of the rasterize_* options is set
+
+        """
+        return not (
+            self.rasterize_vertices is None
+            and self.rasterize_hatch is None
+            and self.rasterize_train is None
+        )
+
+    def rasterize(self):
+        """
+        Marks the elements picked by the rasterize_* options to be drawn
+        as images in vector outputs (with the per-artist rasterization
+        of matplotlib), and unmarks the elements it marked before that
+        are no longer picked. Consecutive marked elements go into one
+        image. Returns a dict from the patch of each marked element to
+        why it was picked: "dense", "hatched" or "train".
+
+        """
+        patches = self.index.patches()
+        state = (
+            self.rasterize_vertices,
+            self.rasterize_hatch,
+            self.rasterize_train,
+            len(patches),
+            id(patches[-1]) if patches else None,
+        )
+
+        if state == self._raster_state:
+            return self._raster_classes
+
+        classes = {}
+        runs = {}
+
+        for patch in patches:
+            element = patch.element
+
+            if isinstance(element, Delay):
+                if self._rasterizes_hatch(patch):
+                    classes[patch] = "hatched"
+                continue
+
+            if (
+                self.rasterize_vertices is not None
+                and self.corners(patch) > self.rasterize_vertices
+            ):
+                classes[patch] = "dense"
+            elif self._rasterizes_hatch(patch):
+                classes[patch] = "hatched"
+
+            geometry = element.geometry_key()
+
+            if self.rasterize_train is not None and geometry is not None:
+                key = (
+                    geometry,
+                    tuple(patch.get_facecolor()),
+                    tuple(patch.get_edgecolor()),
+                    patch.get_hatch(),
+                )
+                run = runs.get(element.channel)
+                if run is None or run[0] != key:
+                    run = runs[element.channel] = (key, [])
+                run[1].append(patch)
+
+                if len(run[1]) >= self.rasterize_train:
+                    for member in run[1]:
+                        classes.setdefault(member, "train")
+
+        for patch in self._raster_classes:
+            if patch not in classes:
+                patch.set_rasterized(False)
+
+        for patch in classes:
+            patch.set_rasterized(True)
+
+        self._raster_classes, self._raster_state = classes, state
+
+        return classes
+
+    def _rasterizes_hatch(self, patch):
+        return (
+            self.rasterize_hatch is not None
+            and len(patch.get_hatch() or "") >= self.rasterize_hatch
+        )
+
+    def corners(self, patch):
+        """
+        Number of corners on the outline of the element of a patch
+        (see artists.count_corners), counted once for each geometry
+
+        """
+        key = patch.element.geometry_key()
+
+        try:
+            return self._corners[key]
+        except KeyError:
+            pass
+
+        corners = count_corners(patch._get_outline(None).vertices)
+
+        if key is not None:
+            self._corners[key] = corners
+
+        return corners
+
+    def get_children(self):
+
+        children = super().get_children()
+
+        if self._culled:
+            culled = self._culled
+            children = [a for a in children if a not in culled]
+
+        if self._envelope is not None:
+            children.append(self._envelope)
+
+        return children
+
+    def cull(self):
+        """
+        Finds the artists that do not need to be drawn with the current
+        x-limits. Returns the set of these artists and a collection that
+        replaces the elements too narrow to be seen (None if there are
+        no such elements).
+
+        """
+        index = self.index
+        x0, x1 = sorted(self.get_xlim())
+
+        # pixels per unit time
+        (px0, _), (px1, _) = self.transData.transform([(x0, 0), (x1, 0)])
+        scale = abs(px1 - px0) / (x1 - x0) if x1 > x0 else 0.0
+        margin = self.cull_margin / scale if scale else 0.0
+
+        hidden = (index.xhigh < x0 - margin) | (index.xlow > x1 + margin)
+
+        envelope = None
+        narrow = (index.xhigh - index.xlow) * scale < self.lod_pixels
+        narrow &= ~hidden & index.collapsible
+
+        if self.lod and narrow.any():
+            # only collapse elements that share a pixel column with
+            # another narrow element on the same channel
+            which = np.flatnonzero(narrow)
+            column = np.floor((index.xlow[which] - x0) * scale).astype(int)
+            _, channel = np.unique(index.ylow[which], return_inverse=True)
+            _, bins, counts = np.unique(
+                np.column_stack([channel, column]),
+                axis=0,
+                return_inverse=True,
+                return_counts=True,
+            )
+            bins = bins.ravel()
+            dense = counts[bins] > 1
+
+            if dense.any():
+                envelope = self.envelope(
+                    bins[dense],
+                    column[dense],
+                    index.ylow[which][dense],
+                    index.yhigh[which][dense],
+                    x0,
+                    scale,
+                    which[dense],
+                )
+                hidden[which[dense]] = True
+
+        culled = set(index.artists_where(hidden)) | self._invisible
+        self.draw_stats = {
+            "elements": len(index),
+            "culled": int(hidden.sum()),
+            "collapsed": 0 if envelope is None else len(envelope.get_paths()),
+        }
+
+        return culled, envelope
+
+    def envelope(self, bins, column, ylow, yhigh, x0, scale, rows):
+        """
+        Makes a collection of one-pixel wide bars that cover the
+        vertical extent of the elements in each (channel, pixel) bin.
+        Each bar has the colour of the first element (rows are the
+        entries of the index) in its bin: the edge colour, which is
+        most of what shows of an element narrower than a pixel, or
+        the face colour of elements drawn without an edge.
+
+        """
+        nbins = bins.max() + 1
+
+        low = np.full(nbins, np.inf)
+        high = np.full(nbins, -np.inf)
+        np.minimum.at(low, bins, ylow)
+        np.maximum.at(high, bins, yhigh)
+
+        left = np.zeros(nbins)
+        left[bins] = x0 + column / scale
+        right = left + 1 / scale
+
+        verts = np.stack(
+            [
+                np.column_stack([left, low]),
+                np.column_stack([left, high]),
+                np.column_stack([right, high]),
+                np.column_stack([right, low]),
+            ],
+            axis=1,
+        )
+
+        style = dict(self.lod_style)
+        if "facecolor" not in style:
+            _, first = np.unique(bins, return_index=True)
+            colours = np.zeros((nbins, 4))
+            colours[bins[first]] = [self.index.colour(i) for i in rows[first].tolist()]
+            style["facecolor"] = colours
+
+        envelope = PolyCollection(verts, **style)
+        self._set_artist_props(envelope)
+
+        return envelope
+
+    def shared_path(self, pulse, npoints=None):
+        """
+        Gets the path for the outline of a pulse relative to its origin.
+        Pulses with the same geometry get the same (read-only) path,
+        so that repeated elements are only built once.
+
+        """
+        sampling = self.shape_sampling()
+        key = pulse.geometry_key(npoints, **sampling) if self.instancing else None
+
+        try:
+            return self._paths[key]
+        except KeyError:
+            pass
+
+        path = outline_path(pulse, npoints, **sampling)
+
+        if key is not None:
+            self._paths[key] = path
+
+        return path
+
+    def shape_sampling(self):
+        """
+        Keyword arguments for Pulse.local_vertices that
+        set how shapes are sampled on this axes
+
+        """
+        return {"oversample": self.oversample, "decimation": self.decimation}
+
+    def shared_extents(self, pulse):
+        """
+        Gets the extents (xmin, xmax, ymin, ymax) of the outline of
+        a pulse relative to its origin without building its path
+
+        """
+        vertices = pulse.local_vertices(**self.shape_sampling())
+        xarr, yarr = vertices[:, 0], vertices[:, 1]
+
+        return xarr.min(), xarr.max(), yarr.min(), yarr.max()
+
+    def add_label(self, **kwargs):
+        """
+        Adds a text annotation, taking the same keyword arguments as
+        ax.text. If cache_labels is set, the label is drawn from
+        a cached outline of the text, so that the mathtext for
+        repeated labels is only parsed and laid out once. Nothing
+        is added if there is no text (s is None).
+
+        """
+        if kwargs.get("s") is None:
+            return None
+
+        label = None
+        if self.cache_labels:
+            label = cached_label(self, **kwargs)
+
+        if label is not None:
+            label = self.add_artist(label)
+        else:
+            label = super().text(**kwargs)
+
+        self._labels.append(label)
+
+        return label
+
+    def place_labels(self, renderer=None):
+        """
+        Moves the labels (texts and phases) so that they do not overlap,
+        see pulseplot.labels. Each label is measured once, and is always
+        moved from the position it was first given, so the labels are
+        placed again (the same way) when the limits or the size of the
+        figure change. Called when drawing if avoid_overlaps is set.
+
+        """
+        self._labels = [label for label in self._labels if label.axes is self]
+
+        # hidden labels (e.g. of other scans, see pulseplot.cycle) take no room
+        visible = [label.get_visible() for label in self._labels]
+        labels = [label for label, shown in zip(self._labels, visible) if shown]
+
+        transform = self.transData
+        state = (
+            transform.get_matrix().tobytes(),
+            self.figure.dpi,
+            self.label_pad,
+            len(visible),
+            np.packbits(visible).tobytes(),
+        )
+        if not labels or state == self._label_state:
+            return
+
+        renderer = renderer or self.figure.canvas.get_renderer()
+
+        origins = self._label_origins
+        xy = np.array([origins.setdefault(a, a.get_position()) for a in labels], float)
+        anchors = transform.transform(xy)
+
+        # size of each label, and where its center is from its anchor
+        boxes = []
+        for label, anchor in zip(labels, anchors):
+            key = (label, self.figure.dpi)
+            try:
+                box = self._label_boxes[key]
+            except KeyError:
+                label.set_position(origins[label])
+                extent = label.get_window_extent(renderer)
+                box = (
+                    extent.width,
+                    extent.height,
+                    extent.x0 + extent.width / 2 - anchor[0],
+                    extent.y0 + extent.height / 2 - anchor[1],
+                )
+                self._label_boxes[key] = box
+            boxes.append(box)
+
+        width, height, cx, cy = np.array(boxes).T
+        pad = self.label_pad * self.figure.dpi / 72.0
+
+        dx, dy = place_boxes(
+            anchors[:, 0] + cx, anchors[:, 1] + cy, width, height, pad=pad
+        )
+
+        moved = transform.inverted().transform(anchors + np.column_stack([dx, dy]))
+        for label, position, shifted in zip(labels, moved, (dx != 0) | (dy != 0)):
+            label.set_position(tuple(position) if shifted else origins[label])
+
+        self._label_state = state
+
     def delay(self, *args, **kwargs):
 
         if isinstance(args[0], Delay):
@@ -206,7 +733,8 @@ class PulseProgram(plt.Axes):
         self.time += d.time
 
         try:
-            super().text(**d.label_params())
+            label = self.add_label(**d.label_params())
+            self.index.add(d.start_time, d.start_time + d.time, 0, 0, [label])
         except:
             pass
 
@@ -223,12 +751,35 @@ class PulseProgram(plt.Axes):
 
     def clear(self):
         """
-        Removes all channels and resets the time to zero
+        Removes all channels, and resets the time, the
+        limits and the sequence. The style is kept, see reset().
 
         """
-        self.time = 0.0
+        self._reset_state()
         super().clear()
 
+        self.set_limits()
+        self.axis(False)
+
+    def _reset_state(self):
+        self.time = 0.0
+        self.limits = dict(self.initial_limits)
+        self.sequence = None
+        self._paths = {}
+        self.index = ElementIndex()
+        self._culled = None
+        self._envelope = None
+        self._invisible = set()
+        self._labels = []
+        self._label_origins = {}
+        self._label_boxes = {}
+        self._label_state = None
+        self._raster_classes = {}
+        self._raster_state = None
+        self._corners = {}
+        self._hold_limits = False
+        self.draw_stats = {}
+
     def draw_channels(self, *args, **kwargs):
         """
         Draws lines marking the channels
@@ -263,14 +814,65 @@ class PulseProgram(plt.Axes):
         if isinstance(instruction, str):
             instruction = PulseSeq(instruction, external_params=self.params)
 
-        for item in instruction.elements:
-            if isinstance(item, Pulse):
-                self.pulse(item)
-            elif isinstance(item, Delay):
-                self.delay(item)
+        anchors = self.resolve_anchors(instruction)
+
+        # apply the limits once at the end instead of after every element
+        self._hold_limits = True
+
+        try:
+            for i, item in enumerate(instruction.elements):
+                if i in anchors:
+                    self.anchored(item, anchors[i])
+                elif isinstance(item, Pulse):
+                    self.pulse(item)
+                elif isinstance(item, Delay):
+                    self.delay(item)
+        finally:
+            self._hold_limits = False
+            self.set_limits()
 
         self.sequence = instruction
 
+    def resolve_anchors(self, sequence, time=None):
+        """
+        Gets the times at which the anchored elements (an=...) of a
+        sequence are placed, by index, when it is drawn from the given
+        time (by default, the current time). Anchors can point to elements
+        that come later, so they are resolved on the compiled sequence
+        (see Timeline.place).
+
+        """
+        if not any(getattr(e, "anchor", None) for e in sequence.elements):
+            return {}
+
+        from .timeline import Timeline
+
+        time = self.time if time is None else time
+        timeline = Timeline.compile(sequence, spacing=self.spacing, time=time)
+        rows = np.flatnonzero(timeline["anchor"] >= 0)
+
+        return dict(zip(rows.tolist(), timeline["clock"][rows].tolist()))
+
+    def anchored(self, element, time):
+        """
+        Draws an element as if the time were at the given time,
+        without moving the time
+
+        """
+        saved = self.time
+        flags = element.defer_start_time, element.wait, element.centered
+
+        # the anchor sets where the element starts, the
+        # other placement flags are restored afterwards
+        element.defer_start_time, element.wait, element.centered = True, True, False
+        self.time = time
+
+        try:
+            self.pulse(element)
+        finally:
+            element.defer_start_time, element.wait, element.centered = flags
+            self.time = saved
+
     def get_time(self, name=None, index=None):
 
         if name is not None:
@@ -296,6 +898,9 @@ class PulseProgram(plt.Axes):
         if limits is not None:
             self.limits = limits
 
+        if self._hold_limits:
+            return
+
         try:
             super().set_xlim(self.limits["xlow"], self.limits["xhigh"])
             super().set_ylim(self.limits["ylow"], self.limits["yhigh"])
@@ -322,3 +927,105 @@ class PulseProgram(plt.Axes):
         self.limits["dy"] = (self.limits["yhigh"] - self.limits["ylow"]) / 50
 
         self.set_limits()
+
+
+def _draws_nothing(patch):
+    """
+    Checks if a patch has no face, no edge and no hatch
+
+    """
+    return (
+        patch.get_facecolor()[3] == 0
+        and patch.get_edgecolor()[3] == 0
+        and not patch.get_hatch()
+    )
+
+
+class ElementIndex(object):
+    """
+    Horizontal and vertical extents of the elements drawn on a
+    PulseProgram, along with the artists that belong to each
+    element. Extents are kept in lists while elements are added
+    and turned into arrays when they are queried.
+
+    """
+
+    def __init__(self):
+        self._extents = []
+        self._collapsible = []
+        self._artists = []
+        self._arrays = None
+
+    def add(self, xlow, xhigh, ylow, yhigh, artists, collapsible=False):
+        """
+        Adds an element with the given extents, made up of the given artists
+
+        """
+        self._extents.append((xlow, xhigh, ylow, yhigh))
+        self._collapsible.append(collapsible)
+        self._artists.append(tuple(a for a in artists if a is not None))
+        self._arrays = None
+
+    def truncate(self, n):
+        """
+        Drops all but the first n elements, and returns the
+        artists of the elements that were dropped
+
+        """
+        artists = [a for group in self._artists[n:] for a in group]
+
+        del self._extents[n:], self._collapsible[n:], self._artists[n:]
+        self._arrays = None
+
+        return artists
+
+    def _get_arrays(self):
+        if self._arrays is None:
+            extents = np.array(self._extents, dtype=float).reshape(-1, 4)
+            self._arrays = (*extents.T, np.array(self._collapsible, dtype=bool))
+
+        return self._arrays
+
+    xlow = property(lambda self: self._get_arrays()[0])
+    xhigh = property(lambda self: self._get_arrays()[1])
+    ylow = property(lambda self: self._get_arrays()[2])
+    yhigh = property(lambda self: self._get_arrays()[3])
+    collapsible = property(lambda self: self._get_arrays()[4])
+
+    def patches(self, start=0):
+        """
+        Gets the patch of each element added from the start-th entry on,
+        in the order they were added. Delays added with delay() have no
+        patch (only a label, if any), and are skipped.
+
+        """
+        return [
+            artists[0]
+            for artists in self._artists[start:]
+            if artists and isinstance(artists[0], ElementPatch)
+        ]
+
+    def colour(self, i):
+        """
+        Colour that shows for the i-th element when it is narrower
+        than a pixel, see PulseProgram.envelope
+
+        """
+        patch = self._artists[i][0]
+        edge = patch.get_edgecolor()
+
+        if edge[3] > 0 and patch.get_linewidth() > 0:
+            return edge
+
+        return patch.get_facecolor()
+
+    def artists_where(self, mask):
+        """
+        Yields the artists of all elements selected by a boolean mask
+
+        """
+        for i in np.flatnonzero(mask):
+            yield from self._artists[i]
+
+    def __len__(self):
+        return len(self._extents)
@@ -0,0 +1,409 @@
+"""
+Rendering pulse sequences to images without pyplot
+
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+
+from .pulseplot import PulseProgram
+
+FORMATS = ("png", "svg", "pdf")
+
+# attributes of PulseProgram that can be set when rendering
+SETTINGS = {
+    "spacing": 0.0,
+    "phase_dy": 0.0,
+    "text_dy": 0.0,
+    "fontsize": None,
+    "center_align": False,
+}
+
+
+def new_figure(figsize=(8, 2.5), layout="constrained"):
+    """
+    Makes a figure that is not managed by pyplot,
+    with an Agg canvas attached to it
+
+    """
+    fig = Figure(figsize=figsize, layout=layout)
+    FigureCanvasAgg(fig)
+
+    return fig
+
+
+def draw_sequence(fig, sequence, params=None, channels=None, **settings):
+    """
+    Clears the figure and draws the sequence on a new PulseProgram.
+    The settings are attributes of PulseProgram (see SETTINGS).
+    channels are passed on to PulseProgram.draw_channels.
+
+    Returns the PulseProgram axes.
+
+    """
+    check_settings(settings)
+
+    fig.clear()
+    ax = fig.add_subplot(axes_class=PulseProgram)
+
+    return draw_on(ax, sequence, params=params, channels=channels, **settings)
+
+
+def check_settings(settings):
+
+    unknown = set(settings) - set(SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+
+
+def draw_on(ax, sequence, params=None, channels=None, **settings):
+    """
+    Draws the sequence on a PulseProgram that is new, or has been reset
+
+    """
+    ax.params = dict(params or {})
+    for key, value in settings.items():
+        setattr(ax, key, value)
+
+    ax.pseq(sequence)
+
+    if channels:
+        ax.draw_channels(*channels)
+
+    return ax
+
+
+def save(fig, fmt="png", dpi=150):
+    """
+    Saves the figure into memory and returns the bytes
+
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Format should be one of {FORMATS}, not {fmt}")
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format=fmt, dpi=dpi)
+
+    return buffer.getvalue()
+
+
+@contextmanager
+def fixed_layout(fig, dpi=None):
+    """
+    Runs the layout engine of the figure (e.g. constrained layout)
+    once, at the given dpi, and turns it off inside the context, so
+    that the figure can be saved many times without laying it out
+    again. Text is measured in pixels, so outputs at other dpis can be
+    laid out a fraction of a pixel differently than when they are
+    saved on their own.
+
+    """
+    engine = fig.get_layout_engine()
+
+    if engine is None:
+        yield fig
+        return
+
+    figure_dpi = fig.dpi
+
+    try:
+        fig.dpi = figure_dpi if dpi is None else dpi
+        engine.execute(fig)
+    finally:
+        fig.dpi = figure_dpi
+
+    fig.set_layout_engine("none")
+
+    try:
+        yield fig
+    finally:
+        fig.set_layout_engine(engine)
+
+
+def save_many(fig, formats, dpi=150):
+    """
+    Saves the figure in several formats with a single layout pass (see
+    fixed_layout), made for the first format, and returns a list of
+    bytes, one for each format. A format is a name, saved at the given
+    dpi, or a (name, dpi) pair. Outlines of pulses and laid out labels
+    are kept between outputs.
+
+    >>> png, png_hires, svg = save_many(fig, ["png", ("png", 600), "svg"])
+
+    """
+    formats = [(f, dpi) if isinstance(f, str) else tuple(f) for f in formats]
+
+    for fmt, _ in formats:
+        if fmt not in FORMATS:
+            raise ValueError(f"Format should be one of {FORMATS}, not {fmt}")
+
+    # laid out for the first output, as it would be on its own
+    # (vector formats are drawn at 72 dpi)
+    first, first_dpi = formats[0] if formats else ("svg", dpi)
+    layout_dpi = first_dpi if first == "png" else 72
+
+    with fixed_layout(fig, layout_dpi):
+        return [save(fig, fmt=fmt, dpi=dpi) for fmt, dpi in formats]
+
+
+def export(fig, outputs, dpi=150):
+    """
+    Saves the figure to several files with a single layout pass,
+    taking the format from the extension of each file. An output
+    is a file name, saved at the given dpi, or a (file name, dpi)
+    pair.
+
+    >>> export(fig, ["hsqc.png", ("hsqc@2x.png", 300), "hsqc.svg", "hsqc.pdf"])
+
+    """
+    outputs = [(o, dpi) if isinstance(o, (str, os.PathLike)) else o for o in outputs]
+    formats = [(Path(output).suffix[1:].lower(), dpi) for output, dpi in outputs]
+
+    for (output, _), data in zip(outputs, save_many(fig, formats)):
+        Path(output).write_bytes(data)
+
+
+def save_pdf(
+    sequences,
+    output,
+    params=None,
+    figsize=(8, 2.5),
+    layout="constrained",
+    channels=None,
+    on_error=None,
+    **settings,
+):
+    """
+    Draws many sequences into one PDF file (a file name or a file
+    object), with one sequence on each page, reusing a single figure.
+    sequences is a list of sequences, or a dict from a title to a
+    sequence, in which case the title is written above each sequence.
+
+    If on_error is given, a sequence that cannot be drawn is left out
+    and on_error(key, exception) is called, with the index or title of
+    the sequence. Otherwise, the error is raised. Returns the number
+    of pages written.
+
+    """
+    check_settings(settings)
+
+    if isinstance(sequences, dict):
+        items = sequences.items()
+    else:
+        items = enumerate(sequences)
+
+    fig = new_figure(figsize=figsize, layout=layout)
+    pages = 0
+
+    with PdfPages(output) as pdf:
+        for key, sequence in items:
+            try:
+                ax = draw_sequence(fig, sequence, params, channels, **settings)
+                if isinstance(sequences, dict):
+                    ax.set_title(key, loc="left")
+
+                # labels that cannot be drawn fail in the layout,
+                # before anything is written to the page
+                with fixed_layout(fig):
+                    pdf.savefig(fig)
+
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(key, e)
+                continue
+
+            pages += 1
+
+    return pages
+
+
+def render(
+    sequence,
+    params=None,
+    fmt="png",
+    dpi=150,
+    figsize=(8, 2.5),
+    fig=None,
+    channels=None,
+    **settings,
+):
+    """
+    Draws a pulse sequence (a string or a PulseSeq) and returns the
+    image as bytes. A new figure is made unless one is given.
+
+    >>> png = render(r"p1 ph1 fc=black", fmt="png")
+
+    """
+    if fig is None:
+        fig = new_figure(figsize)
+
+    draw_sequence(fig, sequence, params=params, channels=channels, **settings)
+
+    return save(fig, fmt=fmt, dpi=dpi)
+
+
+# the option of PulseProgram that rasterizes each class of elements
+RASTER_OPTIONS = {
+    "dense": "rasterize_vertices",
+    "hatched": "rasterize_hatch",
+    "train": "rasterize_train",
+}
+
+
+def size_report(fig, fmt="svg", dpi=150):
+    """
+    Saves the figure with no elements rasterized, then with only one
+    class of elements rasterized at a time (see PulseProgram.rasterize),
+    and then with all of them, as set by the rasterize_* options of
+    each PulseProgram on the figure. Returns a dict with the number of
+    elements and the bytes saved for each class that is rasterized,
+    and the size of the output without ("vector") and with ("mixed")
+    rasterization under "total".
+
+    >>> ax.rasterize_vertices = 200
+    >>> size_report(fig, "pdf")
+    {'dense': {'elements': 2, 'saved': 50633}, 'total': {...}}
+
+    """
+    axes = [ax for ax in fig.axes if isinstance(ax, PulseProgram)]
+    options = list(RASTER_OPTIONS.values())
+    settings = [{key: getattr(ax, key) for key in options} for ax in axes]
+    saved = [
+        {key: ax.__dict__[key] for key in options if key in ax.__dict__} for ax in axes
+    ]
+
+    def size(*keep):
+        for ax, values in zip(axes, settings):
+            for key in options:
+                setattr(ax, key, values[key] if key in keep else None)
+
+        return len(save(fig, fmt=fmt, dpi=dpi))
+
+    report = {}
+
+    try:
+        vector = size()
+
+        for name, option in RASTER_OPTIONS.items():
+            if all(values[option] is None for values in settings):
+                continue
+
+            mixed = size(option)
+            count = sum(list(ax.rasterize().values()).count(name) for ax in axes)
+            report[name] = {"elements": count, "saved": vector - mixed}
+
+        mixed = size(*options) if report else vector
+        report["total"] = {"vector": vector, "mixed": mixed, "saved": vector - mixed}
+
+    finally:
+        for ax, values in zip(axes, saved):
+            for key in options:
+                ax.__dict__.pop(key, None)
+            ax.__dict__.update(values)
+
+    return report
+
+
+# used by render_async when no executor is given
+_EXECUTOR = None
+
+
+def _default_executor():
+    global _EXECUTOR
+
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(thread_name_prefix="pulseplot")
+
+    return _EXECUTOR
+
+
+async def render_async(
+    sequence, params=None, fmt="png", dpi=150, executor=None, limit=None, **kwargs
+):
+    """
+    Same as render, but runs the parsing and drawing (on a new figure)
+    in an executor, without blocking the event loop. By default, a
+    thread pool is used; pass a ProcessPoolExecutor to use all cores.
+
+    limit, an asyncio.Semaphore, bounds the number of renders that are
+    running at a time. If the call is cancelled while the render is
+    waiting, it never starts; a render that has already started cannot
+    be stopped, but keeps its place in limit until it is done.
+
+    >>> svg = await render_async(r"p1 ph1 fc=black", fmt="svg")
+
+    """
+    if executor is None:
+        executor = _default_executor()
+
+    loop = asyncio.get_running_loop()
+    job = partial(render, sequence, params=params, fmt=fmt, dpi=dpi, **kwargs)
+
+    if limit is None:
+        return await asyncio.wrap_future(executor.submit(job))
+
+    await limit.acquire()
+
+    try:
+        future = executor.submit(job)
+    except BaseException:
+        limit.release()
+        raise
+
+    def release(_):
+        try:
+            loop.call_soon_threadsafe(limit.release)
+        except RuntimeError:
+            # the loop is closed
+            pass
+
+    future.add_done_callback(release)
+
+    # cancelling this also cancels the future, if it has not started
+    return await asyncio.wrap_future(future)
+
+
+async def render_many(
+    sequences, params=None, fmt="png", dpi=150, executor=None, limit=None, **kwargs
+):
+    """
+    Renders several sequences at once with render_async, running at
+    most limit (by default, the number of CPUs) at a time. Returns a
+    list of bytes, in the same order as sequences. If one of them
+    fails, the others are cancelled and the error is raised.
+
+    """
+    if not isinstance(limit, asyncio.Semaphore):
+        limit = asyncio.Semaphore(limit or os.cpu_count() or 1)
+
+    tasks = [
+        asyncio.ensure_future(
+            render_async(
+                sequence,
+                params=params,
+                fmt=fmt,
+                dpi=dpi,
+                executor=executor,
+                limit=limit,
+                **kwargs,
+            )
+        )
+        for sequence in sequences
+    ]
+
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
@@ -0,0 +1,637 @@
+"""
+Render server: an HTTP service (over TCP or a Unix socket) that
+draws sequences in a pool of warm worker processes
+
+    pulseplot serve --port 8000
+
+    POST /render   body: {"sequence": "p1 ph1", "params": {...},
+                          "format": "svg", "dpi": 150, ...}
+                   or the sequence as text, with ?format=svg&dpi=150
+    GET  /metrics  Prometheus text format
+    GET  /health
+
+Only the standard library is used.
+
+"""
+
+import asyncio
+import json
+import multiprocessing
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qsl, urlsplit
+
+from .cache import cache_key
+
+FORMATS = {"png": "image/png", "svg": "image/svg+xml", "pdf": "application/pdf"}
+
+SETTINGS = ("spacing", "phase_dy", "text_dy", "fontsize", "center_align")
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    422: "Unprocessable Entity",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+# upper bounds (in seconds) of the render latency histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MAX_HEADER = 16 * 1024
+
+# the number of points of a shape (np100 or np=100), as in parse.PARAMS
+NPOINTS = re.compile(r"(?:^|\s)np=?([0-9]+)")
+
+# pool of figures in each worker process
+_POOL = None
+
+
+def _terminate(executor):
+    """
+    Stops the processes of an executor at once, even in the middle of
+    a job, whose future then fails with BrokenProcessPool
+
+    """
+    terminate = getattr(executor, "terminate_workers", None)
+
+    if terminate is not None:
+        # python 3.14 and later
+        terminate()
+        return
+
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.terminate()
+
+    executor.shutdown()
+
+
+class RequestError(Exception):
+    """
+    Error that is sent back to the client with the given status
+
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _init_worker(figsize, layout, shape_dir):
+    global _POOL
+
+    from .pool import FigurePool
+    from .shapes import confine_shapes
+
+    # sequences come from clients, who should not read files on the server
+    confine_shapes(shape_dir)
+
+    _POOL = FigurePool(size=1, figsize=figsize, layout=layout)
+
+
+def _render(job):
+    return _POOL.render(**job)
+
+
+class MemoryCache(object):
+    """
+    Least-recently used cache of renders in memory,
+    holding at most maxsize bytes
+
+    """
+
+    def __init__(self, maxsize=64 * 2 ** 20):
+        self.maxsize = maxsize
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        try:
+            data = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.maxsize:
+            return
+
+        if key in self._data:
+            self.size -= len(self._data.pop(key))
+
+        self._data[key] = data
+        self.size += len(data)
+
+        while self.size > self.maxsize:
+            _, old = self._data.popitem(last=False)
+            self.size -= len(old)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Metrics(object):
+    """
+    Counters and a histogram of render latencies
+
+    """
+
+    def __init__(self):
+        self.requests = {}
+        self.renders = 0
+        self.render_errors = 0
+        self.render_seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def request(self, status):
+        self.requests[status] = self.requests.get(status, 0) + 1
+
+    def render(self, seconds):
+        self.renders += 1
+        self.render_seconds += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+
+class RenderServer(object):
+    """
+    Renders sequences on a pool of worker processes, each of which
+    keeps a warm figure. At most max_renders renders run at a time;
+    up to max_queue more wait for their turn, and requests beyond
+    that are turned away (503). Identical requests that arrive while
+    a render is running share its result, and finished renders are
+    kept in a MemoryCache. Each worker has an executor of its own, so
+    that a worker whose render times out can be stopped and replaced
+    without the others.
+
+    Requests are checked before they are rendered: sequences with
+    more than max_elements lines (or lines longer than max_line
+    characters) are turned away (413), and so are shapes with more
+    than max_npoints points (422).
+
+    Shape files (sp=file:<name>) are only read from shape_dir, with
+    names relative to it, and not at all when shape_dir is None.
+
+    """
+
+    def __init__(
+        self,
+        workers=2,
+        max_renders=None,
+        max_queue=64,
+        timeout=30.0,
+        cache_size=64 * 2 ** 20,
+        max_body=1 * 2 ** 20,
+        figsize=(8, 2.5),
+        layout="constrained",
+        shape_dir=None,
+        max_elements=2000,
+        max_line=1000,
+        max_npoints=10000,
+    ):
+        self.workers = workers
+        self.max_renders = max_renders or workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.max_body = max_body
+        self.figsize = tuple(figsize)
+        self.layout = layout
+        self.shape_dir = None if shape_dir is None else str(shape_dir)
+        self.max_elements = max_elements
+        self.max_line = max_line
+        self.max_npoints = max_npoints
+
+        self.cache = MemoryCache(cache_size)
+        self.metrics = Metrics()
+
+        self.queued = 0
+        self.running = 0
+
+        self._executors = None
+        self._busy = None
+        self._slots = None
+        self._pending = {}
+        self.sockets = []
+
+    def _new_executor(self):
+        # workers are not forked from the server, so that they do not
+        # hold on to its open connections; each one warms up its figure
+        # when it starts
+        methods = multiprocessing.get_all_start_methods()
+        method = "forkserver" if "forkserver" in methods else "spawn"
+
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context(method),
+            initializer=_init_worker,
+            initargs=(self.figsize, self.layout, self.shape_dir),
+        )
+
+    def start_workers(self):
+        """
+        Starts the worker processes, and waits until they are all warm
+
+        """
+        self._executors = [self._new_executor() for _ in range(self.workers)]
+        self._busy = [0] * self.workers
+
+        warmup = {"sequence": "p1", "fmt": "png", "dpi": 10}
+        futures = [e.submit(_render, warmup) for e in self._executors]
+        for future in futures:
+            future.result()
+
+    def close(self):
+        if self._executors is not None:
+            for executor in self._executors:
+                executor.shutdown()
+            self._executors = None
+
+    def _replace_worker(self, i, executor):
+        """
+        Stops the worker of executor (the i-th one), even in the middle
+        of a render, and starts a new one in its place
+
+        """
+        if self._executors is None or self._executors[i] is not executor:
+            return
+
+        # the old worker is gone before the new one starts
+        _terminate(executor)
+        self._executors[i] = self._new_executor()
+
+    async def render(self, job):
+        """
+        Renders a job (keyword arguments for FigurePool.render), from the
+        cache if possible. Returns the bytes of the image.
+
+        """
+        key = cache_key(**job)
+
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        if key in self._pending:
+            return await asyncio.shield(self._pending[key])
+
+        if self.running >= self.max_renders and self.queued >= self.max_queue:
+            raise RequestError(503, "Too many requests are waiting")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+
+        try:
+            data = await self._run(job)
+
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+        except Exception as e:
+            future.set_exception(e)
+            # the exception is handled by the caller
+            future.exception()
+            raise
+
+        else:
+            future.set_result(data)
+            self.cache.put(key, data)
+
+        finally:
+            del self._pending[key]
+
+        return data
+
+    async def _run(self, job):
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_renders)
+
+        loop = asyncio.get_running_loop()
+
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+
+        self.running += 1
+        t0 = time.perf_counter()
+
+        # the worker with the fewest renders
+        i = self._busy.index(min(self._busy))
+        executor = self._executors[i]
+        self._busy[i] += 1
+
+        def release():
+            self.running -= 1
+            self._busy[i] -= 1
+            self._slots.release()
+
+        def done(_):
+            try:
+                loop.call_soon_threadsafe(release)
+            except RuntimeError:
+                # the loop is closed, nobody is waiting for the slot
+                pass
+
+        work = None
+
+        try:
+            work = executor.submit(_render, job)
+
+            # the slot is freed when the worker is done (or stopped)
+            work.add_done_callback(done)
+
+            # shielded, so that a timeout does not cancel the wrapped future
+            # (which would not stop the worker); the worker is stopped instead
+            wrapped = asyncio.wrap_future(work)
+            wrapped.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+            data = await asyncio.wait_for(asyncio.shield(wrapped), self.timeout)
+
+        except asyncio.TimeoutError:
+            self.metrics.render_errors += 1
+            self._replace_worker(i, executor)
+            raise RequestError(504, f"Rendering took more than {self.timeout} s")
+
+        except BrokenProcessPool:
+            self.metrics.render_errors += 1
+            self._replace_worker(i, executor)
+            raise RequestError(500, "A worker process died, please try again")
+
+        except (ValueError, TypeError, KeyError, IndexError, FileNotFoundError) as e:
+            self.metrics.render_errors += 1
+            raise RequestError(400, f"{type(e).__name__}: {e}")
+
+        finally:
+            if work is None:
+                release()
+
+        self.metrics.render(time.perf_counter() - t0)
+
+        return data
+
+    def parse_job(self, method, target, headers, body):
+        """
+        Makes the job for a POST /render request
+
+        """
+        if method != "POST":
+            raise RequestError(405, "Use POST to render")
+
+        query = dict(parse_qsl(urlsplit(target).query))
+
+        if headers.get("content-type", "").startswith("application/json"):
+            try:
+                request = json.loads(body)
+            except (UnicodeDecodeError, ValueError) as e:
+                raise RequestError(400, f"Invalid JSON: {e}")
+            if not isinstance(request, dict):
+                raise RequestError(400, "The body should be a JSON object")
+        else:
+            try:
+                request = {"sequence": body.decode()}
+            except UnicodeDecodeError:
+                raise RequestError(400, "The sequence should be UTF-8 text")
+
+        request = {**query, **request}
+
+        sequence = request.pop("sequence", None)
+        if not isinstance(sequence, str) or not sequence.strip():
+            raise RequestError(400, "No sequence given")
+
+        self.check_sequence(sequence)
+
+        fmt = request.pop("format", "png")
+        if fmt not in FORMATS:
+            raise RequestError(400, f"format should be one of {', '.join(FORMATS)}")
+
+        job = {"sequence": sequence, "fmt": fmt}
+
+        try:
+            job["dpi"] = float(request.pop("dpi", 150))
+            if not 10 <= job["dpi"] <= 1200:
+                raise ValueError("dpi should be between 10 and 1200")
+
+            job["params"] = request.pop("params", None) or {}
+            if not isinstance(job["params"], dict):
+                raise ValueError("params should be an object")
+
+            if "channels" in request:
+                job["channels"] = list(request.pop("channels"))
+
+            if "figsize" in request:
+                w, h = (float(i) for i in request.pop("figsize"))
+                if not (0 < w <= 50 and 0 < h <= 50):
+                    raise ValueError("figsize should be at most 50 inches")
+                job["figsize"] = (w, h)
+
+            for setting in SETTINGS:
+                if setting in request:
+                    job[setting] = request.pop(setting)
+
+        except (TypeError, ValueError) as e:
+            raise RequestError(400, str(e))
+
+        if request:
+            raise RequestError(400, f"Unknown fields: {', '.join(sorted(request))}")
+
+        return job
+
+    def check_sequence(self, sequence):
+        """
+        Turns away sequences that would take too long or too much
+        memory to draw: too many elements, lines that are too long,
+        or shapes with too many points
+
+        """
+        lines = [line.split("#")[0] for line in sequence.split("\n")]
+        lines = [line for line in lines if line.strip()]
+
+        if len(lines) > self.max_elements:
+            raise RequestError(
+                413, f"The sequence should have at most {self.max_elements} elements"
+            )
+
+        if any(len(line) > self.max_line for line in lines):
+            raise RequestError(
+                413, f"Lines of the sequence should be at most {self.max_line} long"
+            )
+
+        for match in NPOINTS.finditer(sequence):
+            if int(match.group(1)) > self.max_npoints:
+                raise RequestError(
+                    422, f"Shapes should have at most {self.max_npoints} points"
+                )
+
+    def metrics_text(self):
+        """
+        Metrics in the Prometheus text format
+
+        """
+        m = self.metrics
+        lines = [
+            "# TYPE pulseplot_queue_depth gauge",
+            f"pulseplot_queue_depth {self.queued}",
+            "# TYPE pulseplot_renders_running gauge",
+            f"pulseplot_renders_running {self.running}",
+            "# TYPE pulseplot_requests_total counter",
+        ]
+        lines += [
+            f'pulseplot_requests_total{{status="{status}"}} {n}'
+            for status, n in sorted(m.requests.items())
+        ]
+        lines += [
+            "# TYPE pulseplot_render_errors_total counter",
+            f"pulseplot_render_errors_total {m.render_errors}",
+            "# TYPE pulseplot_cache_hits_total counter",
+            f"pulseplot_cache_hits_total {self.cache.hits}",
+            "# TYPE pulseplot_cache_misses_total counter",
+            f"pulseplot_cache_misses_total {self.cache.misses}",
+            "# TYPE pulseplot_cache_bytes gauge",
+            f"pulseplot_cache_bytes {self.cache.size}",
+            "# TYPE pulseplot_render_seconds histogram",
+        ]
+        lines += [
+            f'pulseplot_render_seconds_bucket{{le="{bound}"}} {n}'
+            for bound, n in zip(BUCKETS, m.buckets)
+        ]
+        lines += [
+            f'pulseplot_render_seconds_bucket{{le="+Inf"}} {m.renders}',
+            f"pulseplot_render_seconds_sum {m.render_seconds:.6f}",
+            f"pulseplot_render_seconds_count {m.renders}",
+        ]
+
+        return "\n".join(lines) + "\n"
+
+    async def respond(self, method, target, headers, body):
+        """
+        Handles one request, returns (status, content type, body)
+
+        """
+        path = urlsplit(target).path
+
+        if path == "/render":
+            job = self.parse_job(method, target, headers, body)
+            return 200, FORMATS[job["fmt"]], await self.render(job)
+
+        if path == "/metrics" and method == "GET":
+            return 200, "text/plain; version=0.0.4", self.metrics_text().encode()
+
+        if path == "/health" and method == "GET":
+            return 200, "text/plain", b"ok\n"
+
+        raise RequestError(404, f"No such path: {path}")
+
+    async def handle(self, reader, writer):
+        """
+        Reads one HTTP request from the connection and answers it
+
+        """
+        try:
+            status, content_type, data = await self._handle(reader)
+
+        except RequestError as e:
+            status, content_type, data = e.status, "text/plain", f"{e}\n".encode()
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+
+        except Exception as e:
+            status, content_type = 500, "text/plain"
+            data = f"{type(e).__name__}: {e}\n".encode()
+
+        self.metrics.request(status)
+
+        head = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+
+        try:
+            writer.write(head.encode() + data)
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def _handle(self, reader):
+
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise RequestError(413, "Headers are too large")
+
+        lines = head.decode("latin-1").split("\r\n")
+
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise RequestError(400, "Invalid request line")
+
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise RequestError(400, "Invalid Content-Length")
+
+        if length > self.max_body:
+            raise RequestError(413, f"The body should be at most {self.max_body} B")
+
+        body = await reader.readexactly(length) if length else b""
+
+        return await self.respond(method, target, headers, body)
+
+    async def serve(self, host="127.0.0.1", port=8000, path=None, ready=None):
+        """
+        Serves requests on host:port, or on the Unix socket at path,
+        until cancelled. ready (an asyncio.Event), if given, is set
+        once the server accepts connections.
+
+        """
+        if self._executors is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.start_workers)
+
+        if path is not None:
+            server = await asyncio.start_unix_server(
+                self.handle, path=path, limit=MAX_HEADER
+            )
+        else:
+            server = await asyncio.start_server(
+                self.handle, host, port, limit=MAX_HEADER
+            )
+
+        self.sockets = server.sockets
+
+        try:
+            async with server:
+                if ready is not None:
+                    ready.set()
+                await server.serve_forever()
+        finally:
+            self.close()
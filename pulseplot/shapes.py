@@ -0,0 +1,295 @@
+"""
+Pulse shapes read from files, and decimation of shapes
+
+Shapes are used as sp=file:<name>, where the name is a path, either
+absolute, relative to the current directory, or relative to one of the
+directories in SHAPE_PATH (which starts out with the directories in
+$PULSEPLOT_SHAPE_PATH). Binary files (.npy, and raw arrays of float32
+in .f32/.f4 or float64 in .f64/.f8/.bin/.raw) are memory-mapped. Any
+other file is read as text, with one point per line and the amplitude
+in the first column (columns are separated by spaces, tabs or commas,
+and lines starting with # are skipped, as in Bruker shape files).
+
+confine_shapes limits the files that can be read to one directory, for
+services (like the render server) that draw sequences sent by others.
+
+"""
+
+import os
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+SHAPE_PATH = [
+    p for p in os.environ.get("PULSEPLOT_SHAPE_PATH", "").split(os.pathsep) if p
+]
+
+BINARY = {
+    ".f32": np.float32,
+    ".f4": np.float32,
+    ".f64": np.float64,
+    ".f8": np.float64,
+    ".bin": np.float64,
+    ".raw": np.float64,
+}
+
+PREFIX = "file:"
+
+# set by confine_shapes: (True, directory) when shape files are only
+# read from that directory, or (True, None) when they are not read at all
+_CONFINED = (False, None)
+
+
+def confine_shapes(directory=None):
+    """
+    Only reads shape files from directory from now on, with names
+    relative to it (names that lead out of it are refused), or no
+    shape files at all when directory is None
+
+    """
+    global _CONFINED
+
+    if directory is not None:
+        directory = Path(directory).expanduser().resolve()
+
+    _CONFINED = (True, directory)
+    _read_shape.cache_clear()
+
+
+def find_shape(name):
+    """
+    Gets the path of the shape file with the given name
+
+    """
+    confined, root = _CONFINED
+    if confined:
+        return _find_confined(name, root)
+
+    path = Path(name).expanduser()
+
+    if path.is_file():
+        return path
+
+    if not path.is_absolute():
+        for directory in SHAPE_PATH:
+            candidate = Path(directory).expanduser() / path
+            if candidate.is_file():
+                return candidate
+
+    raise FileNotFoundError(
+        f"Cannot find the shape file {name} (searched in {SHAPE_PATH or 'nothing'})"
+    )
+
+
+def _find_confined(name, root):
+
+    if root is None:
+        raise ValueError(f"Shape files are not allowed here ({PREFIX}{name})")
+
+    path = root.joinpath(name).resolve()
+
+    if root not in path.parents:
+        raise ValueError(f"The shape file {name} is outside the shape directory")
+
+    if not path.is_file():
+        raise FileNotFoundError(f"Cannot find the shape file {name}")
+
+    return path
+
+
+def shape_stamp(name):
+    """
+    Identifies the current contents of a shape file by its path, time
+    of the last change and size, so that anything made from the file
+    can be made again when it changes
+
+    """
+    path = find_shape(name).resolve()
+    stat = path.stat()
+
+    return str(path), stat.st_mtime_ns, stat.st_size
+
+
+def read_shape(name):
+    """
+    Reads the amplitudes in a shape file (memory-mapped for binary files),
+    and the largest absolute amplitude. Files are read once, and again
+    only when they change.
+
+    """
+    path = find_shape(name).resolve()
+    stat = path.stat()
+
+    return _read_shape(path, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=64)
+def _read_shape(path, mtime, size):
+
+    suffix = path.suffix.lower()
+
+    if suffix == ".npy":
+        amplitudes = np.load(path, mmap_mode="r")
+        if amplitudes.ndim > 1:
+            amplitudes = amplitudes[:, 0]
+
+    elif suffix in BINARY:
+        amplitudes = np.memmap(path, dtype=BINARY[suffix], mode="r")
+
+    else:
+        amplitudes = _read_text(path)
+
+    if amplitudes.size == 0:
+        raise ValueError(f"The shape file {path} has no points")
+
+    return amplitudes, float(np.abs(amplitudes).max())
+
+
+def _read_text(path):
+
+    lines = path.read_bytes().replace(b",", b" ").splitlines()
+    lines = [
+        line for line in lines if line.strip() and not line.lstrip().startswith(b"#")
+    ]
+
+    if not lines:
+        return np.zeros(0)
+
+    columns = len(lines[0].split())
+
+    try:
+        values = np.array(b" ".join(lines).split(), dtype=float)
+        return values.reshape(-1, columns)[:, 0]
+    except ValueError:
+        raise ValueError(
+            f"Cannot read the shape file {path}, expected {columns} numbers on each line"
+        )
+
+
+def minmax_indices(y, npoints):
+    """
+    Indexes of the points kept when y is reduced to (at most) npoints
+    points: y is split into npoints // 2 buckets, and the smallest and
+    largest point of each bucket are kept, in the order they appear,
+    so that peaks are not lost
+
+    """
+    n = len(y)
+    buckets = min(npoints // 2, n)
+
+    if buckets == 0:
+        return np.arange(min(npoints, n))
+
+    y = np.asarray(y, dtype=float)
+    edges = np.arange(buckets) * n // buckets
+    sizes = np.diff(np.append(edges, n))
+
+    # position of the first minimum and maximum in each bucket
+    index = np.arange(n)
+    low, high = [
+        np.minimum.reduceat(
+            np.where(y == np.repeat(extreme.reduceat(y, edges), sizes), index, n),
+            edges,
+        )
+        for extreme in (np.minimum, np.maximum)
+    ]
+
+    return np.column_stack([np.minimum(low, high), np.maximum(low, high)]).reshape(-1)
+
+
+def lttb_indices(x, y, npoints):
+    """
+    Indexes of the points kept when the curve (x, y) is reduced to
+    npoints points with largest-triangle-three-buckets: the first and
+    last points are kept, and from each of the npoints - 2 buckets in
+    between, the point that makes the largest triangle with the point
+    kept before it and the average of the next bucket
+
+    """
+    n = len(y)
+
+    if npoints >= n or npoints < 3:
+        return np.arange(min(npoints, n))
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    edges = 1 + np.arange(npoints - 1) * (n - 2) // (npoints - 2)
+    edges[-1] = n - 1
+
+    kept = np.empty(npoints, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+
+    for i in range(npoints - 2):
+        start, stop = edges[i], edges[i + 1]
+        after = slice(stop, edges[i + 2] if i + 2 < len(edges) else n)
+
+        ax, ay = x[kept[i]], y[kept[i]]
+        cx, cy = x[after].mean(), y[after].mean()
+
+        area = np.abs(
+            (ax - cx) * (y[start:stop] - ay) - (ax - x[start:stop]) * (cy - ay)
+        )
+        kept[i + 1] = start + area.argmax()
+
+    return kept
+
+
+def decimate(y, npoints):
+    """
+    Reduces (or stretches) an array to npoints points spread evenly
+    over it, keeping the smallest and largest point of each stretch
+    of the array (see minmax_indices)
+
+    """
+    n = len(y)
+
+    if n <= npoints:
+        return np.interp(np.linspace(0, n - 1, npoints), np.arange(n), y)
+
+    kept = minmax_indices(y, npoints)
+
+    if npoints % 2:
+        kept = np.append(kept, n - 1)
+
+    return np.asarray(y, dtype=float)[kept]
+
+
+def decimate_outline(x, y, npoints, method="minmax"):
+    """
+    Reduces the curve (x, y) to at most npoints points, with the minmax
+    or lttb method, always keeping the first and last points
+
+    """
+    n = len(y)
+
+    if n <= npoints:
+        return x, y
+
+    if method == "lttb":
+        kept = lttb_indices(x, y, npoints)
+
+    elif method == "minmax":
+        inner = minmax_indices(y[1:-1], npoints - 2) + 1
+        kept = np.unique(np.concatenate([[0], inner, [n - 1]]))
+
+    else:
+        raise ValueError(f"Unknown decimation {method!r}, use 'minmax' or 'lttb'")
+
+    return x[kept], y[kept]
+
+
+def file_shape(name, npoints):
+    """
+    The shape in a file on npoints points, scaled so
+    that the largest absolute amplitude is 1
+
+    """
+    amplitudes, scale = read_shape(name)
+    shape = decimate(amplitudes, npoints)
+
+    if scale > 0:
+        shape /= scale
+
+    return shape
@@ -0,0 +1,1248 @@
+"""
+Compiled, columnar form of pulse sequences, and a binary file format
+
+A Timeline holds one array per parameter of the elements (strings are
+indexes into a string table), together with the times at which the
+elements are placed when the sequence is drawn. Timelines are saved
+as uncompressed .npz files, which are memory-mapped when loaded.
+
+"""
+
+import csv
+import json
+import struct
+import zipfile
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+from .expr import compile_expression, count_sets
+from .parse import Delay, Pulse, PulseSeq, Shape, parse_anchor, shape_name
+
+FORMAT = "pulseplot-timeline"
+VERSION = 2
+
+# columns for the parameters of the elements, by type
+FLOATS = (
+    "plen",
+    "time",
+    "power",
+    "channel",
+    "start_time",
+    "alpha",
+    "phtxt_dx",
+    "phtxt_dy",
+    "ph_fontsize",
+    "text_dx",
+    "text_dy",
+    "text_fontsize",
+)
+INTS = ("npoints",)
+BOOLS = (
+    "defer_start_time",
+    "wait",
+    "centered",
+    "keep_centered",
+    "truncate_off",
+    "open",
+)
+STRINGS = (
+    "args",
+    "phase",
+    "shape",
+    "facecolor",
+    "edgecolor",
+    "hatch",
+    "text",
+    "name",
+    "anchor",
+)
+KEYWORDS = ("phase_kw", "text_kw", "style_kw")
+
+FIELDS = set(FLOATS + INTS + BOOLS + STRINGS + KEYWORDS)
+
+# columns computed when a sequence is compiled
+TIMES = ("clock", "x0", "x1")
+
+PULSE, DELAY = 0, 1
+KINDS = ("pulse", "delay")
+
+# the timing table written by Timeline.export
+TABLE = (
+    "element",
+    "kind",
+    "channel",
+    "start",
+    "end",
+    "power",
+    "shape",
+    "phase",
+    "name",
+)
+EXPORT_FORMATS = {".csv": "csv", ".npz": "npz", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+# columns with a secondary index (see Timeline.index)
+INDEXED = ("kind", "channel", "shape", "phase", "name")
+
+# columns that change where the elements are placed
+TIMING = (
+    "plen",
+    "time",
+    "start_time",
+    "defer_start_time",
+    "wait",
+    "centered",
+    "keep_centered",
+    "anchor",
+    "name",
+)
+
+
+def _float(element, field):
+    value = getattr(element, field, None)
+
+    if value is None:
+        return np.nan
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(
+            f"{field}={value!r} of {element.args!r} cannot be stored as a number"
+        )
+
+
+class StringTable(object):
+    """
+    Distinct strings, stored as one block of UTF-8 and the offsets
+    of the strings in it. Strings are decoded when they are used.
+
+    """
+
+    def __init__(self, data=None, offsets=None):
+        self.data = np.zeros(0, np.uint8) if data is None else data
+        self.offsets = np.zeros(1, np.int64) if offsets is None else offsets
+        self._decoded = {}
+        self._ids = None
+
+    @classmethod
+    def build(cls, strings):
+        """
+        Makes a table from a list of distinct strings
+
+        """
+        encoded = []
+        for s in strings:
+            if not isinstance(s, str):
+                raise TypeError(f"{s!r} is not a string")
+            encoded.append(s.encode())
+
+        offsets = np.zeros(len(encoded) + 1, np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), np.uint8)
+
+        return cls(data, offsets)
+
+    def __getitem__(self, i):
+        if i < 0:
+            return None
+
+        try:
+            return self._decoded[i]
+        except KeyError:
+            pass
+
+        s = self.data[self.offsets[i] : self.offsets[i + 1]].tobytes().decode()
+        self._decoded[i] = s
+
+        return s
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def find(self, s):
+        """
+        Gets the index of a string (-1 for None),
+        or None if it is not in the table
+
+        """
+        if s is None:
+            return -1
+
+        if self._ids is None:
+            self._ids = {self[i]: i for i in range(len(self))}
+
+        return self._ids.get(s)
+
+    def add(self, s):
+        """
+        Gets the index of a string, adding it to the table if needed
+
+        """
+        i = self.find(s)
+
+        if i is None:
+            if not isinstance(s, str):
+                raise TypeError(f"{s!r} is not a string")
+
+            encoded = np.frombuffer(s.encode(), np.uint8)
+            self.data = np.concatenate([self.data, encoded])
+            self.offsets = np.append(self.offsets, self.offsets[-1] + len(encoded))
+
+            i = len(self) - 1
+            self._ids[s] = i
+
+        return i
+
+
+class Timeline(object):
+    """
+    A compiled sequence: one array per parameter, plus the clock
+    (the time before each element is applied), and the left (x0) and
+    right (x1) edges of each element as it is drawn.
+
+    >>> timeline = Timeline.compile(PulseSeq("p1 ph1\\nd2\\np2 ph2"))
+    >>> timeline["x0"]
+    array([0., 1., 3.])
+    >>> timeline.save("echo.npz")
+    >>> Timeline.load("echo.npz").to_sequence()
+
+    """
+
+    def __init__(self, columns, strings, meta=None):
+        self.columns = columns
+        self.strings = strings
+        self.meta = dict(meta or {})
+        self._indexes = {}
+
+    def __len__(self):
+        return len(self.columns["kind"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def spacing(self):
+        return self.meta.get("spacing", 0.0)
+
+    @property
+    def end(self):
+        """
+        The time after the last element, i.e. ax.time after drawing
+
+        """
+        return self.meta.get("end", 0.0)
+
+    @classmethod
+    def compile(cls, sequence, spacing=0.0, time=0.0, external_params=None):
+        """
+        Compiles a PulseSeq (or a string) into a timeline. The times are
+        those at which PulseProgram.pseq places the elements, for an
+        axes with the given spacing, starting at the given time.
+
+        """
+        if isinstance(sequence, str):
+            sequence = PulseSeq(sequence, external_params=external_params or {})
+
+        elements = sequence.elements
+        states = [vars(e) for e in elements]
+        n = len(elements)
+
+        columns = {"kind": np.zeros(n, np.uint8)}
+        columns["kind"][[isinstance(e, Delay) for e in elements]] = DELAY
+
+        for field in FLOATS:
+            try:
+                values = np.array([s.get(field) for s in states], float)
+            except (TypeError, ValueError):
+                values = np.array([_float(e, field) for e in elements], float)
+            columns[field] = values
+
+        for field in INTS:
+            columns[field] = np.array([s[field] for s in states], np.int64)
+
+        for field in BOOLS:
+            columns[field] = np.array([s[field] for s in states], bool)
+
+        # strings are stored as indexes into a table of the distinct strings
+        index = {}
+
+        def encode(column):
+            return np.array(
+                [-1 if s is None else index.setdefault(s, len(index)) for s in column],
+                np.int32,
+            )
+
+        for field in STRINGS:
+            columns[field] = encode(s.get(field) for s in states)
+
+        columns["shape"] = encode(_shape(e) for e in elements)
+
+        for field in KEYWORDS:
+            columns[field] = encode(_keywords(s[field]) for s in states)
+
+        columns["extra"] = encode(
+            None if s.keys() <= FIELDS else _extra(e) for e, s in zip(elements, states)
+        )
+
+        strings = StringTable.build(list(index))
+
+        meta = {
+            "input_string": sequence.input_string,
+            "params": _used_params(states, getattr(sequence, "external_params", {})),
+        }
+
+        timeline = cls(columns, strings, meta)
+        timeline.place(spacing, time)
+
+        return timeline
+
+    def place(self, spacing=0.0, time=0.0):
+        """
+        Computes the clock, x0 and x1 columns, following
+        the rules of PulseProgram.pulse for each element
+
+        """
+        c = self.columns
+        s = spacing
+
+        plen = c["plen"]
+        deferred = c["defer_start_time"]
+        centered = c["centered"]
+
+        # how much each element moves ax.time forward
+        step = np.where(
+            centered,
+            np.where(c["keep_centered"], 3 * s, plen / 2 + 2 * s),
+            plen + s,
+        )
+        step[~deferred | c["wait"]] = 0.0
+
+        # anchored elements do not move the time
+        anchored = np.flatnonzero(c["anchor"] >= 0)
+        step[anchored] = 0.0
+
+        clock = np.empty(len(self))
+        clock[:1] = time
+        np.cumsum(step[:-1], out=clock[1:])
+        clock[1:] += time
+
+        start = np.where(deferred, clock + s, c["start_time"])
+        length = np.where(deferred, plen - 2 * s, plen)
+        x0 = np.where(centered, start - length / 2, start)
+
+        x1 = x0 + length
+
+        if len(anchored):
+            self._anchor(anchored, clock, x0, x1, s)
+
+        c["clock"] = clock
+        c["x0"] = x0
+        c["x1"] = x1
+
+        self.meta["spacing"] = spacing
+        self.meta["time"] = time
+        self.meta["end"] = float(time + step.sum())
+
+    def _anchor(self, rows, clock, x0, x1, spacing):
+        """
+        Places the anchored elements (rows), after the others are placed,
+        in an order in which every element comes after the one it is
+        anchored to. An anchored element is placed like one without a
+        start time, as if the time were at its anchor (which is the
+        clock of the element), but it does not move the time.
+
+        """
+        c = self.columns
+        names = self.index("name")
+
+        targets, anchors = {}, {}
+        for row, anchor in zip(rows.tolist(), c["anchor"][rows].tolist()):
+            anchor = self.strings[anchor]
+            mode, name, offset = parse_anchor(anchor)
+
+            try:
+                # as in PulseSeq.named_elements, the last element with a name
+                targets[row] = int(names[name][-1])
+            except KeyError:
+                raise ValueError(
+                    f"Cannot find the element {name} in the anchor {anchor}"
+                )
+
+            anchors[row] = mode, offset
+
+        plen = c["plen"]
+        padded = np.asarray(c["defer_start_time"])
+
+        for row in anchor_order(targets, self.string_column("name")):
+            target = targets[row]
+            mode, offset = anchors[row]
+
+            # the slot of the target includes its spacing
+            pad = spacing if padded[target] or target in targets else 0.0
+            a, b = x0[target] - pad, x1[target] + pad
+            length = plen[row]
+
+            if mode == "after":
+                start = b
+            elif mode == "before":
+                start = a - length
+            elif mode == "start":
+                start = a
+            elif mode == "end":
+                start = b - length
+            else:
+                start = (a + b - length) / 2
+
+            clock[row] = start + offset
+            x0[row] = clock[row] + spacing
+            x1[row] = clock[row] + length - spacing
+
+    def sweep(self, params):
+        """
+        Places the sequence again for each of many sets of parameters,
+        with the values that come from expressions or external parameters
+        evaluated again (each expression once, for all the sets at once).
+        params is a list of dicts, or a dict of arrays (one value per set)
+        and single numbers (the same for all sets). Names that are not
+        given keep the values of the external parameters the sequence
+        was compiled with. Yields a timeline for each set.
+
+        >>> for t in timeline.sweep({"d10": np.linspace(1, 10, 100), "p1": 2}):
+        ...     print(t.end)
+
+        """
+        extra = np.asarray(self.columns["extra"])
+        delays = np.asarray(self.columns["kind"]) == DELAY
+
+        compiled = self.meta.get("params", {})
+        if isinstance(params, (list, tuple)):
+            params = [{**compiled, **p} for p in params]
+        else:
+            params = {**compiled, **params}
+
+        # rows that have each (field, expression)
+        groups = {}
+        for i in np.unique(extra[extra >= 0]).tolist():
+            expressions = json.loads(self.strings[i]).get("expressions", {})
+            if expressions:
+                rows = np.flatnonzero(extra == i)
+                for item in expressions.items():
+                    groups.setdefault(item, []).append(rows)
+
+        values = {
+            item: compile_expression(item[1]).evaluate_many(params) for item in groups
+        }
+        groups = {item: np.concatenate(rows) for item, rows in groups.items()}
+
+        fields = set(field for field, _ in groups)
+        if "time" in fields:
+            fields.add("plen")
+
+        for k in range(count_sets(params)):
+            columns = dict(self.columns)
+            for field in fields:
+                columns[field] = np.array(self.columns[field])
+
+            for (field, source), rows in groups.items():
+                columns[field][rows] = values[field, source][k]
+
+                # delays keep their length in both time and plen
+                if field == "time":
+                    columns["plen"][rows[delays[rows]]] = values[field, source][k]
+
+            timeline = Timeline(columns, self.strings, self.meta)
+            timeline.place(self.spacing, self.meta.get("time", 0.0))
+
+            yield timeline
+
+    def index(self, field):
+        """
+        A secondary index of a column: a dict from each value in the
+        column to the rows that have it (in order). Indexes are built
+        the first time they are used, and kept until the column changes.
+
+        """
+        try:
+            return self._indexes[field]
+        except KeyError:
+            pass
+
+        column = np.asarray(self.columns[field])
+        order = np.argsort(column, kind="stable")
+        values, starts = np.unique(column[order], return_index=True)
+
+        keys = [self._value(field, v) for v in values.tolist()]
+        index = dict(zip(keys, np.split(order, starts[1:])))
+        self._indexes[field] = index
+
+        return index
+
+    def where(self, field, value):
+        """
+        A boolean mask of the rows where a field has a value. The value
+        can also be a list, tuple or set of values, any of which matches,
+        or a function that gets a value and returns True if it matches.
+        Shapes match by their full name (gauss_0.5_0.1) or their name
+        (gauss), and kinds are "pulse" or "delay".
+
+        """
+        if field not in self.columns or field in TIMES + ("extra",):
+            raise ValueError(f"Cannot select by {field}, it is not a parameter")
+
+        if callable(value):
+            matches = value
+        else:
+            wanted = value if isinstance(value, (list, tuple, set)) else [value]
+            wanted = set(None if _missing(v) else v for v in wanted)
+            matches = wanted.__contains__
+
+        mask = np.zeros(len(self), bool)
+
+        if field in INDEXED:
+            index = self.index(field)
+            keys = [k for k in index if matches(k)]
+            if field == "shape":
+                keys += [k for k in index if k and k not in keys and matches(_name(k))]
+            if keys:
+                mask[np.concatenate([index[k] for k in keys])] = True
+            return mask
+
+        # other columns are compared by their distinct values
+        column = np.asarray(self.columns[field])
+        values = np.unique(column)
+        kept = [v for v in values.tolist() if matches(self._value(field, v))]
+
+        if field in FLOATS and any(v != v for v in kept):
+            mask |= np.isnan(column)
+
+        return mask | np.isin(column, kept)
+
+    def _value(self, field, value):
+        """
+        A value of a column as the parameter of an element
+
+        """
+        if field == "kind":
+            return KINDS[value]
+
+        if field in STRINGS or field in KEYWORDS:
+            return self.strings[value]
+
+        if field in FLOATS and value != value:
+            return None
+
+        return value
+
+    def select(self, *predicates, **criteria):
+        """
+        Selects the rows whose fields have the given values (see where),
+        and for which every predicate is True. Predicates are functions
+        that get the timeline and return a boolean mask of the rows.
+
+        >>> timeline.select(channel=2, shape="gauss").scale(plen=2)
+        >>> timeline.select(lambda t: t["x0"] > 10, kind="pulse")
+
+        """
+        return Selection(self).select(*predicates, **criteria)
+
+    def edit(self, rows, values=None, factors=None):
+        """
+        Sets fields of the given rows to values, and multiplies numeric
+        fields by factors (both dicts of field: value). If the timing of
+        the elements changes, they are placed again, once for all the
+        changes. Returns the fields that were changed.
+
+        """
+        values, factors = dict(values or {}), dict(factors or {})
+        rows = np.asarray(rows)
+
+        for field, value in values.items():
+            if field in STRINGS:
+                value = self.strings.add(value)
+            elif field in KEYWORDS:
+                value = self.strings.add(_keywords(value))
+            elif field in FLOATS:
+                value = np.nan if value is None else float(value)
+            elif field not in INTS + BOOLS:
+                raise ValueError(f"Cannot edit {field}, it is not a parameter")
+
+            self._writable(field)[rows] = value
+
+        for field, factor in factors.items():
+            if field not in FLOATS:
+                raise ValueError(f"Cannot scale {field}, it is not a number")
+
+            self._writable(field)[rows] *= factor
+
+        changed = set(values) | set(factors)
+
+        # delays keep their length in both time and plen
+        delays = rows[self.columns["kind"][rows] == DELAY]
+        if len(delays) and ("time" in changed or "plen" in changed):
+            source = "time" if "time" in changed else "plen"
+            target = "plen" if source == "time" else "time"
+            self._writable(target)[delays] = self.columns[source][delays]
+            changed.add(target)
+
+        for field in changed:
+            self._indexes.pop(field, None)
+
+        if changed & set(TIMING):
+            self.place(self.spacing, self.meta.get("time", 0.0))
+
+        return changed
+
+    def _writable(self, field):
+        column = self.columns[field]
+
+        # columns memory-mapped from a file are read-only
+        if not column.flags.writeable:
+            column = self.columns[field] = np.array(column)
+
+        return column
+
+    def string_column(self, field):
+        """
+        Gets a column of strings (None for missing values) as a list
+
+        """
+        # each distinct string is decoded once
+        ids, inverse = np.unique(self.columns[field], return_inverse=True)
+        strings = np.array([self.strings[i] for i in ids.tolist()], dtype=object)
+
+        return strings[inverse.reshape(-1)].tolist()
+
+    def to_sequence(self):
+        """
+        Makes a PulseSeq with the elements of the timeline, without
+        parsing them again. The elements are made (see to_elements)
+        when the sequence first needs them, so that loading a sequence
+        that is only compiled or exported again stays fast.
+
+        """
+        state = {
+            "input_string": self.meta.get("input_string"),
+            "external_params": dict(self.meta.get("params", {})),
+            "named_elements": {
+                name: i for i, name in enumerate(self.string_column("name")) if name
+            },
+        }
+
+        if state["input_string"]:
+            state["_source"] = self
+        else:
+            state["elements"] = self.to_elements()
+            state["args"] = list(state["elements"])
+
+        sequence = PulseSeq.__new__(PulseSeq)
+        sequence.__setstate__(state)
+
+        return sequence
+
+    def to_elements(self):
+        """
+        Makes the Pulse and Delay objects of the rows, one column at a
+        time, without parsing them again
+
+        """
+        c = self.columns
+
+        fields = {}
+        for field in FLOATS:
+            values = c[field]
+            if np.isnan(values).any():
+                values = np.where(np.isnan(values), None, values)
+            fields[field] = values.tolist()
+        for field in INTS + BOOLS:
+            fields[field] = c[field].tolist()
+        for field in STRINGS:
+            fields[field] = self.string_column(field)
+        for field in KEYWORDS:
+            # decode each distinct dict once, and give every element its own copy
+            ids, inverse = np.unique(c[field], return_inverse=True)
+            decoded = np.array([json.loads(self.strings[i]) for i in ids.tolist()])
+            fields[field] = list(map(dict.copy, decoded[inverse.reshape(-1)].tolist()))
+
+        names = list(fields)
+        extra = self.string_column("extra")
+
+        # the attributes of each row become the __dict__ of its element
+        elements = []
+        rows = zip(c["kind"].tolist(), extra, zip(*fields.values()))
+        for kind, more, values in rows:
+            state = dict(zip(names, values))
+
+            if kind == DELAY:
+                element = Delay.__new__(Delay)
+            else:
+                element = Pulse.__new__(Pulse)
+                del state["time"]
+            if more is not None:
+                state.update(json.loads(more))
+
+            element.__dict__ = state
+            elements.append(element)
+
+        return elements
+
+    def table(self, start=0, stop=None):
+        """
+        The timing table for elements start to stop, as a dict of arrays
+        (numbers) and lists (strings, None where missing). The start and
+        end are the left and right edges of the element as drawn.
+
+        """
+        c = self.columns
+        rows = slice(start, stop)
+        start, stop, _ = rows.indices(len(self))
+
+        table = {
+            "element": np.arange(start, stop),
+            "kind": [KINDS[k] for k in c["kind"][rows].tolist()],
+            "channel": c["channel"][rows],
+            "start": c["x0"][rows],
+            "end": c["x1"][rows],
+            "power": c["power"][rows],
+        }
+
+        for field in ("shape", "phase", "name"):
+            table[field] = [self.strings[i] for i in c[field][rows].tolist()]
+
+        return table
+
+    def export(self, file, fmt=None, chunksize=65536):
+        """
+        Writes the timing table (see table) to a path or an open file, as
+        csv, npz or jsonl (one JSON object per line). The format is taken
+        from the extension of the path if it is not given. The table is
+        written chunksize elements at a time.
+
+        """
+        if fmt is None:
+            try:
+                fmt = EXPORT_FORMATS[Path(file).suffix.lower()]
+            except (TypeError, KeyError):
+                raise ValueError(f"Cannot tell the format to export {file} in")
+
+        writer = {"csv": _write_csv, "jsonl": _write_jsonl, "npz": _write_npz}
+        if fmt not in writer:
+            raise ValueError(f"Cannot export to {fmt}, use one of {set(writer)}")
+
+        if hasattr(file, "write"):
+            writer[fmt](file, self, chunksize)
+        elif fmt == "npz":
+            with open(file, "wb") as f:
+                writer[fmt](f, self, chunksize)
+        else:
+            with open(file, "w", newline="") as f:
+                writer[fmt](f, self, chunksize)
+
+    def waveform(self, channel, dt, start=None, stop=None, chunksize=None):
+        """
+        Samples the amplitude (shape times power) of the pulses on a
+        channel every dt, from start to stop, which default to the first
+        and last edge of any element. Sample k is at start + k * dt, and
+        pulses that overlap add up. With chunksize, returns an iterator
+        over arrays of (at most) chunksize samples instead of one array.
+
+        """
+        if dt <= 0:
+            raise ValueError("dt must be positive")
+
+        c = self.columns
+        x0, x1 = np.asarray(c["x0"]), np.asarray(c["x1"])
+        low, high = np.minimum(x0, x1), np.maximum(x0, x1)
+
+        if start is None:
+            start = min(low.min(initial=np.inf), self.meta.get("time", 0.0))
+        if stop is None:
+            stop = max(high.max(initial=-np.inf), self.end)
+
+        n = max(int(np.ceil((stop - start) / dt)), 0)
+
+        pulses = (c["kind"] == PULSE) & (c["channel"] == channel) & (high > low)
+        x0, x1 = x0[pulses], x1[pulses]
+        power = np.asarray(c["power"])[pulses]
+
+        # samples from first (inclusive) to last (exclusive) fall on each pulse
+        first = np.clip(np.ceil((low[pulses] - start) / dt), 0, n).astype(np.int64)
+        last = np.clip(np.ceil((high[pulses] - start) / dt), 0, n).astype(np.int64)
+
+        order = np.argsort(first, kind="stable")
+        first, last, x0, x1, power = (a[order] for a in (first, last, x0, x1, power))
+        longest = (last - first).max(initial=0)
+
+        # each distinct shape is computed once
+        keys = np.stack([c["shape"][pulses], c["npoints"][pulses]], axis=1)[order]
+        keys, group = np.unique(keys, axis=0, return_inverse=True)
+        group = group.reshape(-1)
+        shapes = [_unit_shape(self.strings[s], npoints) for s, npoints in keys.tolist()]
+
+        def samples(a, b):
+            # only pulses that start less than one pulse length before a
+            i = np.searchsorted(first, a - longest)
+            j = np.searchsorted(first, b)
+
+            lo, hi = np.maximum(first[i:j], a), np.minimum(last[i:j], b)
+            counts = np.maximum(hi - lo, 0)
+            pulse = np.repeat(np.arange(i, j), counts)
+            k = np.repeat(lo - np.cumsum(counts) + counts, counts)
+            k += np.arange(len(k))
+
+            u = (start + k * dt - x0[pulse]) / (x1 - x0)[pulse]
+            values = np.empty(len(u))
+
+            for g in np.unique(group[pulse]).tolist():
+                here = group[pulse] == g
+                y = shapes[g]
+                values[here] = np.interp(u[here], np.linspace(0, 1, len(y)), y)
+
+            values *= power[pulse]
+
+            # without any samples, bincount gives integers
+            total = np.bincount(k - a, weights=values, minlength=b - a)
+            return total.astype(np.float64, copy=False)
+
+        if chunksize is None:
+            return samples(0, n)
+
+        return (samples(a, min(a + chunksize, n)) for a in range(0, n, chunksize))
+
+    def save(self, path):
+        """
+        Saves the timeline as an uncompressed .npz file
+
+        """
+        meta = {**self.meta, "format": FORMAT, "version": VERSION, "length": len(self)}
+        input_string = meta.pop("input_string", "")
+
+        arrays = {
+            "meta": np.frombuffer(json.dumps(meta).encode(), np.uint8),
+            "input_string": np.frombuffer(input_string.encode(), np.uint8),
+            "strings_data": self.strings.data,
+            "strings_offsets": self.strings.offsets,
+            **{f"column_{name}": np.asarray(a) for name, a in self.columns.items()},
+        }
+
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads a timeline saved with save(). With mmap, the arrays
+        are mapped from the file (read-only) instead of being read.
+
+        """
+        arrays = load_npz(path, mmap=mmap)
+
+        try:
+            meta = json.loads(arrays.pop("meta").tobytes())
+        except KeyError:
+            raise ValueError(f"{path} is not a pulseplot timeline")
+
+        if meta.get("format") != FORMAT:
+            raise ValueError(f"{path} is not a pulseplot timeline")
+
+        if meta["version"] > VERSION:
+            raise ValueError(
+                f"{path} has version {meta['version']} of the timeline format, "
+                f"this version of pulseplot reads up to version {VERSION}"
+            )
+
+        meta["input_string"] = arrays.pop("input_string").tobytes().decode()
+        strings = StringTable(arrays.pop("strings_data"), arrays.pop("strings_offsets"))
+        columns = {k[len("column_") :]: v for k, v in arrays.items()}
+
+        # version 1 had no anchors (see parse_anchor)
+        if meta["version"] < 2:
+            columns["anchor"] = np.full(meta["length"], -1, np.int32)
+
+        return cls(columns, strings, meta)
+
+
+class Selection(object):
+    """
+    Rows of a timeline, selected with Timeline.select or PulseSeq.select.
+    Edits are applied to all the rows at once, and, for a selection from
+    a PulseSeq, to its elements as well. Iterating over a selection gives
+    the elements (for a PulseSeq) or the rows.
+
+    >>> gradients = sequence.select(channel=3, shape="grad")
+    >>> gradients.edit(facecolor="gray")
+    >>> gradients.scale(plen=0.5, power=2)
+
+    """
+
+    def __init__(self, timeline, rows=None, sequence=None):
+        self.timeline = timeline
+        self.rows = np.arange(len(timeline)) if rows is None else rows
+        self.sequence = sequence
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        if self.sequence is None:
+            return iter(self.rows.tolist())
+
+        return iter(self.elements)
+
+    def __and__(self, other):
+        return self._new(np.intersect1d(self.rows, other.rows))
+
+    def __or__(self, other):
+        return self._new(np.union1d(self.rows, other.rows))
+
+    def _new(self, rows):
+        return Selection(self.timeline, rows, self.sequence)
+
+    @property
+    def elements(self):
+        if self.sequence is None:
+            raise ValueError("The selection is not from a PulseSeq")
+
+        elements = self.sequence.elements
+        return [elements[i] for i in self.rows.tolist()]
+
+    @property
+    def start(self):
+        return self.timeline["x0"][self.rows]
+
+    @property
+    def end(self):
+        return self.timeline["x1"][self.rows]
+
+    def select(self, *predicates, **criteria):
+        """
+        Narrows the selection, see Timeline.select
+
+        """
+        timeline = self.timeline
+
+        mask = np.zeros(len(timeline), bool)
+        mask[self.rows] = True
+
+        for field, value in criteria.items():
+            mask &= timeline.where(field, value)
+
+        for predicate in predicates:
+            mask &= np.asarray(predicate(timeline), bool)
+
+        return self._new(np.flatnonzero(mask))
+
+    def edit(self, **values):
+        """
+        Sets parameters of all the selected elements
+
+        """
+        self._apply(values, {})
+
+        return self
+
+    def scale(self, **factors):
+        """
+        Multiplies numeric parameters (plen, power, ...)
+        of all the selected elements
+
+        """
+        self._apply({}, factors)
+
+        return self
+
+    def _apply(self, values, factors):
+
+        changed = self.timeline.edit(self.rows, values, factors)
+
+        if self.sequence is None:
+            return
+
+        elements = self.elements
+        kinds = self.timeline["kind"][self.rows].tolist()
+
+        for field in changed:
+            if field in values and field not in KEYWORDS:
+                new = [values[field]] * len(elements)
+            else:
+                column = self.timeline[field][self.rows].tolist()
+                new = [self.timeline._value(field, v) for v in column]
+                if field in KEYWORDS:
+                    new = [json.loads(v) for v in new]
+
+            for element, kind, value in zip(elements, kinds, new):
+                # pulses have no time
+                if field == "time" and kind == PULSE:
+                    continue
+                setattr(element, field, value)
+
+        # the timeline was edited along with the elements,
+        # so it is still the compiled sequence
+        sequence = self.sequence
+        cached = sequence.__dict__.get("_timeline")
+        sequence.invalidate()
+
+        if cached is not None and cached[1] is self.timeline:
+            sequence._timeline = (sequence._timeline_key(), self.timeline)
+
+
+def _used_params(states, params):
+    """
+    The external parameters that the expressions of
+    the elements use, as numbers (for the metadata)
+
+    """
+    names = set()
+    for state in states:
+        for source in state.get("expressions", {}).values():
+            names |= compile_expression(source).names
+
+    used = {}
+    for name in names & set(params):
+        try:
+            used[name] = float(params[name])
+        except (TypeError, ValueError):
+            pass
+
+    return used
+
+
+def anchor_order(targets, names=None):
+    """
+    Orders the anchored elements (the keys of targets, a dict from
+    each anchored element to the one it is anchored to) so that every
+    element comes after its target. Raises a ValueError for cycles.
+
+    """
+    order, done = [], set()
+
+    for row in targets:
+        path, seen = [], set()
+
+        # follow the anchors until an element that is placed already
+        while row in targets and row not in done:
+            if row in seen:
+                cycle = path[path.index(row) :] + [row]
+                if names is not None:
+                    cycle = [names[i] for i in cycle]
+                raise ValueError(
+                    f"The anchors make a cycle: {' -> '.join(map(str, cycle))}"
+                )
+            seen.add(row)
+            path.append(row)
+            row = targets[row]
+
+        order.extend(reversed(path))
+        done.update(path)
+
+    return order
+
+
+def _missing(value):
+    return isinstance(value, float) and value != value
+
+
+def _name(shape):
+    """
+    The name of a shape without its parameters (gauss for gauss_0.5_0.1)
+
+    """
+    try:
+        return Shape(shape, 2).name
+    except ValueError:
+        return shape.split("_")[0]
+
+
+def _shape(element):
+    shape = element.shape
+
+    if shape is None or isinstance(shape, str):
+        return shape
+
+    name = shape_name(shape)
+    if name is None:
+        raise ValueError(
+            f"The shape of {element.args!r} is a function that is not registered, "
+            "register it with register_shape to save it"
+        )
+
+    return name
+
+
+def _unit_shape(name, npoints):
+    """
+    A shape (for a power of 1) on npoints points from 0 to 1
+
+    """
+    if name is None:
+        return np.ones(npoints)
+
+    return Shape(name, npoints).get_shape()
+
+
+def _keywords(kw):
+    """
+    A keyword dict as JSON, with the keys sorted so
+    that equal dicts make the same string
+
+    """
+    if not kw:
+        return "{}"
+
+    return json.dumps(kw, sort_keys=True)
+
+
+def _extra(element):
+    """
+    Parameters that have no column of their own, as JSON
+
+    """
+    extra = {k: v for k, v in vars(element).items() if k not in FIELDS}
+
+    if not extra:
+        return None
+
+    try:
+        return json.dumps(extra, sort_keys=True)
+    except TypeError as e:
+        raise ValueError(f"Cannot save the parameters of {element.args!r}: {e}")
+
+
+def _numbers(values):
+    """
+    A column of numbers as a list, with None for NaN
+
+    """
+    if np.isnan(values).any():
+        values = np.where(np.isnan(values), None, values)
+
+    return values.tolist()
+
+
+def _chunks(timeline, chunksize):
+    for i in range(0, len(timeline), chunksize):
+        yield timeline.table(i, i + chunksize)
+
+
+def _write_csv(f, timeline, chunksize):
+    writer = csv.writer(f)
+    writer.writerow(TABLE)
+
+    for table in _chunks(timeline, chunksize):
+        for name in ("channel", "start", "end", "power"):
+            table[name] = _numbers(table[name])
+        table["element"] = table["element"].tolist()
+
+        writer.writerows(zip(*table.values()))
+
+
+def _write_jsonl(f, timeline, chunksize):
+    line = ", ".join(f'"{name}": %s' for name in TABLE)
+    line = "{" + line + "}\n"
+    quoted = {None: "null"}
+
+    for table in _chunks(timeline, chunksize):
+        for name in ("kind", "shape", "phase", "name"):
+            column = table[name]
+            for s in set(column) - quoted.keys():
+                quoted[s] = json.dumps(s)
+            table[name] = [quoted[s] for s in column]
+
+        # JSON has no inf or nan, so they are written as null; each
+        # column is encoded at once and split into its values
+        for name in ("channel", "start", "end", "power"):
+            values = table[name]
+            values = np.where(np.isfinite(values), values, None).tolist()
+            table[name] = json.dumps(values, allow_nan=False)[1:-1].split(", ")
+        table["element"] = table["element"].tolist()
+
+        f.write("".join([line % row for row in zip(*table.values())]))
+
+
+def _write_npz(f, timeline, chunksize):
+    """
+    Writes the table into the archive one column at a time, chunk by
+    chunk, with strings as fixed-width unicode arrays
+
+    """
+    c = timeline.columns
+    n = len(timeline)
+
+    def column(name):
+        if name == "element":
+            return np.arange(n)
+        if name == "kind":
+            return np.array(KINDS)[c["kind"]]
+        if name in ("start", "end"):
+            return c["x0" if name == "start" else "x1"]
+        if name in ("channel", "power"):
+            return c[name]
+
+        # look the strings up in a small table of the distinct ones
+        codes, inverse = np.unique(c[name], return_inverse=True)
+        strings = [timeline.strings[i] or "" for i in codes.tolist()]
+        width = max(map(len, strings), default=0)
+
+        return np.array(strings, f"U{max(width, 1)}")[inverse.reshape(-1)]
+
+    with zipfile.ZipFile(f, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name in TABLE:
+            values = column(name)
+            header = {
+                "descr": np.lib.format.dtype_to_descr(values.dtype),
+                "fortran_order": False,
+                "shape": (n,),
+            }
+
+            with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                np.lib.format.write_array_header_2_0(member, header)
+                for i in range(0, n, chunksize):
+                    member.write(values[i : i + chunksize].tobytes())
+
+
+def load_npz(path, mmap=True):
+    """
+    Reads all arrays from an .npz file. Arrays that are stored without
+    compression are memory-mapped (read-only) if mmap is set, which
+    np.load does not do for .npz files.
+
+    """
+    arrays = {}
+
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[: -len(".npy")]
+
+            if not (mmap and info.compress_type == zipfile.ZIP_STORED):
+                data = BytesIO(archive.read(info))
+                arrays[name] = np.load(data, allow_pickle=False)
+                continue
+
+            # skip the local header of the member, its name and extra field
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if dtype.hasobject:
+                raise ValueError(f"{name} in {path} holds Python objects")
+
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype)
+            else:
+                arrays[name] = np.memmap(
+                    path,
+                    dtype=dtype,
+                    mode="r",
+                    offset=f.tell(),
+                    shape=shape,
+                    order="F" if fortran else "C",
+                )
+
+    return arrays
@@ -0,0 +1,250 @@
+"""
+Redraws a sequence file as it is edited
+
+A LiveSequence keeps a sequence drawn on a PulseProgram. When the text
+changes, only lines that have not been seen before are parsed, and only
+the elements from the first changed line onward are removed and drawn
+again, starting from the time and limits the axes had before them.
+
+    >>> fig, ax = pplot.subplots()
+    >>> timer = watch("sequence.seq", ax)
+    >>> pplot.show()
+
+"""
+
+import os
+import time
+from copy import copy
+
+from .parse import Delay, Pulse, PulseSeq
+
+
+def sequence_lines(text):
+    """
+    Splits a sequence into the lines that make elements,
+    with comments removed, as PulseSeq does
+
+    """
+    lines = [i for i in text.split("\n") if i.strip()]
+    return [i.split("#")[0] for i in lines if i.split("#")[0]]
+
+
+class LiveSequence(object):
+    """
+    A sequence drawn on a PulseProgram that is updated in place
+
+    """
+
+    def __init__(self, ax, params=None):
+        self.ax = ax
+        self.params = {**ax.params, **(params or {})}
+        self.lines = []
+
+        # parsed elements by line, and (time, limits) before each element
+        self._parsed = {}
+        self._states = []
+        self._anchored = False
+        self._first_index = len(ax.index)
+
+    def update(self, text):
+        """
+        Updates the drawing to the sequence in text. Returns the index
+        of the first element that was drawn again, or None if nothing
+        changed. If a line cannot be parsed, a ValueError is raised
+        (with the line), and the drawing is left as it was.
+
+        """
+        lines = sequence_lines(text)
+
+        first = 0
+        for old, new in zip(self.lines, lines):
+            if old != new:
+                break
+            first += 1
+
+        if first == len(lines) == len(self.lines):
+            return None
+
+        for line in lines[first:]:
+            self._parse(line)
+
+        # anchors can point to elements anywhere in the sequence,
+        # so sequences with anchors are drawn again in full
+        anchored = any(self._parsed[line].anchor for line in lines)
+        if anchored or self._anchored:
+            first = 0
+
+        elements = [self._element(line) for line in lines[first:]]
+
+        ax = self.ax
+        time, limits = (
+            self._states[first] if first < len(self._states) else (None, None)
+        )
+
+        anchors = {}
+        if anchored:
+            anchors = ax.resolve_anchors(PulseSeq(elements), time=time)
+
+        if time is not None:
+            ax.time, ax.limits = time, dict(limits)
+            ax.remove_elements(self._first_index + first)
+            del self._states[first:]
+
+        ax._hold_limits = True
+        try:
+            for i, element in enumerate(elements):
+                self._states.append((ax.time, dict(ax.limits)))
+                # delays are pulses too, drawn as pseq draws them
+                if i in anchors:
+                    ax.anchored(element, anchors[i])
+                else:
+                    ax.pulse(element)
+        finally:
+            ax._hold_limits = False
+            ax.set_limits()
+
+        drawn = ax.sequence.elements[:first] if ax.sequence else []
+        ax.sequence = PulseSeq(drawn + elements)
+        self.lines = lines
+        self._anchored = anchored
+
+        return first
+
+    def _parse(self, line):
+        """
+        Parses a line, the first time it is seen
+
+        """
+        if line not in self._parsed:
+            try:
+                parsed = Pulse(line, external_params=self.params)
+            except ValueError:
+                try:
+                    parsed = Delay(line, external_params=self.params)
+                except Exception as e:
+                    raise ValueError(f"Cannot read the line {line!r}: {e}")
+
+            # checked here, so that the drawing is not left half-updated
+            if isinstance(parsed, Pulse) and parsed.plen is None:
+                raise ValueError(f"The line {line!r} has no pulse length or delay")
+
+            self._parsed[line] = parsed
+
+    def _element(self, line):
+        """
+        Gets a fresh copy of the element for a line
+
+        """
+        parsed = self._parsed[line]
+
+        # drawing changes the element, so the parsed one is kept aside
+        element = copy(parsed)
+        for item in ["phase_kw", "text_kw", "style_kw"]:
+            setattr(element, item, dict(getattr(element, item)))
+
+        return element
+
+
+class FileWatcher(object):
+    """
+    Polls a file for changes (by its modification time and size,
+    and then its contents)
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._stat = None
+        self._text = None
+
+    def poll(self):
+        """
+        Returns the text of the file if it has changed since the
+        last poll (or on the first poll), and None otherwise
+
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        stat = (stat.st_mtime_ns, stat.st_size)
+        if stat == self._stat:
+            return None
+
+        self._stat = stat
+
+        with open(self.path) as f:
+            text = f.read()
+
+        if text == self._text:
+            return None
+
+        self._text = text
+
+        return text
+
+
+def watch(path, ax, params=None, interval=0.25, on_error=print):
+    """
+    Draws a sequence file on a PulseProgram, and redraws it whenever the
+    file changes, using a timer of the figure's canvas (so that it runs
+    in the event loop of an open figure). Returns the timer, which has
+    to be kept around for as long as the file should be watched.
+
+    """
+    live = LiveSequence(ax, params)
+    watcher = FileWatcher(path)
+
+    def check():
+        text = watcher.poll()
+        if text is None:
+            return
+
+        try:
+            if live.update(text) is not None:
+                ax.figure.canvas.draw_idle()
+        except ValueError as e:
+            on_error(f"{path}: {e}")
+
+    check()
+
+    timer = ax.figure.canvas.new_timer(interval=int(interval * 1000))
+    timer.add_callback(check)
+    timer.start()
+
+    return timer
+
+
+def watch_to(path, output, params=None, interval=0.25, dpi=150, report=print, **kw):
+    """
+    Draws a sequence file to an output file, and draws it again whenever
+    the sequence file changes, until interrupted. Other arguments are
+    passed on to pulseplot.render.new_figure.
+
+    """
+    from .pulseplot import PulseProgram
+    from .render import new_figure
+
+    fig = new_figure(**kw)
+    ax = fig.add_subplot(axes_class=PulseProgram)
+
+    live = LiveSequence(ax, params)
+    watcher = FileWatcher(path)
+
+    while True:
+        text = watcher.poll()
+
+        if text is not None:
+            t0 = time.perf_counter()
+            try:
+                first = live.update(text)
+            except ValueError as e:
+                report(f"{path}: {e}")
+            else:
+                if first is not None:
+                    fig.savefig(output, dpi=dpi)
+                    elapsed = time.perf_counter() - t0
+                    report(f"{output}: redrawn from element {first} in {elapsed:.2f} s")
+
+        time.sleep(interval)
@@ -7,7 +7,7 @@ from setuptools import setup, find_packages
 with open("README.md") as readme_file:
     readme = readme_file.read()
 
-requirements = ["numpy", "matplotlib"]
+requirements = ["numpy", "matplotlib>=3.6"]
 test_requirements = ["pytest>=3"]
 
 setup(
@@ -18,13 +18,12 @@ setup(
     long_description_content_type='text/markdown',
     author="Kaustubh R. Mote",
     author_email="kaustubh@gmail.com",
-    python_requires=">=3.7",
+    python_requires=">=3.8",
     classifiers=[
         "Intended Audience :: Science/Research",
         "Intended Audience :: Developers",
         "License :: OSI Approved :: BSD License",
         "Natural Language :: English",
-        "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
         "Topic :: Scientific/Engineering",
@@ -33,6 +32,7 @@ setup(
         "Operating System :: POSIX :: Linux",
     ],
     install_requires=requirements,
+    entry_points={"console_scripts": ["pulseplot=pulseplot.cli:main"]},
     include_package_data=True,
     packages=find_packages(include=["pulseplot"]),
     setup_requires=requirements,
@@ -0,0 +1,109 @@
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from pulseplot import PulseSeq
+from pulseplot.cache import RenderCache, cache_key, cached_render
+from pulseplot.cli import main
+
+
+def test_cache_key():
+
+    key = cache_key("p1 ph1\nd2 tx=a", fmt="png", dpi=100, spacing=0.1)
+
+    # only whitespace, comments and empty lines differ
+    same = cache_key(
+        "  p1   ph1  # comment\n\n  d2 tx=a  \n", fmt="png", dpi=100, spacing=0.1
+    )
+    assert key == same
+
+    assert key != cache_key("p1 ph2\nd2 tx=a", fmt="png", dpi=100, spacing=0.1)
+    assert key != cache_key("p1 ph1\nd2 tx=a", fmt="svg", dpi=100, spacing=0.1)
+    assert key != cache_key("p1 ph1\nd2 tx=a", fmt="png", dpi=200, spacing=0.1)
+    assert key != cache_key("p1 ph1\nd2 tx=a", fmt="png", dpi=100, spacing=0.2)
+    assert key != cache_key(
+        "p1 ph1\nd2 tx=a", {"x": 1}, fmt="png", dpi=100, spacing=0.1
+    )
+
+    seq = PulseSeq("p1 ph1\nd2 tx=a")
+    assert cache_key(seq) == cache_key(PulseSeq("p1   ph1\nd2 tx=a"))
+    assert cache_key(seq) != cache_key(PulseSeq("p1 ph1\nd3 tx=a"))
+
+
+def test_cached_render(tmp_path):
+
+    cache = RenderCache(tmp_path)
+
+    first = cached_render(r"p1 ph1 tx=$\tau$", fmt="svg", cache=cache)
+    assert (cache.hits, cache.misses, len(cache)) == (0, 1, 1)
+
+    again = cached_render(r"p1 ph1 tx=$\tau$", fmt="svg", cache=cache)
+    assert again == first
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+
+    # a hit does not import pyplot, or draw anything
+    script = (
+        "import sys\n"
+        "from pulseplot.cache import RenderCache, cached_render\n"
+        f"cache = RenderCache({str(tmp_path)!r})\n"
+        r"data = cached_render(r'p1 ph1 tx=$\tau$', fmt='svg', cache=cache)"
+        "\n"
+        "assert cache.hits == 1\n"
+        "assert 'matplotlib.pyplot' not in sys.modules\n"
+        "assert 'pulseplot.render' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+
+def test_eviction(tmp_path):
+
+    cache = RenderCache(tmp_path, maxsize=250)
+
+    for i in range(5):
+        cache.put(f"{i:02d}key", bytes(100))
+        os.utime(cache.entry(f"{i:02d}key"), (i, i))
+
+    # only the two most recent entries fit
+    assert cache.size() <= 250
+    assert len(cache) == 2
+    assert cache.get("04key") is not None
+    assert cache.get("00key") is None
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_concurrent_writes(tmp_path):
+
+    cache = RenderCache(tmp_path)
+    data = [bytes([i]) * 100_000 for i in range(8)]
+
+    def write_and_read(i):
+        cache.put("abkey", data[i])
+        return cache.get("abkey")
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(write_and_read, range(8)))
+
+    # readers only ever see a complete entry
+    assert all(result in data for result in results)
+    assert list(tmp_path.joinpath("ab").iterdir()) == [cache.entry("abkey")]
+
+
+def test_render_with_cache(tmp_path):
+
+    tmp_path.joinpath("a.seq").write_text("p1 ph1\nd2 tx=a")
+    cache_dir = tmp_path.joinpath("cache")
+
+    args = [str(tmp_path.joinpath("a.seq")), "-f", "png", "-f", "svg", "-j", "1"]
+    args += ["--cache", str(cache_dir)]
+
+    assert main(["render", *args]) == 0
+    assert len(RenderCache(cache_dir)) == 2
+
+    png = tmp_path.joinpath("a.png").read_bytes()
+    tmp_path.joinpath("a.png").unlink()
+
+    assert main(["render", *args]) == 0
+    assert tmp_path.joinpath("a.png").read_bytes() == png
@@ -0,0 +1,111 @@
+import json
+
+from pulseplot.cli import expand, main
+
+SPIN_ECHO = r"""
+p1 ph1 fc=black f1
+d10 tx=$\tau$ f1
+p2 ph2 f1
+d10 tx=$\tau$ f1
+p10 sp=fid phrec f1
+"""
+
+
+def _write_sequences(tmp_path):
+    seqdir = tmp_path.joinpath("seqs")
+    seqdir.mkdir()
+    seqdir.joinpath("echo.seq").write_text(SPIN_ECHO)
+    seqdir.joinpath("hahn.seq").write_text(SPIN_ECHO.replace("p2", "p2 fc=grey"))
+
+    params = tmp_path.joinpath("params.json")
+    params.write_text(json.dumps({"f1": 1}))
+
+    return seqdir, params
+
+
+def test_expand(tmp_path):
+    seqdir, _ = _write_sequences(tmp_path)
+
+    files, unmatched = expand([f"{seqdir}/*.seq", f"{seqdir}/echo.seq", "nothing*.seq"])
+    assert [f.split("/")[-1] for f in files] == ["echo.seq", "hahn.seq"]
+    assert unmatched == ["nothing*.seq"]
+
+
+def test_render(tmp_path):
+    seqdir, params = _write_sequences(tmp_path)
+    outdir = tmp_path.joinpath("out")
+
+    status = main(
+        ["render", f"{seqdir}/*.seq", "-p", str(params), "-o", str(outdir)]
+        + ["-f", "png", "-f", "svg", "--channels", "f1", "-j", "2"]
+    )
+
+    assert status == 0
+    assert sorted(p.name for p in outdir.iterdir()) == [
+        "echo.png",
+        "echo.svg",
+        "hahn.png",
+        "hahn.svg",
+    ]
+    assert outdir.joinpath("echo.png").read_bytes().startswith(b"\x89PNG")
+
+
+def test_render_errors(tmp_path, capsys):
+    seqdir, _ = _write_sequences(tmp_path)
+    seqdir.joinpath("bad.seq").write_text("p1 d1")
+
+    status = main(["render", f"{seqdir}/*.seq", "missing/*.seq", "-j", "1"])
+    err = capsys.readouterr().err
+
+    assert status == 1
+    assert "2 error(s)" in err
+    assert "bad.seq: ValueError: A combination of a Pulse and a Delay" in err
+    assert "missing/*.seq: no files match" in err
+    assert seqdir.joinpath("echo.png").exists()
+
+
+def test_render_same_names(tmp_path, capsys):
+    seqdir, _ = _write_sequences(tmp_path)
+    other = tmp_path.joinpath("other")
+    other.mkdir()
+    other.joinpath("echo.seq").write_text("p1 ph1")
+    outdir = tmp_path.joinpath("out")
+
+    status = main(
+        ["render", f"{seqdir}/echo.seq", f"{other}/echo.seq", "-o", str(outdir)]
+    )
+    err = capsys.readouterr().err
+
+    assert status == 1
+    assert f"{seqdir}/echo.seq: has the same output as {other}/echo.seq" in err
+    assert [p.name for p in outdir.iterdir()] == ["echo.png"]
+
+
+def test_render_timeout(tmp_path, capsys):
+    seqdir, _ = _write_sequences(tmp_path)
+
+    status = main(["render", f"{seqdir}/echo.seq", "-j", "1", "--timeout", "1e-6"])
+
+    assert status == 1
+    assert "timed out" in capsys.readouterr().err
+
+
+def test_render_pdf(tmp_path, capsys):
+    seqdir, params = _write_sequences(tmp_path)
+    seqdir.joinpath("bad.seq").write_text("p1 d1")
+    output = tmp_path.joinpath("library.pdf")
+
+    status = main(
+        ["render", f"{seqdir}/*.seq", "-p", str(params), "--pdf", str(output)]
+    )
+    err = capsys.readouterr().err
+
+    assert status == 1
+    assert "library.pdf: 2 page(s)" in err
+    assert "bad.seq: ValueError" in err
+    assert output.read_bytes().startswith(b"%PDF")
+    assert sorted(p.name for p in seqdir.iterdir()) == [
+        "bad.seq",
+        "echo.seq",
+        "hahn.seq",
+    ]
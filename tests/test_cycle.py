@@ -0,0 +1,99 @@
+import pickle
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+import pulseplot as pplot
+from pulseplot import PhaseCycle, PulseSeq, show_scan
+
+SEQUENCE = r"""
+p1 ph1 fc=black f1
+d2 tx=$\tau$ f1
+p2 ph2 f1
+d2 f1
+p4 sp=fid phrec f1
+"""
+
+CYCLE = {
+    "ph1": "x y -x -y",
+    "2": ["x", "x", "y", "y"],
+    "phrec": [0, 3, 2, 1, 2, 1, 0, 3],
+}
+
+
+def pixels(fig):
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba()).copy()
+
+
+def test_phase_cycle():
+    cycle = PhaseCycle(CYCLE)
+
+    assert cycle.labels == ["1", "2", "rec"]
+    assert len(cycle) == 8
+    assert cycle.expand(5).tolist() == [
+        ["x", "y", "-x", "-y", "x"],
+        ["x", "x", "y", "y", "x"],
+        ["x", "-y", "-x", "y", "-x"],
+    ]
+    assert len(PhaseCycle({"ph1": "x y y", "ph2": "x y"})) == 6
+
+    # quadrants as strings of digits or numpy integers
+    quadrants = ["x", "y", "-x", "-y"]
+    assert PhaseCycle({"ph1": "0 1 2 3"}).table["1"] == quadrants
+    assert PhaseCycle({"ph1": ["1", "5"]}).table["1"] == ["y", "y"]
+    assert PhaseCycle({"ph1": np.arange(4)}).table["1"] == quadrants
+    assert PhaseCycle({"ph1": [np.int8(3), "-x"]}).table["1"] == ["-y", "-x"]
+
+    with pytest.raises(ValueError):
+        PhaseCycle({"ph1": ""})
+
+
+def test_scans():
+    sequence = PulseSeq(SEQUENCE, phase_cycle=CYCLE)
+    view = sequence.scans()
+
+    assert len(view) == 8 and len(sequence.scans(3)) == 3
+    assert view.elements.tolist() == [0, 2, 4]
+    assert view.phases(1).tolist() == ["y", "x", "-y"]
+
+    # only the cycled elements are copied
+    scan = view[1]
+    assert scan.elements[1] is sequence.elements[1]
+    assert scan.elements[0] is not sequence.elements[0]
+    assert [scan.elements[i].phase for i in (0, 2, 4)] == ["_y", "_x", "_-y"]
+    assert sequence.elements[0].phase == "1"
+
+    with pytest.raises(IndexError):
+        view[8]
+
+    assert pickle.loads(pickle.dumps(sequence)).phase_cycle == CYCLE
+
+
+def test_scan_frames(tmp_path):
+    sequence = PulseSeq(SEQUENCE, phase_cycle=CYCLE)
+
+    fig, ax = pplot.subplots()
+    ax.avoid_overlaps = True
+    frames = sequence.scans().draw(ax)
+
+    assert len(frames) == 8 and all(len(labels) == 3 for labels in frames)
+    assert [label.get_text() for label in frames[3]] == ["-y", "y", "y"]
+    assert len(ax.patches) == len(sequence)
+
+    # each frame looks like the scan drawn on its own
+    for scan in (0, 3, 7):
+        show_scan(frames, scan)
+
+        alone, other = pplot.subplots()
+        other.avoid_overlaps = True
+        other.pseq(sequence.scans()[scan])
+
+        assert np.array_equal(pixels(fig), pixels(alone))
+        plt.close(alone)
+
+    ani = pplot.animation(fig, frames, interval=100)
+    ani.save(tmp_path / "scans.gif", writer="pillow", dpi=20)
+    assert (tmp_path / "scans.gif").stat().st_size > 0
+    plt.close(fig)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from pulseplot.expr import compile_expression, hide_expressions
+from pulseplot.parse import Delay, Pulse, PulseSeq
+
+PARAMS = {"p1": 2.0, "d10": 5.0, "p2": 1.0}
+
+
+def test_expressions():
+
+    expression = compile_expression("d10 - p2/2")
+    assert expression(PARAMS) == 4.5
+    assert expression.names == {"d10", "p2"}
+    assert compile_expression("d10 - p2/2") is expression
+
+    assert compile_expression("2*pi*max(p1, 3) + sqrt(4)")(PARAMS) == 6 * np.pi + 2
+
+    assert np.allclose(expression.evaluate_many({"d10": [5, 6], "p2": 1}), [4.5, 5.5])
+    assert np.allclose(
+        expression.evaluate_many([PARAMS, {"d10": 1, "p2": 4}]), [4.5, -1]
+    )
+
+    for bad in ["__import__('os')", "p1.real", "[p1]", "p1 p2", "10**10**10", "1/0"]:
+        with pytest.raises(ValueError):
+            compile_expression(bad)(PARAMS)
+
+    with pytest.raises(ValueError, match="p9"):
+        compile_expression("p9 + 1")(PARAMS)
+
+    # only the values of numeric parameters are expressions
+    line = r"p={2 * p1} tx=$\tau_{m}$ pkw={'color': 'r'}"
+    assert hide_expressions(line) == r"p={000000} tx=$\tau_{m}$ pkw={'color': 'r'}"
+
+
+def test_parse_expressions():
+
+    pulse = Pulse("p={2 * p1} pl{p2/4} f1 tx=$\\tau_{m}$", external_params=PARAMS)
+    assert (pulse.plen, pulse.power, pulse.text) == (4, 0.25, "$\\tau_{m}$")
+    assert pulse.expressions == {"plen": "2 * p1", "power": "p2/4"}
+
+    delay = Delay("d={d10 - p2/2}", external_params=PARAMS)
+    assert delay.time == delay.plen == 4.5
+
+    sequence = PulseSeq("p{d10} f1 pkw={'color': 'r'}\np1\nd2", external_params=PARAMS)
+    assert [e.plen for e in sequence.elements] == [5, 2, 2]
+    assert sequence.elements[1].expressions == {"plen": "p1"}
+    assert not hasattr(sequence.elements[2], "expressions")
+
+    with pytest.raises(ValueError, match="p9"):
+        PulseSeq("p={2*p9}", external_params=PARAMS)
+
+
+def test_sweep():
+
+    sequence = PulseSeq(
+        "p={2*p1} f1\nd={d10 - p2/2}\np1 f1\nd0.5", external_params=PARAMS
+    )
+
+    timelines = list(sequence.sweep({"d10": [5, 6, 7], "p1": 2, "p2": 1}))
+    assert [t.end for t in timelines] == [11, 12, 13]
+    assert np.allclose(timelines[1]["x0"], [0, 4, 9.5, 11.5])
+
+    # each set is placed as if the sequence were parsed with it
+    params = {"d10": 1, "p1": 1, "p2": 0}
+    (timeline,) = sequence.sweep([params])
+    parsed = PulseSeq(sequence.input_string, external_params=params).compile()
+    assert np.allclose(timeline["x1"], parsed["x1"])
+
+    # the sequence is not changed
+    assert sequence.compile().end == 11
+
+    # names that are not swept keep the values the sequence was parsed with
+    timelines = list(sequence.sweep({"d10": [5, 6, 7]}))
+    assert [t.end for t in timelines] == [11, 12, 13]
+    assert [t.end for t in sequence.sweep([{"p1": 1}])] == [8]
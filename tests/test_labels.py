@@ -0,0 +1,64 @@
+import numpy as np
+
+import pulseplot as pplot
+from pulseplot.labels import place_boxes
+
+SEQUENCE = "\n".join(f"p0.3 ph{i % 4} f1 tx=L{i}\nd0.1 tx=d{i}" for i in range(20))
+
+
+def overlapping(boxes):
+    return sum(
+        1 for i in range(len(boxes)) for j in range(i) if boxes[i].overlaps(boxes[j])
+    )
+
+
+def test_place_boxes():
+
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(0, 400, 200), rng.uniform(0, 100, 200)
+    width, height = np.full(200, 12.0), np.full(200, 6.0)
+
+    dx, dy = place_boxes(x, y, width, height)
+
+    # boxes that were moved do not overlap anything placed before them
+    x, y = x + dx, y + dy
+    moved = (dx != 0) | (dy != 0)
+    for i in np.flatnonzero(moved):
+        others = (np.abs(x - x[i]) < 12) & (np.abs(y - y[i]) < 6)
+        others[i] = False
+        assert not (others & moved).any()
+
+    # the result does not depend on the order of the boxes
+    order = rng.permutation(200)
+    dx2, dy2 = place_boxes(x[order] - dx[order], y[order] - dy[order], width, height)
+    assert np.array_equal(dx2, dx[order]) and np.array_equal(dy2, dy[order])
+
+    # boxes that do not overlap stay where they are
+    dx, dy = place_boxes([0, 20, 40], [0, 0, 0], [10, 10, 10], [5, 5, 5], pad=2)
+    assert not dx.any() and not dy.any()
+
+
+def test_avoid_overlaps():
+
+    for cache_labels in [False, True]:
+        fig, ax = pplot.subplots(figsize=(6, 2))
+        ax.cache_labels = cache_labels
+        ax.pseq(SEQUENCE)
+
+        fig.canvas.draw()
+        renderer = fig.canvas.get_renderer()
+        origins = [label.get_position() for label in ax._labels]
+        assert overlapping([a.get_window_extent(renderer) for a in ax._labels]) > 0
+
+        ax.avoid_overlaps = True
+        fig.canvas.draw()
+        placed = [label.get_position() for label in ax._labels]
+        assert overlapping([a.get_window_extent(renderer) for a in ax._labels]) == 0
+
+        # labels are placed from where they were put, the same way each time
+        ax.set_xlim(-5, 15)
+        fig.canvas.draw()
+        ax.set_xlim(ax.limits["xlow"], ax.limits["xhigh"])
+        fig.canvas.draw()
+        assert [label.get_position() for label in ax._labels] == placed
+        assert ax._label_origins == dict(zip(ax._labels, origins))
@@ -0,0 +1,90 @@
+import json
+import subprocess
+import sys
+
+from pulseplot.cli import main
+from pulseplot.lint import lint_text
+
+SEQUENCE = """p1 pl1 ph1 f1
+pX pl1
+d2 p1  # a pulse and a delay
+p1 pl1 xyz ph1 ph2
+p-1 sp=gaus
+tx=hello
+p1 pkw={a: 1}
+p1 pl=power
+"""
+
+
+def test_lint_text():
+
+    found = [(d.line, d.column, d.severity) for d in lint_text(SEQUENCE)]
+
+    assert found == [
+        (2, 1, "error"),
+        (3, 1, "error"),
+        (4, 8, "error"),
+        (4, 16, "warning"),
+        (5, 1, "warning"),
+        (5, 5, "warning"),
+        (6, 1, "error"),
+        (7, 4, "error"),
+        (8, 4, "error"),
+    ]
+
+    # external parameters are looked up like in the parser
+    params = {"pX": 2, "pl=power": 0.5, "p1": 1, "pl1": 0.5, "d2": 2}
+    assert len(lint_text(SEQUENCE, params)) == 7
+
+    assert [d.column for d in lint_text("p1 f1 an=middle:t1")] == [7]
+    expressions = "p={2 * p1}\np={2*p9}\nd{p1+}"
+    assert [d.line for d in lint_text(expressions, {"p1": 1})] == [2, 3]
+
+
+def test_lint_unresolved_names():
+
+    sequence = "p1 pl1 ph1 f1\nd10 tx=tau\np2 pl1 f2\np=2 pl=0.2\np0.5 pl={2*pl1}"
+
+    # without parameters, names are taken as they are written
+    assert [d.line for d in lint_text(sequence)] == [5]
+
+    found = [(d.line, d.column, d.severity) for d in lint_text(sequence, {})]
+    assert found == [
+        (1, 1, "warning"),
+        (1, 4, "warning"),
+        (2, 1, "warning"),
+        (3, 1, "warning"),
+        (3, 4, "warning"),
+        (5, 6, "error"),
+    ]
+
+    params = {"p1": 1, "pl1": 0.5, "d10": 2, "p2": 1}
+    assert lint_text(sequence, params) == []
+
+
+def test_lint_command(tmp_path, capsys):
+
+    good, bad = tmp_path / "good.seq", tmp_path / "bad.seq"
+    good.write_text("p1 ph1\nd2 tx=$\\tau$\np2 ph2 sp=gauss\n")
+    bad.write_text(SEQUENCE)
+
+    assert main(["lint", str(good), "-j", "1"]) == 0
+    assert main(["lint", str(tmp_path / "*.seq"), "-j", "2"]) == 1
+
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].startswith(f"{bad}:2:1: error:")
+    assert len(out) == 9
+
+    assert main(["lint", str(good), str(bad), "--format", "json", "-q"]) == 1
+    results = json.loads(capsys.readouterr().out)
+    assert [len(r["diagnostics"]) for r in results] == [9, 0]
+
+
+def test_lint_without_matplotlib():
+
+    code = (
+        "import sys; import pulseplot.cli, pulseplot.lint; "
+        "pulseplot.lint.lint_text('p1 ph1'); "
+        "assert 'matplotlib' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
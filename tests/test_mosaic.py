@@ -0,0 +1,72 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from pulseplot.mosaic import mosaic_cells, panel_pixels, render_mosaic
+from pulseplot.render import render
+
+ECHO = "p1 ph1 fc=black f1\nd2 tx=$\\tau$ f1\np2 ph2 f1\nd2 f1\np4 sp=fid phrec f1"
+
+
+def decoupling(ax):
+    ax.pseq("p1 pl1 f0 fck\np6 pl0.8 f1 h=//// fc=none")
+    ax.draw_channels(0, 1)
+
+
+def test_mosaic_cells():
+    spans, nrows, ncols = mosaic_cells("AB;CC")
+    assert spans == {"A": (0, 1, 0, 1), "B": (0, 1, 1, 2), "C": (1, 2, 0, 2)}
+    assert (nrows, ncols) == (2, 2)
+
+    assert mosaic_cells([["A", "A", "."], ["A", "A", "B"]])[0] == {
+        "A": (0, 2, 0, 2),
+        "B": (1, 2, 2, 3),
+    }
+
+    assert panel_pixels(spans, 2, 2, 101, 50) == {
+        "A": (0, 25, 0, 50),
+        "B": (0, 25, 50, 101),
+        "C": (25, 50, 0, 101),
+    }
+
+    with pytest.raises(ValueError, match="not a rectangle"):
+        mosaic_cells("AB;BA")
+
+    with pytest.raises(ValueError, match="same length"):
+        mosaic_cells("AB;C")
+
+
+def test_render_mosaic():
+    panels = {
+        "A": ECHO,
+        "B": {"sequence": ECHO, "spacing": 0.2, "params": {"f1": 0}},
+        "C": decoupling,
+    }
+
+    with ThreadPoolExecutor(3) as executor:
+        image = render_mosaic(
+            "AB;CC", panels, figsize=(4, 2), dpi=50, fmt="rgba", executor=executor
+        )
+
+    assert image.shape == (100, 200, 4) and image.dtype == np.uint8
+
+    # each tile is the panel as it would be drawn on its own
+    alone = render(ECHO, dpi=50, figsize=(100.5 / 50, 50.5 / 50))
+    alone = (plt.imread(BytesIO(alone)) * 255).round().astype(np.uint8)
+    assert np.array_equal(image[:50, :100], alone)
+    assert not np.array_equal(image[:50, 100:], alone)
+
+    # in worker processes, through shared memory
+    with ProcessPoolExecutor(2) as executor:
+        png = render_mosaic("AB;CC", panels, figsize=(4, 2), dpi=50, executor=executor)
+
+    assert np.array_equal((plt.imread(BytesIO(png)) * 255).round(), image)
+
+    with pytest.raises(ValueError, match="Nothing to draw on 'C'"):
+        render_mosaic("AB;CC", {"A": ECHO, "B": ECHO})
+
+    with ThreadPoolExecutor(2) as executor, pytest.raises(ValueError):
+        render_mosaic("AB", {"A": ECHO, "B": "p1 d1"}, executor=executor)
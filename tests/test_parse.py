@@ -1,4 +1,10 @@
-from pulseplot import PARAMS, Delay, Pulse, PulseSeq, parse_base
+import pickle
+from copy import copy
+
+import numpy as np
+import pytest
+
+from pulseplot import PARAMS, Delay, Pulse, PulseSeq, parse_base, register_shape
 
 test_string = r"""p1 pl1 ph1 f2
 d1 f1 tx$\\tau$
@@ -122,5 +128,57 @@ def test_pulse_seq():
     }
 
 
+def test_register_shape():
+    @register_shape("level")
+    def level(x, height=0.5):
+        return np.full_like(x, height)
+
+    assert np.allclose(Pulse("p1 sp=level").get_shape(5), 0.5)
+    assert np.allclose(Pulse("p1 pl2 sp=level_0.25").get_shape(5), 0.5)
+
+    with pytest.raises(ValueError):
+        register_shape("a_b", level)
+
+
+def test_pickle():
+
+    pseq = PulseSeq(test_string)
+    pseq.elements[0].shape = register_shape("square2", lambda x: x ** 2)
+    pseq.elements[3].phase_kw["color"] = "red"
+
+    # only non-default parameters are sent
+    assert pseq.elements[1].__getstate__() == {
+        "args": "d1 f1 tx$\\\\tau$",
+        "time": 1.0,
+        "plen": 1.0,
+        "channel": 1.0,
+        "text": "$\\\\tau$",
+    }
+    assert pseq.elements[0].__getstate__()["shape"] == "square2"
+
+    copied = pickle.loads(pickle.dumps(pseq))
+
+    for old, new in zip(pseq.elements, copied.elements):
+        assert type(new) is type(old)
+        assert set(vars(new)) == set(vars(old))
+        for key, value in vars(old).items():
+            if key != "shape":
+                assert vars(new)[key] == value
+
+    assert copied.elements[0].shape == "square2"
+    assert np.allclose(copied.elements[0].get_shape(), pseq.elements[0].get_shape())
+    assert copied.elements[3].phase_kw == {"color": "red"}
+    assert copied.elements[4].phase_kw is not copied.elements[5].phase_kw
+    assert copied.args == pseq.args
+    assert copied.named_elements == pseq.named_elements
+
+    # unregistered lambdas cannot be sent, but can still be copied
+    pulse = Pulse("p1", shape=lambda x: x)
+    assert copy(pulse).shape is pulse.shape
+
+    with pytest.raises(pickle.PicklingError):
+        pickle.dumps(pulse)
+
+
 if __name__ == "__main__":
     test_parse_base_4()
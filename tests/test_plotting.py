@@ -1,7 +1,9 @@
+from io import BytesIO
 from pathlib import Path
 
 import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.collections import PolyCollection
 import pulseplot as pplot
 from pulseplot import PulseSeq
 
@@ -86,5 +88,231 @@ def test_shaped_pulses():
     fig.savefig(TESTDIR.joinpath("test_shaped_pulses.png"))
 
 
+def test_shared_paths():
+    fig, ax = pplot.subplots()
+    ax.pseq(
+        r"""
+    p1 pl1 f0 fck
+    d1
+    p1 pl1 f2 fcr
+    p2 pl0.5 sp=grad f0
+    p2 pl0.5 sp=grad f2
+    """
+    )
+
+    # the delay is drawn as an invisible pulse of the same geometry
+    first, delay, second, grad1, grad2 = ax.patches
+    assert first.get_path() is second.get_path() is delay.get_path()
+    assert grad1.get_path() is grad2.get_path()
+    assert first.get_path() is not grad1.get_path()
+    assert len(ax._paths) == 2
+
+    # placement is done by the transform, not the vertices
+    x0, y0 = (first.get_transform() - ax.transData).transform((0, 0))
+    x1, y1 = (second.get_transform() - ax.transData).transform((0, 0))
+    assert np.allclose([x0, y0, x1, y1], [0, 0, 2, 2])
+
+
+def test_cached_labels():
+    from pulseplot.artists import LabelCache, LabelPatch
+
+    fig, ax = pplot.subplots()
+    ax.cache_labels = True
+    ax.fontsize = 12
+    ax.pseq(
+        r"""
+    p1 pl1 ph1 f1
+    d2 tx=$\tau$ f1
+    p1 pl1 ph1 f1
+    d2 tx=$\tau$ f1
+    p1 pl1 ph_x f1 tkw={'rotation':90} tx=rot
+    """
+    )
+
+    labels = [a for a in ax.patches if isinstance(a, LabelPatch)]
+    texts = [label.get_text() for label in labels]
+    assert texts == [r"$\phi_{1}$", r"$\tau$"] * 2 + ["x"]
+    assert labels[0].layout is labels[2].layout
+    assert labels[1].get_path() is labels[3].get_path()
+
+    # unsupported keywords fall back to a Text artist
+    assert [t.get_text() for t in ax.texts if t.get_text()] == ["rot"]
+
+    # the label is centered on its position like a Text would be
+    fig.canvas.draw()
+    x, y = ax.transData.transform(labels[1].get_position())
+    box = labels[1].get_window_extent()
+    assert np.allclose([box.x0 + box.x1, box.y0 + box.y1], [2 * x, 2 * y])
+
+    cache = LabelCache(maxsize=1)
+    from matplotlib.font_manager import FontProperties
+
+    prop = FontProperties(size=10)
+    assert cache.get("a", prop) is cache.get("a", prop)
+    cache.get("b", prop)
+    assert len(cache) == 1 and (cache.hits, cache.misses) == (1, 2)
+
+
+def test_culling():
+    fig, ax = pplot.subplots(figsize=(4, 2), dpi=100)
+    narrow = [r"p0.001 pl1 f0 fck ph1", r"d0.001"] * 300
+    ax.pseq("\n".join(narrow + [r"p5 pl1 f0 tx=long"]))
+
+    # without lod, the narrow pulses are all drawn
+    fig.canvas.draw()
+    assert ax.draw_stats["collapsed"] == 0
+
+    # zoomed out: the 300 narrow pulses are collapsed into an envelope
+    ax.lod = True
+    fig.canvas.draw()
+    assert ax.draw_stats["elements"] == 601
+    assert ax.draw_stats["collapsed"] > 0
+    assert ax.draw_stats["culled"] >= 300
+
+    # zoomed in on the last pulse, everything else is skipped
+    ax.set_xlim(3, 6)
+    drawn = []
+    for child in ax.get_children():
+        child.draw = lambda renderer, child=child: drawn.append(child)
+    fig.canvas.draw()
+
+    assert ax.draw_stats["collapsed"] == 0
+    assert ax.draw_stats["culled"] == 600
+    assert ax.patches[-1] in drawn
+    assert ax.patches[0] not in drawn
+
+    # the envelope is only there while drawing
+    assert not any(isinstance(a, PolyCollection) for a in ax.get_children())
+
+    ax.culling = False
+    drawn.clear()
+    fig.canvas.draw()
+    assert ax.patches[0] in drawn
+
+
+def test_lod_colours():
+    fig, ax = pplot.subplots(figsize=(4, 2), dpi=100)
+    ax.pseq("\n".join([r"p0.002 pl1 f0 fcr ecr", r"d0.002"] * 500))
+
+    def pixels():
+        buffer = BytesIO()
+        fig.savefig(buffer, format="png")
+        buffer.seek(0)
+        image = plt.imread(buffer)[..., :3]
+        return (image[..., 0] > 0.5) & (image[..., 1:].max(axis=-1) < 0.3)
+
+    red = pixels().sum()
+    assert red > 1000
+
+    # the envelope has the colour of the pulses it replaces
+    ax.lod = True
+    assert abs(pixels().sum() - red) < red / 4
+    assert ax.draw_stats["collapsed"] > 0
+
+
+def test_lazy_outlines():
+    from pulseplot.artists import ElementPatch
+
+    fig, ax = pplot.subplots(figsize=(4, 2), dpi=50)
+    ax.pseq(
+        r"""
+    p1 pl1 f0 sp=fid np=400
+    p20 pl1 f0 sp=fid np=400
+    """
+    )
+
+    short, long = ax.patches
+    assert isinstance(short, ElementPatch)
+    assert short.slot == (0, 0) and long.slot == (1, 0)
+
+    # nothing is built until the figure is drawn
+    assert short._path is None and len(ax._paths) == 0
+    fig.canvas.draw()
+    assert len(short.get_path()) == 400
+    assert len(ax._paths) == 2
+
+    # with adaptive points, the outline follows the size on the output
+    ax.clear()
+    ax.adaptive_npoints = True
+    ax.pseq(
+        r"""
+    p1 pl1 f0 sp=fid np=400
+    p20 pl1 f0 sp=fid np=400
+    """
+    )
+    short, long = ax.patches
+    fig.canvas.draw()
+    assert len(short.get_path()) < len(long.get_path()) <= 400
+
+    fig.savefig(BytesIO(), dpi=300)
+    assert len(long.get_path()) == 400
+
+
+def test_rasterization():
+    fig, ax = pplot.subplots(figsize=(4, 2), dpi=100)
+    single = [r"p1 pl1 f1 fck", r"p2 pl1 f1 sp=fid np=400", r"p2 pl1 f1 h=//// fc=none"]
+    ax.pseq("\n".join(single + [r"p0.2 pl1 f0 fck", r"d0.2"] * 20))
+
+    def svg():
+        buffer = BytesIO()
+        fig.savefig(buffer, format="svg")
+        return buffer.getvalue().decode()
+
+    vector = svg()
+    assert "<image" not in vector
+
+    ax.rasterize_vertices = 100
+    ax.rasterize_hatch = 4
+    ax.rasterize_train = 10
+    classes = sorted(ax.rasterize().values())
+    assert classes == ["dense", "hatched"] + ["train"] * 20
+    assert not ax.patches[0].get_rasterized()
+
+    # marked elements drawn one after the other go into one image
+    mixed = svg()
+    assert mixed.count("<image") == 1
+    assert len(mixed) < len(vector) / 5
+
+    ax.reset_style()
+    assert svg().count("<image") == 0
+    assert not any(patch.get_rasterized() for patch in ax.patches)
+
+    # rounded outlines look the same, with only the corners of rectangles
+    ax.vector_digits = 2
+    assert len(svg()) < len(vector) / 2
+    assert len(ax.patches[0].get_path()) == 103
+
+    png = BytesIO()
+    fig.savefig(png, format="png")
+    ax.vector_digits = None
+    expected = BytesIO()
+    fig.savefig(expected, format="png")
+
+    png.seek(0), expected.seek(0)
+    diff = np.abs(plt.imread(png).astype(float) - plt.imread(expected))
+    assert (diff > 0.25).mean() < 1e-3
+
+
+def test_rasterization_with_delays():
+    fig, ax = pplot.subplots(figsize=(4, 2), dpi=100)
+    ax.rasterize_vertices = 100
+    ax.rasterize_hatch = 4
+    ax.rasterize_train = 10
+
+    # delays drawn directly have only a label, or nothing at all
+    ax.delay("d2")
+    ax.pulse(r"p2 pl1 f1 sp=fid np=400")
+    ax.delay("d2 tx=tau")
+    ax.pulse(r"p2 pl1 f1 h=//// fc=none")
+
+    assert sorted(ax.rasterize().values()) == ["dense", "hatched"]
+    assert len(ax.index.patches()) == 2
+    assert len(ax.index.patches(2)) == 1
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format="svg")
+    assert buffer.getvalue().decode().count("<image") == 1
+
+
 if __name__ == "__main__":
     test_shaped_pulses()
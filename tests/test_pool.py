@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pulseplot as pplot
+from pulseplot.pool import FigurePool
+from pulseplot.render import render
+
+SEQUENCES = [
+    r"""
+    p1 ph1 fc=black
+    d1 tx=$\tau$
+    p2 ph2 sp=gauss pl1
+    """,
+    r"""
+    p5 pl0.5 ph_x f1 fc=red
+    d2
+    p2 ph2 sp=fid
+    """,
+]
+
+
+def test_clear_and_reset():
+
+    fig, ax = pplot.subplots()
+    new_limits = dict(ax.limits)
+
+    ax.spacing = 0.1
+    ax.params["p1"] = 2
+    ax.culling = False
+    ax.pseq("p1 ph1\nd2\np1 ph2")
+    ax.draw_channels(0)
+    ax.set_title("test")
+
+    ax.clear()
+    assert (ax.time, ax.sequence, ax.limits) == (0.0, None, new_limits)
+    assert ax.get_xlim() == (new_limits["xlow"], new_limits["xhigh"])
+    assert not ax.axison
+    assert (ax.spacing, ax.params, ax.culling) == (0.1, {"p1": 2}, False)
+
+    ax.pseq("p1 ph1\nd2\np1 ph2")
+    ax.set_title("test")
+    ax.reset()
+    assert (ax.time, ax.sequence, ax.limits) == (0.0, None, new_limits)
+    assert ax.get_xlim() == (new_limits["xlow"], new_limits["xhigh"])
+    assert len(ax.patches) == len(ax.texts) == len(ax.lines) == 0
+    assert ax.get_title() == ""
+    assert (ax.spacing, ax.params, ax.culling) == (0.0, {}, True)
+
+
+def test_pool_render():
+
+    pool = FigurePool(size=2, figsize=(4, 1))
+    options = dict(fmt="png", dpi=100, channels=[0], spacing=0.1)
+
+    # reused figures give the same output as new ones
+    for sequence in SEQUENCES:
+        fresh = render(sequence, figsize=(4, 1), **options)
+        assert pool.render(sequence, **options) == fresh
+        assert pool.render(sequence, **options) == fresh
+
+    buffer = pool.render_to(BytesIO(), SEQUENCES[0], fmt="svg")
+    assert buffer.getvalue().startswith(b"<?xml")
+
+    # a figure that was changed beyond the axes is replaced
+    with pool.figure() as (fig, ax):
+        fig.add_subplot(212)
+    assert pool.render(SEQUENCES[0], **options) == render(
+        SEQUENCES[0], figsize=(4, 1), **options
+    )
+    assert pool.free() == 2
+
+
+def test_pool_threads():
+
+    pool = FigurePool(size=3, figsize=(4, 1))
+    expected = [render(s, fmt="png", dpi=100, figsize=(4, 1)) for s in SEQUENCES]
+
+    def work(i):
+        return pool.render(SEQUENCES[i % 2], fmt="png", dpi=100)
+
+    with ThreadPoolExecutor(6) as threads:
+        results = list(threads.map(work, range(30)))
+
+    assert all(result == expected[i % 2] for i, result in enumerate(results))
+    assert pool.free() == 3
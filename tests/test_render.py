@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+
+import pulseplot as pplot
+from pulseplot.render import (
+    draw_sequence,
+    export,
+    new_figure,
+    render,
+    save,
+    save_many,
+    save_pdf,
+    size_report,
+)
+
+SEQUENCES = [f"p1 ph{i} fc=black\nd1 tx=$\\tau_{i}$\np2 sp=gauss pl1" for i in range(6)]
+
+
+def test_render_async():
+    async def main():
+        svg = await pplot.render_async(SEQUENCES[0], fmt="svg", figsize=(4, 1))
+        png = await pplot.render_async(
+            "p1 ph1 f1", {"p1": 2}, fmt="png", dpi=50, channels=[1]
+        )
+        return svg, png
+
+    svg, png = asyncio.run(main())
+
+    assert svg.startswith(b"<?xml")
+    assert png == render("p1 ph1 f1", {"p1": 2}, fmt="png", dpi=50, channels=[1])
+
+    with pytest.raises(ValueError):
+        asyncio.run(pplot.render_async("p1 d1"))
+
+
+def test_render_many():
+
+    expected = [render(s, fmt="png", dpi=50, figsize=(4, 1)) for s in SEQUENCES]
+
+    with ProcessPoolExecutor(2) as executor:
+        results = asyncio.run(
+            pplot.render_many(
+                SEQUENCES, fmt="png", dpi=50, figsize=(4, 1), executor=executor
+            )
+        )
+
+    assert results == expected
+
+
+def test_render_async_limit_and_cancel():
+
+    running, most = 0, 0
+    lock = threading.Lock()
+
+    class CountingExecutor(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            def job():
+                nonlocal running, most
+                with lock:
+                    running += 1
+                    most = max(most, running)
+                try:
+                    time.sleep(0.05)
+                    return fn(*args, **kwargs)
+                finally:
+                    with lock:
+                        running -= 1
+
+            return super().submit(job)
+
+    async def main(executor):
+        limit = asyncio.Semaphore(2)
+        tasks = [
+            asyncio.ensure_future(
+                pplot.render_async(s, dpi=20, executor=executor, limit=limit)
+            )
+            for s in SEQUENCES
+        ]
+
+        await asyncio.sleep(0.01)
+        tasks[-1].cancel()
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        # all slots are given back, including the cancelled one
+        await asyncio.sleep(0.1)
+        await asyncio.wait_for(asyncio.gather(limit.acquire(), limit.acquire()), 1)
+
+        return results
+
+    with CountingExecutor(8) as executor:
+        results = asyncio.run(main(executor))
+
+    assert isinstance(results[-1], asyncio.CancelledError)
+    assert all(isinstance(r, bytes) for r in results[:-1])
+    assert most == 2
+
+
+def test_size_report():
+    fig = new_figure(figsize=(4, 2))
+    sequence = "p2 pl1 f1 sp=fid np=2000\n" + "p0.2 pl1 f0\nd0.2\n" * 20
+    ax = draw_sequence(fig, sequence)
+    ax.rasterize_vertices = 100
+
+    report = size_report(fig, "pdf")
+    assert list(report) == ["dense", "total"]
+    assert report["dense"]["elements"] == 1
+    assert report["dense"]["saved"] == report["total"]["saved"] > 0
+
+    # the options are put back
+    assert ax.rasterize_vertices == 100 and "rasterize_train" not in ax.__dict__
+
+    ax.rasterize_train = 10
+    report = size_report(fig, "svg")
+    assert report["train"]["elements"] == 20
+    assert report["total"]["mixed"] < report["total"]["vector"]
+
+
+def test_save_many(tmp_path):
+    fig, alone = new_figure(figsize=(4, 2)), new_figure(figsize=(4, 2))
+    draw_sequence(fig, SEQUENCES[0])
+    draw_sequence(alone, SEQUENCES[0])
+    engine = fig.get_layout_engine()
+
+    png, png_hires, svg = save_many(fig, ["png", ("png", 100), "svg"], dpi=50)
+
+    # the first output is laid out as it would be on its own
+    assert png == save(alone, fmt="png", dpi=50)
+    assert png_hires.startswith(b"\x89PNG") and len(png_hires) > len(png)
+    assert svg.startswith(b"<?xml")
+    assert fig.get_layout_engine() is engine
+
+    with pytest.raises(ValueError):
+        save_many(fig, ["jpg"])
+
+    export(fig, [tmp_path / "a.png", (tmp_path / "b.png", 100), tmp_path / "a.pdf"])
+    a, b = (tmp_path / "a.png").read_bytes(), (tmp_path / "b.png").read_bytes()
+    assert a.startswith(b"\x89PNG") and len(a) > len(b) > len(png)
+    assert (tmp_path / "a.pdf").read_bytes().startswith(b"%PDF")
+
+
+def test_save_pdf():
+    errors = []
+    buffer = BytesIO()
+
+    pages = save_pdf(
+        {"first": SEQUENCES[0], "bad": "p1 d1", "second": SEQUENCES[1]},
+        buffer,
+        on_error=lambda key, e: errors.append(key),
+    )
+
+    assert pages == 2 and errors == ["bad"]
+    assert buffer.getvalue().startswith(b"%PDF") and b"/Count 2" in buffer.getvalue()
+
+    with pytest.raises(ValueError):
+        save_pdf(["p1 d1"], BytesIO())
@@ -0,0 +1,178 @@
+import asyncio
+import json
+
+from pulseplot.server import RenderServer
+
+
+async def request(method, path, body=b"", headers=None, port=None, socket=None):
+
+    if socket is not None:
+        reader, writer = await asyncio.open_unix_connection(socket)
+    else:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    headers = {"Content-Length": len(body), **(headers or {})}
+    head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+    head += "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+
+    writer.write(head.encode() + b"\r\n" + body)
+    await writer.drain()
+
+    response = await reader.read()
+    writer.close()
+
+    head, data = response.split(b"\r\n\r\n", 1)
+    status = int(head.split()[1])
+
+    return status, data
+
+
+def post(sequence, port, **fields):
+    body = json.dumps({"sequence": sequence, **fields}).encode()
+    headers = {"Content-Type": "application/json"}
+
+    return request("POST", "/render", body, headers, port=port)
+
+
+async def with_server(test, socket=None, **kwargs):
+
+    server = RenderServer(workers=1, figsize=(4, 1), **kwargs)
+    ready = asyncio.Event()
+    task = asyncio.create_task(server.serve(port=0, path=socket, ready=ready))
+
+    await ready.wait()
+    port = None if socket else server.sockets[0].getsockname()[1]
+
+    try:
+        await test(server, port)
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+def test_server():
+    async def test(server, port):
+
+        status, svg = await post(r"p1 ph1 tx=$\tau$", port, format="svg")
+        assert status == 200 and svg.startswith(b"<?xml")
+
+        # the second time, from the cache
+        assert await post(r"p1 ph1 tx=$\tau$", port, format="svg") == (200, svg)
+
+        # plain text, with the options in the query
+        status, png = await request(
+            "POST", "/render?format=png&dpi=50", b"p1 ph1\nd1\np2", port=port
+        )
+        assert status == 200 and png.startswith(b"\x89PNG")
+
+        status, params = await post(
+            "p1 ph1 f1", port, params={"p1": 2}, channels=[1], spacing=0.1
+        )
+        assert status == 200
+
+        # errors
+        assert (await post("p1 d1", port))[0] == 400
+        assert (await post("p1", port, format="gif"))[0] == 400
+        assert (await post("p1", port, colour="red"))[0] == 400
+        assert (await request("GET", "/render", port=port))[0] == 405
+        assert (await request("GET", "/nothing", port=port))[0] == 404
+
+        status, metrics = await request("GET", "/metrics", port=port)
+        metrics = metrics.decode()
+        assert status == 200
+        assert "pulseplot_queue_depth 0" in metrics
+        assert "pulseplot_cache_hits_total 1" in metrics
+        assert "pulseplot_render_seconds_count 3" in metrics
+        assert 'pulseplot_requests_total{status="400"} 3' in metrics
+
+    asyncio.run(with_server(test))
+
+
+def test_server_overload():
+
+    sequence = "\n".join(f"p1 ph{i} tx=a{i}\nd1" for i in range(50))
+
+    async def test(server, port):
+
+        results = await asyncio.gather(
+            post(sequence, port, dpi=100),
+            post(sequence, port, dpi=101),
+            post(sequence, port, dpi=102),
+        )
+        statuses = sorted(status for status, _ in results)
+        assert statuses == [200, 503, 503]
+
+        # identical requests share one render
+        results = await asyncio.gather(*[post(sequence, port, dpi=80)] * 3)
+        assert [status for status, _ in results] == [200] * 3
+        assert server.metrics.renders == 2
+
+    asyncio.run(with_server(test, max_renders=1, max_queue=0))
+
+
+def test_server_unix_socket(tmp_path):
+
+    socket = str(tmp_path.joinpath("pulseplot.sock"))
+
+    async def test(server, port):
+        status, data = await request("GET", "/health", socket=socket)
+        assert (status, data) == (200, b"ok\n")
+
+    asyncio.run(with_server(test, socket=socket))
+
+
+def test_server_timeout():
+
+    sequence = "\n".join(f"p1 ph{i} tx=a{i}\nd1" for i in range(200))
+
+    async def test(server, port):
+
+        status, _ = await post(sequence, port, dpi=300)
+        assert status == 504
+
+        # the worker is recycled, so its slot is free again
+        for _ in range(100):
+            if not server.running:
+                break
+            await asyncio.sleep(0.05)
+        assert server.running == 0
+
+        server.timeout = 30.0
+        assert (await post("p1", port))[0] == 200
+
+    asyncio.run(with_server(test, max_renders=1, max_queue=0, timeout=0.01))
+
+
+def test_server_limits():
+    async def test(server, port):
+
+        assert (await post("p1\nd1\np2", port))[0] == 413
+        assert (await post("p1 tx=" + "a" * 100, port))[0] == 413
+        assert (await post("p1 sp=fid np=20000", port))[0] == 422
+        assert (await post("p1 sp=fid np=100", port))[0] == 200
+
+    asyncio.run(with_server(test, max_elements=2, max_line=50, max_npoints=1000))
+
+
+def test_server_shape_files(tmp_path):
+
+    shapes = tmp_path.joinpath("shapes")
+    shapes.mkdir()
+    shapes.joinpath("gauss.txt").write_text("0\n1\n0\n")
+    tmp_path.joinpath("secret.txt").write_text("1\n2\n")
+
+    async def without_files(server, port):
+        shape = str(shapes.joinpath("gauss.txt"))
+        assert (await post(f"p1 sp=file:{shape}", port))[0] == 400
+
+    async def with_files(server, port):
+        assert (await post("p1 sp=file:gauss.txt", port))[0] == 200
+        assert (await post("p1 sp=file:../secret.txt", port))[0] == 400
+        assert (await post(f"p1 sp=file:{tmp_path}/secret.txt", port))[0] == 400
+        assert (await post("p1 sp=file:missing.txt", port))[0] == 400
+
+    asyncio.run(with_server(without_files))
+    asyncio.run(with_server(with_files, shape_dir=shapes))
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+import pulseplot as pplot
+from pulseplot import Pulse, PulseSeq
+from pulseplot import shapes
+from pulseplot.shapes import decimate, decimate_outline, read_shape
+
+AMPLITUDES = np.sin(np.linspace(0, np.pi, 1000)) * 50
+AMPLITUDES[123] = 100
+
+
+def test_decimate():
+
+    y = np.array([0, 5, 1, -3, 2, 2, 9, 0.0])
+
+    assert np.allclose(decimate(y, 4), [5, -3, 9, 0])
+    assert np.allclose(decimate(y, 5), [5, -3, 9, 0, 0])
+    assert np.allclose(decimate(np.arange(3.0), 5), [0, 0.5, 1, 1.5, 2])
+
+    # the single high point is kept
+    assert decimate(AMPLITUDES, 20).max() == 100
+
+
+def test_shape_files(tmp_path, monkeypatch):
+
+    with open(tmp_path / "shape.txt", "w") as f:
+        f.write("##TITLE= test shape\n##NPOINTS= 1000\n")
+        f.writelines(f"{a}, 0.0\n" for a in AMPLITUDES)
+
+    AMPLITUDES.astype(np.float32).tofile(tmp_path / "shape.f32")
+    np.save(tmp_path / "shape.npy", AMPLITUDES)
+
+    for name in ["shape.txt", "shape.f32", "shape.npy"]:
+        amplitudes, scale = read_shape(tmp_path / name)
+        assert np.allclose(amplitudes, AMPLITUDES, atol=1e-4)
+        assert np.isclose(scale, 100)
+
+    assert isinstance(read_shape(tmp_path / "shape.f32")[0], np.memmap)
+
+    monkeypatch.setattr(shapes, "SHAPE_PATH", [str(tmp_path)])
+    pulse = Pulse("p1 pl2 sp=file:shape.npy np=50")
+    assert len(pulse.get_shape()) == 50
+    assert pulse.get_shape().max() == 2
+
+    assert np.isclose(PulseSeq("p1 sp=file:shape.txt").waveform(0, 1 / 99).max(), 1)
+
+    outline = pulse.local_vertices()
+
+    # changed files are read again, and their outlines made again
+    np.save(tmp_path / "shape.npy", -AMPLITUDES)
+    assert read_shape("shape.npy")[0].min() == -100
+    assert pulse.local_vertices()[:, 1].min() == -outline[:, 1].max()
+
+    with pytest.raises(FileNotFoundError):
+        Pulse("p1 sp=file:missing.txt").get_shape()
+
+
+def test_decimate_outline():
+
+    x = np.linspace(0, 1, 2000)
+    y = np.sin(200 * x) * np.exp(-2 * x)
+
+    for method in ["minmax", "lttb"]:
+        xs, ys = decimate_outline(x, y, 50, method)
+
+        assert len(xs) <= 50
+        assert (xs[0], xs[-1]) == (0, 1)
+        assert np.all(np.diff(xs) > 0)
+        assert ys.max() > 0.9 and ys.min() < -0.9
+
+    with pytest.raises(ValueError):
+        decimate_outline(x, y, 50, "mean")
+
+    # the envelope of a fast oscillation is kept with few points,
+    # instead of being aliased into a slow one
+    pulse = Pulse("p2 np=20 troff")
+    pulse.shape = lambda x: np.sin(2 * np.pi * 37 * x)
+
+    def envelope(vertices):
+        x, y = vertices.T
+        part = np.minimum((x / 2 * 5).astype(int), 4)
+        return np.array([np.ptp(y[part == i]) for i in range(5)])
+
+    assert envelope(pulse.local_vertices()).min() < 0.5
+
+    for method in ["minmax", "lttb"]:
+        vertices = pulse.local_vertices(oversample=16, decimation=method)
+        assert len(vertices) == 20
+        assert envelope(vertices).min() > 1.8
+        assert np.allclose(vertices[[0, -1], 0], [0, 2])
+
+    fig, ax = pplot.subplots()
+    ax.oversample, ax.decimation = 8, "lttb"
+    ax.pseq("p10 sp=fid np=50")
+    fig.canvas.draw()
+
+    # the points picked from the oversampled fid are not evenly spaced
+    x = ax.patches[0].get_path().vertices[:, 0]
+    assert len(x) == 50
+    assert not np.allclose(np.diff(x), np.diff(x)[0])
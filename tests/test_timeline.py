@@ -0,0 +1,251 @@
+import csv
+import json
+import pickle
+
+import numpy as np
+import pytest
+
+import pulseplot as pplot
+from pulseplot.artists import ElementPatch
+from pulseplot.parse import Delay, PulseSeq, register_shape
+from pulseplot.timeline import Timeline
+
+SEQUENCE = """
+p1 ph1 n=first
+d2 tx=$\\tau$
+p2 ph_y w
+p1 pl0.5 c sp=gauss
+d0.4 c k
+p1 st=10 fc=red
+p1 c w  # comment
+"""
+
+
+def test_compile():
+
+    fig, ax = pplot.subplots()
+    ax.spacing = 0.1
+    ax.pseq(SEQUENCE)
+
+    timeline = Timeline.compile(SEQUENCE, spacing=0.1)
+    slots = [a.slot[0] for a in ax.patches if isinstance(a, ElementPatch)]
+
+    assert np.allclose(timeline["x0"], slots)
+    assert np.isclose(timeline.end, ax.time)
+    assert timeline.string_column("name")[0] == "first"
+
+
+def test_save_and_load(tmp_path):
+
+    sequence = PulseSeq(SEQUENCE)
+    sequence.save(tmp_path / "seq.npz")
+
+    timeline = Timeline.load(tmp_path / "seq.npz")
+    assert isinstance(timeline["x0"], np.memmap)
+    assert np.allclose(timeline["x0"], sequence.compile()["x0"])
+
+    loaded = PulseSeq.load(tmp_path / "seq.npz")
+    assert loaded.input_string == sequence.input_string
+    assert loaded.named_elements == {"first": 0}
+
+    # the elements are made when they are first used
+    assert "elements" not in vars(loaded)
+    assert len(pickle.loads(pickle.dumps(loaded))) == len(sequence)
+    assert isinstance(loaded.elements[1], Delay)
+    for a, b in zip(loaded.elements, sequence.elements):
+        assert vars(a) == vars(b)
+
+    # copies of the keyword dicts are not shared between elements
+    loaded.elements[0].text_kw["color"] = "red"
+    assert "color" not in loaded.elements[2].text_kw
+
+
+def test_load_version_1(tmp_path):
+
+    sequence = PulseSeq(SEQUENCE)
+    sequence.save(tmp_path / "seq.npz")
+
+    # a file from before anchors were added
+    with np.load(tmp_path / "seq.npz") as f:
+        arrays = dict(f)
+    meta = json.loads(arrays["meta"].tobytes())
+    arrays["meta"] = np.frombuffer(
+        json.dumps({**meta, "version": 1}).encode(), np.uint8
+    )
+    del arrays["column_anchor"]
+    np.savez(tmp_path / "old.npz", **arrays)
+
+    timeline = Timeline.load(tmp_path / "old.npz")
+    assert timeline.string_column("anchor") == [None] * len(sequence)
+    assert np.allclose(timeline["x0"], sequence.compile()["x0"])
+
+    # a newer version is not read
+    arrays["meta"] = np.frombuffer(
+        json.dumps({**meta, "version": 3}).encode(), np.uint8
+    )
+    np.savez(tmp_path / "new.npz", **arrays)
+    with pytest.raises(ValueError):
+        Timeline.load(tmp_path / "new.npz")
+
+
+def test_save_shapes_and_errors(tmp_path):
+
+    register_shape("half", lambda x: np.full_like(x, 0.5))
+    sequence = PulseSeq(["p1 sp=half", "p1 sp=gauss", "d1"])
+    sequence.elements[1].shape = lambda x: x
+
+    with pytest.raises(ValueError):
+        sequence.save(tmp_path / "seq.npz")
+
+    del sequence.elements[1]
+    sequence.save(tmp_path / "seq.npz")
+    loaded = PulseSeq.load(tmp_path / "seq.npz")
+    assert loaded.elements[0].shape == "half"
+    assert len(loaded.args) == 2
+
+    with pytest.raises(ValueError):
+        np.savez(tmp_path / "other.npz", x=np.zeros(3))
+        Timeline.load(tmp_path / "other.npz")
+
+
+def test_export(tmp_path):
+
+    sequence = PulseSeq(SEQUENCE)
+    timeline = sequence.compile(spacing=0.1)
+
+    for ext in ["csv", "jsonl", "npz"]:
+        sequence.export(tmp_path / f"seq.{ext}", spacing=0.1, chunksize=3)
+
+    with open(tmp_path / "seq.csv") as f:
+        rows = list(csv.DictReader(f))
+    with open(tmp_path / "seq.jsonl") as f:
+        lines = [json.loads(line) for line in f]
+    table = np.load(tmp_path / "seq.npz")
+
+    assert len(rows) == len(lines) == len(table["element"]) == len(sequence)
+    assert np.allclose([float(r["start"]) for r in rows], timeline["x0"])
+    assert np.allclose([line["end"] for line in lines], timeline["x1"])
+    assert np.allclose(table["end"], timeline["x1"])
+
+    assert lines[1]["kind"] == rows[1]["kind"] == table["kind"][1] == "delay"
+    assert lines[3]["shape"] == rows[3]["shape"] == table["shape"][3] == "gauss"
+    assert lines[1]["phase"] is None and rows[1]["phase"] == ""
+
+    # lines are strict JSON, without inf or nan
+    sequence = PulseSeq("p1 pl1e400 f1\nd1")
+    sequence.export(tmp_path / "inf.jsonl")
+    with open(tmp_path / "inf.jsonl") as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[0]["power"] is None and lines[1]["power"] == 1.0
+
+    with pytest.raises(ValueError):
+        sequence.export(tmp_path / "seq.txt")
+
+
+def test_waveform():
+
+    register_shape("linear", lambda x: x)
+    sequence = PulseSeq("p1 pl2 f1\nd1\np2 sp=linear f1\np1 f0 pl3\np1 st=0.5 f1")
+    wave = sequence.waveform(1, 0.25)
+
+    assert len(wave) == 20
+    assert np.allclose(wave[:6], [2, 2, 3, 3, 1, 1])
+    assert np.allclose(wave[8:16], np.arange(8) / 8)
+    assert np.allclose(wave[16:], 0)
+    assert np.allclose(sequence.waveform(0, 0.25)[16:], 3)
+
+    chunks = list(sequence.waveform(1, 0.25, chunksize=3))
+    assert len(chunks) == 7
+    assert np.allclose(np.concatenate(chunks), wave)
+
+    # a channel without pulses is all zeros, as floats
+    assert wave.dtype == np.float64
+    empty = PulseSeq("d1").waveform(1, 0.1)
+    assert empty.dtype == np.float64 and np.all(empty == 0)
+    assert all(c.dtype == np.float64 for c in sequence.waveform(5, 0.25, chunksize=3))
+
+    with pytest.raises(ValueError):
+        sequence.waveform(1, 0)
+
+
+def test_select(tmp_path):
+
+    sequence = PulseSeq(
+        "p1 ph1 f1 n=a\nd2 f1\np2 ph2 f2 sp=gauss_0.5_0.1\np3 f2 sp=gauss\nd1 f2 c"
+    )
+
+    assert len(sequence.select(channel=2)) == 3
+    assert len(sequence.select(channel=[1, 2], kind="pulse")) == 3
+    assert list(sequence.select(shape="gauss").rows) == [2, 3]
+    assert list(sequence.select(shape="gauss_0.5_0.1").rows) == [2]
+    assert list(sequence.select(phase=None, kind="delay").rows) == [1, 4]
+    assert list(sequence.select(plen=lambda v: v > 1.5).rows) == [1, 2, 3]
+    assert list(sequence.select(lambda t: t["x0"] >= 3).rows) == [2, 3, 4]
+
+    with pytest.raises(ValueError):
+        sequence.select(x0=1)
+
+    gaussians = sequence.select(shape="gauss")
+    gaussians.scale(plen=2).edit(facecolor="red", text_kw={"color": "b"})
+    sequence.select(kind="delay").scale(time=3)
+
+    assert [e.plen for e in sequence.elements] == [1, 6, 4, 6, 3]
+    assert [e.facecolor for e in gaussians] == ["red", "red"]
+    assert gaussians.elements[0].text_kw is not gaussians.elements[1].text_kw
+    assert sequence.elements[1].time == 6
+    assert not hasattr(sequence.elements[2], "time")
+
+    # the timing is the same as for the edited sequence compiled again
+    assert np.allclose(gaussians.timeline["x0"], sequence.compile()["x0"])
+    assert list(sequence.select(facecolor="red").rows) == [2, 3]
+
+    # timelines loaded from files are edited on copies of their columns
+    sequence.save(tmp_path / "seq.npz")
+    timeline = Timeline.load(tmp_path / "seq.npz")
+    timeline.select(channel=1).scale(plen=0.5)
+    assert np.allclose(timeline["x0"], [0, 0.5, 3.5, 7.5, 13.5])
+    assert timeline.to_sequence().elements[1].time == 3
+
+    # elements changed directly are compiled again after invalidate()
+    sequence.elements[0].phase = "2"
+    assert list(sequence.select(phase="1").rows) == [0]
+    sequence.invalidate()
+    assert list(sequence.select(phase="1").rows) == []
+    sequence.elements[1] = sequence.elements[0]
+    assert list(sequence.select(phase="2").rows) == [0, 1, 2]
+
+
+def test_anchors():
+
+    sequence = """
+    p1 f1 n=a
+    d2
+    p2 f1 n=echo
+    d3 n=tail
+    p1 f2 an=center:echo
+    p0.5 f2 an=before:a
+    p0.5 f2 an=after:tail+0.5
+    p0.4 f0 an=end:b
+    p1 f0 c an=start:echo n=b
+    """
+
+    timeline = Timeline.compile(sequence)
+    assert np.allclose(timeline["x0"][4:], [3.5, -0.5, 8.5, 3.6, 3])
+    assert timeline.end == 8
+
+    # anchored elements are drawn where the timeline places them
+    fig, ax = pplot.subplots()
+    ax.spacing = 0.1
+    ax.pseq(sequence)
+
+    timeline = Timeline.compile(sequence, spacing=0.1)
+    slots = [a.slot[0] for a in ax.patches if isinstance(a, ElementPatch)]
+
+    assert np.allclose(timeline["x0"], slots)
+    assert np.isclose(timeline.end, ax.time)
+
+    with pytest.raises(ValueError, match="a -> b -> a"):
+        Timeline.compile("p1 n=a an=b\np1 n=b an=start:a")
+
+    with pytest.raises(ValueError):
+        Timeline.compile("p1 an=after:nothing")
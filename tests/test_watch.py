@@ -0,0 +1,86 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+import pulseplot as pplot
+from pulseplot.watch import FileWatcher, LiveSequence
+
+LINES = [
+    "p1 pl1 ph1 f1",
+    "d2 tx=delay",
+    "p2 pl0.5 ph2 f0 c",
+    "p1 pl1 sp=gauss f1 w",
+    "d1 f1",
+    "p4 pl0.3 f0 fc=k n=last",
+]
+
+
+def pixels(ax):
+    ax.figure.canvas.draw()
+    return np.asarray(ax.figure.canvas.buffer_rgba()).astype(int)
+
+
+def check(live, text):
+    fig, ax = pplot.subplots()
+    ax.pseq(text)
+
+    assert live.ax.time == ax.time
+    assert live.ax.limits == ax.limits
+    assert len(live.ax.index) == len(ax.index)
+    assert np.array_equal(pixels(live.ax), pixels(ax))
+    assert live.ax.get_time(name="last") == ax.get_time(name="last")
+
+    plt.close(fig)
+
+
+def test_live_sequence():
+
+    fig, ax = pplot.subplots()
+    live = LiveSequence(ax)
+
+    assert live.update("\n".join(LINES)) == 0
+    check(live, "\n".join(LINES))
+
+    # nothing changed, comments and blank lines are ignored
+    assert live.update("\n".join(LINES) + "\n\n# comment") is None
+
+    edits = [
+        (4, LINES[:4] + ["d3 f1"] + LINES[5:]),
+        (2, LINES[:2] + ["p1 pl1 ph3 f0"] + LINES[2:]),
+        (1, LINES[:1] + LINES[3:]),
+        (0, ["d1"] + LINES),
+    ]
+
+    for first, lines in edits:
+        assert live.update("\n".join(lines)) == first
+        check(live, "\n".join(lines))
+
+    # anchors to elements further down are drawn again too
+    lines = ["p1 f1 an=end:last"] + lines
+    assert live.update("\n".join(lines)) == 0
+    check(live, "\n".join(lines))
+
+    lines = lines[:-1] + ["p5 pl0.3 f0 fc=k n=last"]
+    assert live.update("\n".join(lines)) == 0
+    check(live, "\n".join(lines))
+
+    # errors leave the drawing as it was
+    before = pixels(ax)
+    with pytest.raises(ValueError):
+        live.update("\n".join(lines + ["xyz"]))
+    assert np.array_equal(pixels(ax), before)
+
+
+def test_file_watcher(tmp_path):
+
+    path = tmp_path / "sequence.seq"
+    watcher = FileWatcher(path)
+
+    assert watcher.poll() is None
+
+    path.write_text("p1 pl1")
+    assert watcher.poll() == "p1 pl1"
+    assert watcher.poll() is None
+
+    path.write_text("p1 pl0.5")
+    assert watcher.poll() == "p1 pl0.5"